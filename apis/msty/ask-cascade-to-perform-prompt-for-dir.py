@@ -1,7 +1,24 @@
 import os
-import re
+import sys
+import json
+import time
+import hashlib
+import yaml
+import asyncio
 import anthropic
-from typing import Dict, Tuple
+from pathlib import Path
+
+# --- SHARED PIPELINE HELPERS ---
+# ai-labs/utils/content_pipeline is shared by the recraft and msty scripts; put ai-labs/utils on the path
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from content_pipeline.frontmatter import Frontmatter
+from content_pipeline.writes import BatchedWriter
+from content_pipeline.condense import prepare_content, summary_prompt
+from content_pipeline.generic import GenericDetector, PATTERNS_DIR
+from content_pipeline.scan import FrontmatterIndex, DEFAULT_INDEX_PATH
+from content_pipeline import log as logging_setup
+from content_pipeline.metrics import RunMetrics, httpx_event_hooks
+from content_pipeline import jobs as job_queue
 # ---
 # Load environment variables from .env file (for local development)
 from dotenv import load_dotenv
@@ -36,44 +53,64 @@ ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 # Use full version string (e.g. 'claude-3-7-sonnet-20250219') for production stability, or '-latest' alias for latest snapshot
 ANTHROPIC_MODEL = "claude-3-7-sonnet-latest"  # Supported as of May 2025; see doc chunk 45
 MAX_ATTEMPTS = 3
+# Files in flight at once; each holds at most one request open
+DEFAULT_CONCURRENCY = int(os.getenv("CASCADE_CONCURRENCY", "8"))
+# Processes to shard the files across (--workers), each with its own client and CONCURRENCY files in flight
+DEFAULT_WORKERS = int(os.getenv("CASCADE_WORKERS", "1"))
+# Body chars sent per file; longer bodies are condensed (headings, section openers, key sections)
+MAX_CONTENT_CHARS = int(os.getenv("CASCADE_MAX_CONTENT_CHARS", "24000"))
+# Bodies over this many chars are summarized map-reduce style first (0 = never; --batch only condenses)
+SUMMARIZE_OVER_CHARS = int(os.getenv("CASCADE_SUMMARIZE_OVER_CHARS", str(4 * MAX_CONTENT_CHARS)))
+# --batch mode: where the in-flight batch id and its file list are kept between runs (next to this
+# script, so a run resumed from another directory finds the same batch), and how often to poll
+BATCH_STATE_PATH = os.getenv("CASCADE_BATCH_STATE", str(Path(__file__).parent / ".cascade-batch-state.json"))
+BATCH_POLL_SECONDS = float(os.getenv("CASCADE_BATCH_POLL_SECONDS", "60"))
+# Per-request latency/token records (JSON lines, appended per run; "" = report only, no file)
+METRICS_PATH = os.getenv("CASCADE_METRICS_PATH", str(Path(__file__).parent / ".cascade-metrics.jsonl")) or None
+
+# Async client shared by all workers. The SDK reads ANTHROPIC_BASE_URL, so pointing it at a
+# local mock (python ai-labs/utils/content_pipeline/stubs.py anthropic) needs no code change.
+# The event hooks stamp time-to-first-byte and SDK retries on the request being measured (see metrics below).
+# --workers processes are spawned, so each one imports this module and builds its own client.
+client = anthropic.AsyncAnthropic(
+    api_key=ANTHROPIC_API_KEY,
+    http_client=anthropic.DefaultAsyncHttpxClient(event_hooks=httpx_event_hooks()),
+)
 
-client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
+# Shared structured logger (ai-labs/utils/content_pipeline/log.py): one info event per updated file,
+# --log-level debug for more, --log-format json / CONTENT_LOG_FILE for JSON-lines records
+log = logging_setup.get_logger('claude-fill')
 
-# Helper: Find all markdown files in a directory recursively
-def find_markdown_files(directory):
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.md'):
-                yield os.path.join(root, file)
+# Helper: Select the markdown files missing any REQUIRED_FIELDS from the shared frontmatter index
+# (ai-labs/utils/content_pipeline/scan.py). Only new/changed files have their frontmatter head re-read;
+# files without frontmatter count as missing every field (an empty block is added for them).
+def select_markdown_files(directory):
+    index = FrontmatterIndex(DEFAULT_INDEX_PATH)
+    try:
+        scanned = index.refresh(directory)
+        files = index.select(directory, missing_any=REQUIRED_FIELDS, require_frontmatter=False)
+        log.info('index', "{files} file(s) under {directory} ({read} re-read) | {missing} missing {fields}",
+                 files=scanned['files'], directory=directory, read=scanned['read'], missing=len(files),
+                 fields=list(REQUIRED_FIELDS))
+        return files
+    finally:
+        index.close()
 
-# Helper: Parse YAML frontmatter and return (frontmatter_dict, body_str)
-def parse_frontmatter(filepath) -> Tuple[Dict, str]:
+# Helper: Parse YAML frontmatter with the shared single-pass parser (ai-labs/utils/content_pipeline/frontmatter.py)
+# Returns a Frontmatter object; files without frontmatter get an empty block so fields can be added.
+def parse_frontmatter(filepath) -> Frontmatter:
     with open(filepath, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-    if not lines or not lines[0].startswith('---'):
-        return { }, ''.join(lines)
-    frontmatter_lines = []
-    body_start = None
-    for i, line in enumerate(lines[1:], 1):
-        if line.startswith('---'):
-            body_start = i + 1
-            break
-        frontmatter_lines.append(line)
-    frontmatter = yaml.safe_load(''.join(frontmatter_lines)) or {}
-    body = ''.join(lines[body_start:]) if body_start else ''
-    return frontmatter, body
-
-# Helper: Write YAML frontmatter and body back to file
-# This function writes all frontmatter fields as single-line, single-quoted strings with no YAML library or folding.
-def write_frontmatter(filepath, frontmatter, body):
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write('---\n')
-        for k, v in frontmatter.items():
-            # Escape single quotes by doubling them per YAML spec
-            val = str(v).replace("'", "''").replace('\n', ' ').strip()
-            f.write(f"{k}: '{val}'\n")
-        f.write('---\n')
-        f.write(body)
+        text = f.read()
+    return Frontmatter.parse(text) or Frontmatter.empty(text)
+
+# Helper: Write frontmatter and body back to file
+# Only the lines of fields that were set change; every other field and the body are written back untouched.
+# Goes through the shared atomic writer (temp file + rename, batched fsync); in dry-run mode it prints the diff instead.
+# `on_commit` runs on the writer thread once the new file has been renamed into place (the job queue
+# marks the fields done then, a SQLite commit that never blocks the event loop).
+async def write_frontmatter(filepath, frontmatter: Frontmatter, writer: BatchedWriter, on_commit=None):
+    await writer.write_async(filepath, frontmatter.render(), before=frontmatter.original_block(), after=frontmatter.block(),
+                             on_commit_in_thread=on_commit)
 
 # Helper: Load prompt from file for use as prompt_base
 # This function reads the copywriter prompt from the canonical markdown file
@@ -89,97 +126,429 @@ def load_prompt_base(prompt_path: str) -> str:
     with open(prompt_path, 'r', encoding='utf-8') as f:
         return f.read()
 
-# Detect generic/meta output
+# Detect generic/meta output with the shared precompiled detector (ai-labs/utils/content_pipeline/generic.py)
+# Patterns live in content_pipeline/generic_patterns/claude.txt; CASCADE_GENERIC_PATTERNS points at another list.
+# Values that are too short (< 10 chars), start with '{' or are not strings are generic too.
+GENERIC = GenericDetector.from_file(
+    os.getenv("CASCADE_GENERIC_PATTERNS", PATTERNS_DIR / "claude.txt"),
+    min_length=10, reject_prefixes=("{",), non_string_is_generic=True,
+)
+
 def is_generic(val):
-    if not isinstance(val, str):
-        return True
-    val_lower = val.lower().strip()
-    generic_patterns = [
-        r'placeholder',
-        r'example',
-        r'this is',
-        r'a simple json',
-        r'lede:',
-        r'image_prompt:',
-        r'to be added',
-        r'tbd',
-        r'n/a',
-        r'json object',
-        r'fill in',
-        r'empty',
-        r'describe',
-        r'template',
-        r'field',
-    ]
-    for pattern in generic_patterns:
-        if re.search(pattern, val_lower):
-            return True
-    # Too short or too meta
-    if len(val_lower) < 10 or val_lower.startswith('{'):
-        return True
-    return False
+    return GENERIC.is_generic(val)
 
-# Call Claude to fill missing fields, retrying if output is generic
-# NOTE: This uses the latest anthropic SDK (>=0.50.0), which supports the messages API.
-def fill_missing_fields(frontmatter, content, prompt_base):
-    missing = [f for f in REQUIRED_FIELDS if not frontmatter.get(f)]
+# Helper: The stable part of every request (copywriter prompt + examples) as a cached system block
+# Identical for every file and retry, so after the first request it is billed and processed as a cache read.
+# Anthropic only caches prefixes above a model-specific minimum (1024 tokens for Sonnet); shorter prompts just run uncached.
+def build_system_blocks(prompt_base):
+    instructions = (
+        f"""{prompt_base}\n\n***\nBAD EXAMPLES (do NOT do this):\n- 'This is a placeholder for the document's lead.'\n- 'This is a simple JSON object with only the lede and image_prompt fields.'\n- 'lede: ...'\n- 'image_prompt: ...'\n\nGOOD EXAMPLES:\n- lede: 'A sweeping overview of how citation processing can transform knowledge management, bridging the gap between scattered footnotes and a unified scholarly record.'\n- image_prompt: 'A tangled web of handwritten notes and digital citations converging into a single glowing registry, with lines connecting books, articles, and code.'\n***\n"""
+    )
+    return [{"type": "text", "text": instructions, "cache_control": {"type": "ephemeral"}}]
+
+# Helper: The per-file user message (only this part is re-processed on each request)
+def build_file_message(missing, content):
     quoted_missing = ', '.join([f'"{f}"' for f in missing])
-    prompt = (
-        f"""{prompt_base}\n\n***\nBAD EXAMPLES (do NOT do this):\n- 'This is a placeholder for the document's lead.'\n- 'This is a simple JSON object with only the lede and image_prompt fields.'\n- 'lede: ...'\n- 'image_prompt: ...'\n\nGOOD EXAMPLES:\n- lede: 'A sweeping overview of how citation processing can transform knowledge management, bridging the gap between scattered footnotes and a unified scholarly record.'\n- image_prompt: 'A tangled web of handwritten notes and digital citations converging into a single glowing registry, with lines connecting books, articles, and code.'\n***\nBelow is the content of the file for which you must generate the following field(s): {', '.join(missing)}.\n***\n{content}\n***\nReturn a JSON object with only these fields: {quoted_missing}. Do not include markdown, explanations, or extra text. Only output the JSON object.\n"""
+    return (
+        f"""Below is the content of the file for which you must generate the following field(s): {', '.join(missing)}.\n***\n{content}\n***\nReturn a JSON object with only these fields: {quoted_missing}. Do not include markdown, explanations, or extra text. Only output the JSON object.\n"""
     )
-    for attempt in range(1, MAX_ATTEMPTS + 1):
-        # anthropic >=0.50.0 uses messages.create()
-        response = client.messages.create(
+
+# Running token totals across the run, printed at the end (shows whether the system block is being cached)
+usage_totals = {"input_tokens": 0, "cache_creation_input_tokens": 0, "cache_read_input_tokens": 0, "output_tokens": 0}
+
+# Per-request metrics (ai-labs/utils/content_pipeline/metrics.py): wall time, TTFB, retries and tokens
+# for every live request, reported as p50/p95/p99 when the run ends
+metrics = RunMetrics(METRICS_PATH)
+
+def record_usage(usage, sample=None):
+    for key in usage_totals:
+        usage_totals[key] += getattr(usage, key, None) or 0
+    if sample is not None:
+        sample.tokens(
+            input_tokens=getattr(usage, "input_tokens", None),
+            output_tokens=getattr(usage, "output_tokens", None),
+            cached_tokens=getattr(usage, "cache_read_input_tokens", None),
+            cache_write_tokens=getattr(usage, "cache_creation_input_tokens", None),
+        )
+
+# Helper: Parse the JSON object out of a response's content blocks (None if it is not a mapping)
+def parse_model_output(content_blocks):
+    # The response content is a list of content blocks; get the text
+    text = "".join([block.text for block in content_blocks if hasattr(block, "text")])
+    try:
+        data = yaml.safe_load(text)
+    except Exception:
+        return None
+    return data if isinstance(data, dict) else None
+
+# Helper: One map/reduce step of a long file's summary
+async def summarize_with_claude(chunk, max_chars):
+    with metrics.track("anthropic.summarize") as sample:
+        response = await client.messages.create(
             model=ANTHROPIC_MODEL,
-            max_tokens=512,
-            temperature=0.7,
-            messages=[
-                {"role": "user", "content": prompt}
-            ]
+            max_tokens=max(256, max_chars // 3),
+            temperature=0.2,
+            messages=[{"role": "user", "content": summary_prompt(chunk, max_chars)}]
         )
-        # The response content is a list of content blocks; get the text
-        text = "".join([block.text for block in response.content if hasattr(block, "text")])
-        try:
-            data = yaml.safe_load(text)
-            # If the output is not a dict or missing fields, treat as generic
-            if not isinstance(data, dict) or any(is_generic(data.get(f, '')) for f in missing):
-                continue
-            return data
-        except Exception:
+        record_usage(response.usage, sample)
+    return "".join([block.text for block in response.content if hasattr(block, "text")])
+
+# Helper: Keep the body within MAX_CONTENT_CHARS so input cost stays flat however long the essay is
+async def condense_for_prompt(md_file, body, allow_summary=True):
+    summarize = summarize_with_claude if allow_summary and SUMMARIZE_OVER_CHARS else None
+    text, method = await prepare_content(body, MAX_CONTENT_CHARS, summarize, SUMMARIZE_OVER_CHARS or None)
+    if method != 'full':
+        log.info('condense', "{path}: body {before} -> {after} chars ({method})",
+                 path=md_file, before=len(body), after=len(text), method=method)
+    return text
+
+# Call Claude to fill missing fields, retrying if output is generic
+# NOTE: This uses the latest anthropic SDK (>=0.50.0), which supports the messages API and prompt caching.
+async def fill_missing_fields(frontmatter, content, system_blocks):
+    missing = [f for f in REQUIRED_FIELDS if not frontmatter.get(f)]
+    file_message = build_file_message(missing, content)
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        # anthropic >=0.50.0 uses messages.create(); the system block is served from the prompt cache
+        with metrics.track("anthropic.fill", attempt=attempt) as sample:
+            response = await client.messages.create(
+                model=ANTHROPIC_MODEL,
+                max_tokens=512,
+                temperature=0.7,
+                system=system_blocks,
+                messages=[
+                    {"role": "user", "content": file_message}
+                ]
+            )
+            record_usage(response.usage, sample)
+        data = parse_model_output(response.content)
+        # If the output is not a dict or missing fields, treat as generic
+        if data is None:
+            continue
+        reasons = GENERIC.check_many([data.get(f, '') for f in missing])
+        if any(reasons):
+            log.warning('retry', "Generic output (attempt {attempt}/{max_attempts}): {detail}", attempt=attempt,
+                        max_attempts=MAX_ATTEMPTS, detail="; ".join(f"{f} {r}" for f, r in zip(missing, reasons) if r))
             continue
+        return data
     # If all attempts fail, return empty values for missing fields
     return {f: '' for f in missing}
 
-def main(target_dir):
+def main(target_dir, dry_run=False, concurrency=DEFAULT_CONCURRENCY, mode="run", workers=1):
+    if workers > 1:
+        main_sharded(target_dir, dry_run, concurrency, mode, workers)
+    else:
+        asyncio.run(main_async(target_dir, dry_run, concurrency, mode))
+
+# Discovery feeds the job queue (skipped by --resume/--retry-failed); workers claim files from it
+def plan_jobs(jobs, target_dir, mode):
+    queued = job_queue.plan_run(jobs, mode, lambda: [(md_file, REQUIRED_FIELDS) for md_file in select_markdown_files(target_dir)])
+    log.info('jobs', "{queued} task(s) queued ({mode}) | {reclaimed} reclaimed from stopped runs",
+             queued=queued, mode=mode, reclaimed=jobs.reclaimed)
+
+def report_run(jobs, elapsed, concurrency, workers=1):
+    log.info('done', "{elapsed:.1f}s (concurrency: {concurrency}, workers: {workers}) | tokens: {token_text}",
+             elapsed=elapsed, concurrency=concurrency, workers=workers, tokens=dict(usage_totals),
+             token_text=lambda: ", ".join(f"{key} {value}" for key, value in usage_totals.items()))
+    job_queue.report_status(jobs, log, limit=0)
+
+# Live mode works through the durable job queue (ai-labs/utils/content_pipeline/jobs.py, queue
+# 'cascade:<resolved target_dir>', so runs on other directories keep their own tasks): one task per file and missing field, claimed under a lease, done once the file is on disk or failed
+# with the reason. mode is 'run' (discover + work), 'resume' (queued/interrupted tasks only),
+# 'retry_failed' (failures only) or 'status'. Several processes can share one queue.
+# With shard=(index, count) this is one --workers process (see main_sharded): the queue is already
+# planned, only the shard's files are claimed, and the token totals and metrics are returned unreported.
+async def main_async(target_dir, dry_run=False, concurrency=DEFAULT_CONCURRENCY, mode="run", shard=None, run_id=None):
+    jobs = job_queue.JobQueue(job_queue.queue_name("cascade", target_dir), shard=shard)
+    if mode == "status":
+        job_queue.report_status(jobs, log)
+        jobs.close()
+        await client.close()
+        return
+    if run_id:
+        metrics.run = run_id
     # Load the canonical prompt from the markdown file for use as prompt_base
     prompt_base = load_prompt_base(PROMPT_PATH)
-    for md_file in find_markdown_files(target_dir):
-        frontmatter, body = parse_frontmatter(md_file)
+    system_blocks = build_system_blocks(prompt_base)
+    writer = BatchedWriter(dry_run=dry_run)
+    started = time.monotonic()
+    if shard is None:
+        plan_jobs(jobs, target_dir, mode)
+    leases = asyncio.create_task(job_queue.renew_leases(jobs))
+    try:
+        await process_dir(system_blocks, writer, concurrency, jobs)
+    finally:
+        # Land any writes still pending in the current fsync batch (their commits mark tasks done),
+        # then hand back whatever is still held: an interrupted run or a dry run
+        leases.cancel()
+        await writer.aclose()
+        jobs.release_held()
+        await client.close()
+        if shard is None:
+            metrics.report(log)
+        metrics.close()
+    if shard is None:
+        report_run(jobs, time.monotonic() - started, concurrency)
+    jobs.close()
+    return {"usage": dict(usage_totals), "records": metrics.records}
+
+# Entry point of one --workers process
+def run_shard(shard, target_dir, dry_run, concurrency, run_id):
+    return asyncio.run(main_async(target_dir, dry_run, concurrency, "resume", shard, run_id))
+
+# --workers N: plan the queue once here, then run N processes that each claim one hash shard of the
+# files (own client, own event loop, CONCURRENCY files in flight) and merge their tokens and metrics
+# into this run's report. Each shard warms the prompt cache with its own first request.
+def main_sharded(target_dir, dry_run, concurrency, mode, workers):
+    jobs = job_queue.JobQueue(job_queue.queue_name("cascade", target_dir))
+    if mode == "status":
+        job_queue.report_status(jobs, log)
+        jobs.close()
+        return
+    plan_jobs(jobs, target_dir, mode)
+    jobs.reshard(workers)
+    started = time.monotonic()
+    try:
+        results = job_queue.run_shards(run_shard, workers, target_dir, dry_run, concurrency, metrics.run)
+        for result in results:
+            metrics.merge(result["records"])
+            for key, value in result["usage"].items():
+                usage_totals[key] += value
+        metrics.report(log)
+    finally:
+        metrics.close()
+    report_run(jobs, time.monotonic() - started, concurrency, workers)
+    jobs.close()
+
+async def process_dir(system_blocks, writer, concurrency, jobs):
+    # Bounded concurrency: CONCURRENCY workers claim files until the job queue is empty
+    # (queue calls run in a thread: under --workers they can wait on another process's lock)
+    async def worker(until_cached=False):
+        while True:
+            claimed = await jobs.aclaim()
+            if claimed is None:
+                return
+            md_file = claimed.path
+            try:
+                requested = await process_file(md_file, system_blocks, writer, jobs)
+            except Exception as e:
+                # One file's failure never stops the run: an API error (the SDK already retried
+                # 429/5xx), a file that is unreadable or gone since discovery, a bad answer
+                log.error('error', "{path}: {error}", path=md_file, error=str(e) or type(e).__name__)
+                await jobs.afail(md_file, e if str(e) else type(e).__name__)
+                continue
+            if until_cached and requested:
+                return
+
+    # The cache entry only exists once the first request has finished, so run files one at a
+    # time until one request has been made; otherwise every worker would write the cache at once.
+    await worker(until_cached=True)
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+async def process_file(md_file, system_blocks, writer, jobs):
+    # Returns True if the file needed a request to Claude
+    frontmatter = parse_frontmatter(md_file)
+    missing = [f for f in REQUIRED_FIELDS if not frontmatter.get(f)]
+    await jobs.adone(md_file, [f for f in REQUIRED_FIELDS if f not in missing])
+    if not missing:
+        return False
+    content = await condense_for_prompt(md_file, frontmatter.body)
+    new_vals = await fill_missing_fields(frontmatter, content, system_blocks)
+    updated = []
+    for field in missing:
+        if not is_generic(new_vals.get(field, '')):
+            frontmatter.set(field, new_vals[field])
+            updated.append(field)
+    await jobs.afail(md_file, "generic output", [f for f in missing if f not in updated])
+    if updated:
+        await write_frontmatter(md_file, frontmatter, writer, on_commit=lambda: jobs.done(md_file, updated))
+        log.info('update', "{path}: set {fields}", path=md_file, fields=updated)
+    return True
+
+# --- BATCH MODE (--batch) ---
+# Overnight backfills go through the Message Batches API instead: one job for every file with
+# missing fields, half the per-token price, no per-request latency. The batch id and the
+# custom_id -> file mapping are persisted to BATCH_STATE_PATH as soon as the batch is created,
+# so an interrupted run picks up the same batch. Applying results is idempotent: only fields
+# that are still empty are set, so re-running after a crash never overwrites anything.
+# Generic or errored results are resubmitted as a new batch, up to MAX_ATTEMPTS batches.
+
+# Helper: Stable custom_id for a file (the API allows [a-zA-Z0-9_-]{1,64})
+def batch_custom_id(md_file):
+    return hashlib.sha1(os.path.abspath(md_file).encode('utf-8')).hexdigest()[:32]
+
+def load_batch_state(state_path):
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def save_batch_state(state_path, state):
+    # Temp file + rename, so a crash never leaves half a state file
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, state_path)
+
+def collect_batch_items(target_dir):
+    items = {}
+    for md_file in select_markdown_files(target_dir):
+        frontmatter = parse_frontmatter(md_file)
         missing = [f for f in REQUIRED_FIELDS if not frontmatter.get(f)]
+        if missing:
+            items[batch_custom_id(md_file)] = {"path": os.path.abspath(md_file), "missing": missing}
+    return items
+
+async def submit_batch(items, system_blocks, state_path, attempt):
+    requests = []
+    for custom_id, item in items.items():
+        frontmatter = parse_frontmatter(item["path"])
+        # Condense only: a map-reduce summary would mean live (full-price) calls before the batch
+        content = await condense_for_prompt(item["path"], frontmatter.body, allow_summary=False)
+        requests.append({
+            "custom_id": custom_id,
+            "params": {
+                "model": ANTHROPIC_MODEL,
+                "max_tokens": 512,
+                "temperature": 0.7,
+                "system": system_blocks,
+                "messages": [{"role": "user", "content": build_file_message(item["missing"], content)}],
+            },
+        })
+    batch = await client.messages.batches.create(requests=requests)
+    state = {"batch_id": batch.id, "attempt": attempt, "items": items}
+    save_batch_state(state_path, state)
+    log.info('batch', "Submitted {batch_id} with {files} file(s) (attempt {attempt}/{max_attempts}); state in {state_path}",
+             batch_id=batch.id, files=len(requests), attempt=attempt, max_attempts=MAX_ATTEMPTS, state_path=state_path)
+    return state
+
+async def wait_for_batch(batch_id, poll_seconds):
+    while True:
+        batch = await client.messages.batches.retrieve(batch_id)
+        if batch.processing_status == "ended":
+            return batch
+        counts = batch.request_counts
+        log.info('batch', "{batch_id}: {status} ({processing} processing, {succeeded} succeeded, {errored} errored)",
+                 batch_id=batch_id, status=batch.processing_status, processing=counts.processing,
+                 succeeded=counts.succeeded, errored=counts.errored)
+        await asyncio.sleep(poll_seconds)
+
+async def apply_batch_results(state, writer):
+    """
+    Writes every usable result back to its file and returns the items that need another attempt.
+    """
+    retry = {}
+    seen = set()
+    async for entry in await client.messages.batches.results(state["batch_id"]):
+        item = state["items"].get(entry.custom_id)
+        if item is None:
+            continue
+        seen.add(entry.custom_id)
+        if entry.result.type != "succeeded":
+            log.warning('batch', "{path}: {result}", path=item['path'], result=entry.result.type)
+            retry[entry.custom_id] = item
+            continue
+        record_usage(entry.result.message.usage)
+        frontmatter = parse_frontmatter(item["path"])
+        # Only fields still empty: results that were already applied (or filled by hand since) are left alone
+        missing = [f for f in item["missing"] if not frontmatter.get(f)]
         if not missing:
             continue
-        new_vals = fill_missing_fields(frontmatter, body, prompt_base)
-        updated = False
-        for field in missing:
-            if not is_generic(new_vals.get(field, '')):
-                frontmatter[field] = new_vals[field]
-                updated = True
-        if updated:
-            write_frontmatter(md_file, frontmatter, body)
-            print(f"[UPDATE] {md_file}: set {', '.join([f for f in missing if f in new_vals and not is_generic(new_vals[f])])}")
+        data = parse_model_output(entry.result.message.content) or {}
+        reasons = GENERIC.check_many([data.get(f, '') for f in missing])
+        filled = [f for f, reason in zip(missing, reasons) if reason is None]
+        for field in filled:
+            frontmatter.set(field, data[field])
+        if filled:
+            await write_frontmatter(item["path"], frontmatter, writer)
+            log.info('update', "{path}: set {fields}", path=item['path'], fields=filled)
+        if len(filled) < len(missing):
+            retry[entry.custom_id] = {"path": item["path"], "missing": [f for f in missing if f not in filled]}
+    # Requests with no result line at all (should not happen) get another attempt too
+    for custom_id, item in state["items"].items():
+        if custom_id not in seen:
+            retry[custom_id] = item
+    return retry
+
+async def run_batch_mode(target_dir, dry_run=False, state_path=BATCH_STATE_PATH, poll_seconds=BATCH_POLL_SECONDS):
+    prompt_base = load_prompt_base(PROMPT_PATH)
+    system_blocks = build_system_blocks(prompt_base)
+    writer = BatchedWriter(dry_run=dry_run)
+    try:
+        state = load_batch_state(state_path)
+        if state:
+            log.info('batch', "Resuming {batch_id} (attempt {attempt}/{max_attempts}) from {state_path}",
+                     batch_id=state['batch_id'], attempt=state['attempt'], max_attempts=MAX_ATTEMPTS, state_path=state_path)
+        else:
+            items = collect_batch_items(target_dir)
+            if not items:
+                log.info('batch', "No files with missing fields.")
+                return
+            if dry_run:
+                # Submitting costs money; a dry run only lists what would go into the batch
+                for item in items.values():
+                    log.info('dry_run', "would request {fields} for {path}", path=item['path'], fields=item['missing'])
+                return
+            state = await submit_batch(items, system_blocks, state_path, attempt=1)
+        while True:
+            await wait_for_batch(state["batch_id"], poll_seconds)
+            retry = await apply_batch_results(state, writer)
+            # Land this batch's writes before the state file moves on past it
+            await asyncio.get_running_loop().run_in_executor(None, writer.flush)
+            if dry_run:
+                log.info('dry_run', "{files} file(s) would be resubmitted; state kept in {state_path}",
+                         files=len(retry), state_path=state_path)
+                return
+            if retry and state["attempt"] < MAX_ATTEMPTS:
+                state = await submit_batch(retry, system_blocks, state_path, attempt=state["attempt"] + 1)
+                continue
+            if retry:
+                log.error('batch', "Giving up on {files} file(s) after {attempts} batch(es):", files=len(retry), attempts=state['attempt'])
+                for item in retry.values():
+                    log.error('gave_up', "{path} ({fields})", path=item['path'], fields=item['missing'])
+            os.remove(state_path)
+            log.info('batch', "Done | tokens: {token_text}", tokens=dict(usage_totals),
+                     token_text=lambda: ", ".join(f"{key} {value}" for key, value in usage_totals.items()))
+            return
+    finally:
+        await writer.aclose()
+        await client.close()
 
 if __name__ == "__main__":
-    import sys
+    import argparse
+    parser = argparse.ArgumentParser(description="Fill missing lede/image_prompt fields with Claude.")
+    parser.add_argument("target_dir", nargs="?", help="directory of markdown files (defaults to TARGET_DIR)")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="print a unified diff of each frontmatter change instead of writing files")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help="files processed at once (default: %(default)s)")
+    parser.add_argument("--batch", action="store_true",
+                        help="submit all files with missing fields as one Message Batches job, poll, and apply the results (resumable)")
+    parser.add_argument("--batch-state", default=BATCH_STATE_PATH,
+                        help="where the in-flight batch id is kept (default: %(default)s)")
+    parser.add_argument("--poll-seconds", type=float, default=BATCH_POLL_SECONDS,
+                        help="seconds between batch status checks (default: %(default)s)")
+    # Live mode only: --batch keeps its own state in --batch-state
+    job_queue.add_arguments(parser, workers=DEFAULT_WORKERS)
+    logging_setup.add_arguments(parser)
+    args = parser.parse_args()
+    logging_setup.configure_from_args(args)
     # ---
     # Prefer user option at top of file; allow CLI override for advanced use
     # ---
-    if len(sys.argv) == 2:
-        target_dir = sys.argv[1]
-        print(f"[INFO] Using target directory from command-line argument: {target_dir}")
+    if args.target_dir:
+        target_dir = args.target_dir
+        log.info('info', "Using target directory from command-line argument: {target_dir}", target_dir=target_dir)
     else:
         target_dir = TARGET_DIR
-        print(f"[INFO] Using target directory from script option: {target_dir}")
+        log.info('info', "Using target directory from script option: {target_dir}", target_dir=target_dir)
     if not os.path.isdir(target_dir):
-        print(f"[ERROR] The directory '{target_dir}' does not exist or is not a directory.")
+        log.error('error', "The directory '{target_dir}' does not exist or is not a directory.", target_dir=target_dir)
         sys.exit(1)
-    main(target_dir)
\ No newline at end of file
+    if args.batch:
+        asyncio.run(run_batch_mode(target_dir, dry_run=args.dry_run, state_path=args.batch_state, poll_seconds=args.poll_seconds))
+    else:
+        main(target_dir, dry_run=args.dry_run, concurrency=max(1, args.concurrency), mode=args.jobs_mode,
+             workers=max(1, args.workers))
\ No newline at end of file
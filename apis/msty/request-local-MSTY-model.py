@@ -4,21 +4,69 @@ Script: request-local-MSTY-model.py
 Automates sending a content auditing/generation prompt to the local MSTY (Gemma) LLM API.
 
 - Reads the main copywriter prompt file
-- Iterates through all Markdown files in the target directory
+- Selects the Markdown files missing `lede` or `image_prompt` from the shared frontmatter index
+  (ai-labs/utils/content_pipeline/scan.py; only new/changed files have their frontmatter head read)
+- Queues them as per-file/per-field tasks in the durable job queue (ai-labs/utils/content_pipeline/jobs.py,
+  one queue per TARGET_DIR); --concurrency async workers claim them under a lease, sharing one keep-alive httpx
+  connection pool (match it to the server's OLLAMA_NUM_PARALLEL). A field is marked done once the
+  file is on disk, or failed with the reason. --resume finishes an interrupted run without re-walking,
+  --retry-failed reruns only the failures, --jobs-status shows the queue; several processes can
+  share one queue
+- With --workers N, shards the queued files by a stable hash of their path across N processes, each
+  with its own event loop, httpx client and --concurrency workers, and reports their merged metrics
+  and timings as one run (for a fast backend where one process's client overhead is the limit)
 - For any file missing `lede` or `image_prompt`, sends the prompt + file to the LLM
-- Updates the file with the generated fields
+- Sends the shared copywriter prompt prefix byte-for-byte identical in front of every file and
+  retry (with keep_alive), so the server's prompt (KV prefix) cache evaluates it once and each
+  request only pays for the file itself; every request is a plain, self-contained prompt, so the
+  model sees exactly what it would without the cache. The warm-up measures the saving
+  (prompt_eval_count of a repeat vs. the first evaluation)
+- Keeps each file's content within MAX_PROMPT_CHARS: longer files are condensed to their headings,
+  section openers and key sections; very long ones get a map-reduce summary from the model first
+- With --pack N, bins up to N short files into one request (under MAX_PROMPT_CHARS) that asks for
+  a JSON object keyed by file id; files whose entries come back missing or generic go back to the
+  job queue and are retried on their own (a file claimed for the second time is never packed)
+- Stops reading each streamed answer as soon as the first complete JSON object closes
+  (the request is aborted), and records time-to-result per file
+- Updates the file with the generated fields (atomic temp-file + rename writes)
+- With --dry-run, prints a unified diff of each frontmatter change instead of writing
+- Records every Ollama request (wall time, time to first streamed token, prompt/output tokens) in a
+  JSON-lines metrics file (METRICS_PATH) and reports p50/p95/p99 latency and tokens/s at the end
+- Logs through the shared structured logger (ai-labs/utils/content_pipeline/log.py): one info event
+  per file written, per-field and per-file timing detail at --log-level debug, JSON lines with
+  --log-format json
 
 This Python version is designed to be run from anywhere in the monorepo, using absolute paths for robustness.
 
 Usage:
-    python ai-labs/apis/msty/request-local-MSTY-model.py
+    python ai-labs/apis/msty/request-local-MSTY-model.py [--dry-run] [--concurrency N] [--pack N] [--workers N] [--resume | --retry-failed]
 """
 
 import os
 import sys
 import json
+import time
+import asyncio
+import argparse
 from pathlib import Path
-from urllib import request, error
+
+import httpx
+
+# --- SHARED PIPELINE HELPERS ---
+# ai-labs/utils/content_pipeline is shared by the recraft and msty scripts; put ai-labs/utils on the path
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from content_pipeline.frontmatter import Frontmatter
+from content_pipeline.writes import BatchedWriter
+from content_pipeline.json_stream import JsonObjectScanner
+from content_pipeline.packing import pack_bins
+from content_pipeline.condense import prepare_content, summary_prompt
+from content_pipeline.generic import GenericDetector, PATTERNS_DIR
+from content_pipeline.scan import FrontmatterIndex, DEFAULT_INDEX_PATH
+from content_pipeline import log as logging_setup
+from content_pipeline.metrics import RunMetrics, track
+from content_pipeline import jobs as job_queue
+
+log = logging_setup.get_logger('msty-fill')
 
 # --- CONFIGURATION ---
 MONOREPO_ROOT = Path(__file__).resolve()
@@ -30,44 +78,47 @@ while not (MONOREPO_ROOT / 'package.json').exists() or not all((MONOREPO_ROOT /
 PROMPT_FILE = MONOREPO_ROOT / 'content/lost-in-public/prompts/workflow/Ask-Local-LLM-to-Be-a-Copywriter.md'
 TARGET_DIR = MONOREPO_ROOT / 'content/lost-in-public/prompts/data-integrity'
 LLM_API_URL = os.environ.get('LOCAL_MODEL_API_SERVICE_MSTY', 'http://localhost:10100')
+LLM_MODEL = 'gemma3:1b'
+# Seconds to wait for each streamed chunk (prompt evaluation of a long file can take a while on CPU)
+LLM_READ_TIMEOUT = 120.0
+# Keep the model (and its prompt cache) loaded between requests
+LLM_KEEP_ALIVE = os.environ.get('MSTY_KEEP_ALIVE', '30m')
+# Warm the server's prompt cache with the shared copywriter prefix before the workers start (and log how much it saves)
+WARM_PREFIX_CACHE = os.environ.get('MSTY_WARM_PREFIX', '1') != '0'
+# Conservative max prompt size for the Gemma context window, in chars of file content per request
+MAX_PROMPT_CHARS = 16000
+# Files over this many chars are summarized map-reduce style by the model before the real request
+# instead of just condensed (0 = never summarize)
+SUMMARIZE_OVER_CHARS = int(os.environ.get('MSTY_SUMMARIZE_OVER_CHARS', str(4 * MAX_PROMPT_CHARS)))
+# Chunk summaries of one file run at most this many at once (the workers already share the server)
+SUMMARY_CONCURRENCY = 2
+# --pack: only files up to this many chars are packed together; longer ones always go alone
+PACK_MAX_FILE_CHARS = int(os.environ.get('MSTY_PACK_MAX_FILE_CHARS', '4000'))
+# Files processed at once; set to the server's parallel slots (OLLAMA_NUM_PARALLEL) to saturate it
+DEFAULT_CONCURRENCY = int(os.environ.get('MSTY_CONCURRENCY', os.environ.get('OLLAMA_NUM_PARALLEL', '4')))
+# Processes to shard the files across (--workers); 1 runs everything in this process
+DEFAULT_WORKERS = int(os.environ.get('MSTY_WORKERS', '1'))
+# Per-request latency/token records (JSON lines, appended per run); MSTY_METRICS_PATH='' turns the file off
+METRICS_PATH = os.environ.get('MSTY_METRICS_PATH', str(Path(__file__).parent / '.msty-metrics.jsonl')) or None
 
-# --- Helpers for YAML frontmatter ---
+# --- Helpers for YAML frontmatter (shared single-pass parser, see ai-labs/utils/content_pipeline/frontmatter.py) ---
 def extract_frontmatter(content):
     """
-    Extract YAML frontmatter from Markdown content using string parsing only.
-    Returns a dict or None.
-    """
-    if content.startswith('---'):
-        end = content.find('---', 3)
-        if end != -1:
-            fm = content[3:end].strip()
-            # Manual parse: only handles flat key: value pairs, no nesting or lists
-            result = {}
-            for line in fm.split('\n'):
-                if ':' in line:
-                    key, val = line.split(':', 1)
-                    result[key.strip()] = val.strip().strip('"').strip("'")
-            return result
-    return None
-
-def write_frontmatter_to_file(filepath, updated_frontmatter):
-    """
-    Overwrites the frontmatter in a Markdown file with the updated dict using string formatting only.
-    """
-    filepath = Path(filepath)
-    content = filepath.read_text(encoding='utf-8')
-    if content.startswith('---'):
-        end = content.find('---', 3)
-        if end != -1:
-            body = content[end+3:].lstrip('\n')
-        else:
-            body = content
-    else:
-        body = content
-    # Write keys in original order if possible
-    yaml_str = '\n'.join(f'{k}: {v}' for k, v in updated_frontmatter.items())
-    new_content = f"---\n{yaml_str}\n---\n\n{body}"
-    filepath.write_text(new_content, encoding='utf-8')
+    Parses YAML frontmatter from Markdown content using string parsing only.
+    Returns a Frontmatter object (order-preserving, lossless) or None.
+    """
+    return Frontmatter.parse(content)
+
+async def write_frontmatter_to_file(filepath, frontmatter, writer, on_commit=None):
+    """
+    Writes the document back with the updated frontmatter through the shared atomic writer
+    (temp file + rename, batched fsync), or prints the frontmatter diff in dry-run mode.
+    Only the changed frontmatter lines differ; all other fields and the body are kept byte-for-byte.
+    `on_commit` runs on the writer thread once the new file has been renamed into place (the job
+    queue's done() is a SQLite commit, kept off the event loop).
+    """
+    await writer.write_async(filepath, frontmatter.render(), before=frontmatter.original_block(), after=frontmatter.block(),
+                             on_commit_in_thread=on_commit)
 
 # --- Robustly extract JSON object from LLM response (handles code blocks, extra text, etc.) ---
 def extract_json_from_response(response_text):
@@ -101,134 +152,517 @@ def extract_json_from_response(response_text):
     except Exception:
         return {'lede': '', 'image_prompt': ''}
 
-# --- Recursively find all Markdown files in a directory ---
-def find_markdown_files(directory):
-    files = []
-    for root, _, filenames in os.walk(directory):
-        for fn in filenames:
-            if fn.endswith('.md'):
-                files.append(os.path.join(root, fn))
-    return files
+# --- Parse the id-keyed JSON object a packed request returns ---
+def parse_packed_response(response_text):
+    """
+    Returns {file_id: {field: value}} from a packed answer, or {} if it is not a JSON object.
+    """
+    start = response_text.find('{')
+    if start == -1:
+        return {}
+    try:
+        obj, _ = json.JSONDecoder().raw_decode(response_text[start:])
+    except ValueError:
+        return {}
+    return obj if isinstance(obj, dict) else {}
+
+# --- POST-PROCESSING CHECK FOR GENERIC OUTPUTS ---
+# Shared precompiled detector (ai-labs/utils/content_pipeline/generic.py); the pattern list is
+# content_pipeline/generic_patterns/local-model.txt unless MSTY_GENERIC_PATTERNS points elsewhere
+GENERIC = GenericDetector.from_file(os.environ.get('MSTY_GENERIC_PATTERNS', PATTERNS_DIR / 'local-model.txt'))
+
+# --- Select the Markdown files that need work, from the shared frontmatter index ---
+def select_markdown_files(directory):
+    """
+    Refreshes the index for `directory` (parallel os.scandir walk; frontmatter heads re-read
+    only for new/changed files) and returns the paths whose lede or image_prompt is blank.
+    """
+    index = FrontmatterIndex(DEFAULT_INDEX_PATH)
+    try:
+        started = time.monotonic()
+        scanned = index.refresh(directory)
+        files = index.select(directory, missing_any=('lede', 'image_prompt'))
+        log.info('index', "{files} file(s) under {directory} ({read} re-read) | {missing} missing lede/image_prompt | {elapsed:.2f}s",
+                 files=scanned['files'], directory=str(directory), read=scanned['read'], missing=len(files),
+                 elapsed=time.monotonic() - started)
+        return files
+    finally:
+        index.close()
+
+# --- Shared HTTP client for the Ollama API ---
+def make_llm_client(concurrency):
+    """
+    One httpx.AsyncClient for the whole run: a keep-alive pool sized to the concurrency level,
+    so every request reuses an open connection instead of a fresh TCP handshake.
+    The read timeout is per streamed chunk, not per request.
+    """
+    return httpx.AsyncClient(
+        base_url=LLM_API_URL.rstrip('/'),
+        limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+        timeout=httpx.Timeout(LLM_READ_TIMEOUT, connect=10.0),
+    )
+
+# --- Shared prompt prefix, evaluated once and reused through the server's prompt cache ---
+def build_shared_prefix(main_prompt):
+    """
+    The part of every request that is identical across files and retries: the copywriter prompt
+    plus the standing instructions. Anything file-specific goes in build_file_prompt().
+    """
+    return (
+        f"{main_prompt}\n\n***\nIMPORTANT: Do NOT use generic or placeholder text like 'Example citation', 'Example image', or any form of 'placeholder' or 'example'. Be creative, specific, and original. If you return generic or placeholder text, your output will be rejected and you will be asked again until you provide something vivid and creative.\n***\n"
+    )
+
+def build_file_prompt(missing, content, stern=False):
+    """
+    The per-file part of a request. On retries (stern=True) it leads with the sterner warning,
+    so the shared prefix, and its cached evaluation, stays the same for every attempt.
+    """
+    missing_fields_str = ', '.join(missing)
+    return_fields = ', '.join([f'\"{field}\"' for field in missing])
+    warning = (
+        "CRITICAL: You MUST NOT use generic or placeholder text. Your previous output was rejected for being generic. Provide only vivid, creative, and original language.\n***\n"
+        if stern else ''
+    )
+    return (
+        f"{warning}Below is the content of the file for which you must generate the following field(s): {missing_fields_str}.\n***\n"
+        f"{content}"
+        f"\n***\nReturn a JSON object with only the following fields: {return_fields}. Do not include markdown, explanations, or extra text. Only output the JSON object.\n"
+    )
+
+def build_pack_prompt(docs_by_id):
+    """
+    One request for several short files: each file is introduced by a '### FILE <id> ###' line
+    and its missing fields, and the answer is a single JSON object keyed by file id.
+    """
+    sections = []
+    for file_id, doc in docs_by_id.items():
+        sections.append(f"### FILE {file_id} ###\nMissing field(s): {', '.join(doc['missing'])}\n{doc['content']}\n")
+    ids = ', '.join(f'\"{file_id}\"' for file_id in docs_by_id)
+    return (
+        f"Below are {len(docs_by_id)} files. Each starts with a '### FILE <id> ###' line followed by the field(s) it is missing. Generate the missing field(s) for every file from that file's own content.\n***\n"
+        + ''.join(sections)
+        + f"***\nReturn a single JSON object keyed by file id ({ids}). Each value is an object with only that file's missing fields. Do not include markdown, explanations, or extra text. Only output the JSON object.\n"
+    )
+
+async def prime_prefix(client, prefix_text, metrics=None):
+    """
+    Evaluates `prefix_text` as a prompt of its own (generating a single token) and returns the
+    response JSON, or None if the request failed.
+    """
+    payload = {
+        'model': LLM_MODEL,
+        'prompt': prefix_text,
+        'stream': False,
+        'keep_alive': LLM_KEEP_ALIVE,
+        'options': {'num_predict': 1},
+    }
+    try:
+        with track(metrics, 'ollama.prefix') as sample:
+            sample.attempt()
+            resp = await client.post('/api/generate', json=payload)
+            sample.first_byte()
+            if resp.status_code == 200:
+                usage = resp.json()
+                sample.tokens(input_tokens=usage.get('prompt_eval_count'), output_tokens=usage.get('eval_count'))
+        if resp.status_code != 200:
+            log.warning('warning', "Prefix warm-up failed: {status} {reason}", status=resp.status_code, reason=resp.reason_phrase)
+            return None
+        return resp.json()
+    except (httpx.HTTPError, ValueError) as e:
+        log.warning('warning', "Prefix warm-up failed: {error}", error=repr(e))
+        return None
+
+async def warm_prefix_cache(client, prefix_text, metrics=None):
+    """
+    Loads the model (keep_alive) and fills the server's prompt cache with the shared prefix, then
+    sends it once more: the repeat's prompt_eval_count is what every per-file request pays for the
+    prefix. Each request still carries the full prefix text; nothing from this call is passed on,
+    so answers are the same with or without it. Returns (first, repeat) prompt_eval_count, or None.
+    """
+    first = await prime_prefix(client, prefix_text, metrics)
+    repeat = await prime_prefix(client, prefix_text, metrics) if first is not None else None
+    if repeat is None:
+        return None
+    counts = (first.get('prompt_eval_count'), repeat.get('prompt_eval_count'))
+    if None in counts:
+        log.info('prefix', "Shared prefix evaluated; the server reports no prompt_eval_count")
+    elif counts[1] < counts[0]:
+        log.info('prefix', "Shared prefix: {first} prompt tokens evaluated, {repeat} on a repeat (prompt cache reused)",
+                 first=counts[0], repeat=counts[1])
+    else:
+        log.warning('warning', "Shared prefix: {first} prompt tokens evaluated, {repeat} on a repeat; the server is "
+                    "not reusing its prompt cache", first=counts[0], repeat=counts[1])
+    return counts
 
 # --- Send prompt + file to Ollama LLM API (gemma3:1b) ---
-def get_llm_completion(prompt, file_content, file_path):
+async def get_llm_completion(client, prompt, file_content, file_path, parse=extract_json_from_response,
+                             metrics=None, attempt=1):
+    """
+    Streams one /api/generate answer. With `parse` set (the default), stops at the first complete
+    JSON object and returns parse(object_text); with parse=None, returns the whole answer text.
+    With a RunMetrics, the request is one 'ollama.generate' record: wall time, time to the first
+    streamed token, and tokens. Ollama reports token counts only in its final chunk; for an answer
+    cut off at the first JSON object, output tokens are the chunks streamed (one token each) and
+    input tokens are unknown.
+    """
     # Use the correct Ollama API endpoint and payload
     payload = {
-        'model': 'gemma3:1b',
+        'model': LLM_MODEL,
         'prompt': prompt,
+        'keep_alive': LLM_KEEP_ALIVE,
         # Optionally, you can include file_content or file_path in the prompt if needed
         # Ollama expects just 'prompt' and 'model' (see https://github.com/jmorganca/ollama/blob/main/docs/api.md)
     }
-    data = json.dumps(payload).encode('utf-8')
-    api_url = os.environ.get('LOCAL_MODEL_API_SERVICE_MSTY', 'http://localhost:10100')
-    endpoint = f"{api_url.rstrip('/')}/api/generate"
-    headers = {'Content-Type': 'application/json'}
-
-    try:
-        req = request.Request(endpoint, data=data, headers=headers, method='POST')
-        with request.urlopen(req, timeout=10) as resp:
-            # Ollama streams responses as JSON lines; collect all and concatenate
-            output = ""
-            for line in resp:
-                try:
-                    chunk = json.loads(line.decode('utf-8'))
-                    output += chunk.get('response', '')
+    with track(metrics, 'ollama.generate', label=str(file_path), attempt=attempt) as sample:
+        sample.attempt()
+        try:
+            async with client.stream('POST', '/api/generate', json=payload) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    raise RuntimeError(f'LLM API error: {resp.status_code} {resp.reason_phrase}')
+                # Ollama streams responses as JSON lines. Feed each token to the scanner and stop as soon
+                # as the first JSON object closes: leaving the `async with` closes the connection, which
+                # makes Ollama abort the rest of the generation.
+                parts = []
+                scanner = JsonObjectScanner() if parse is not None else None
+                async for line in resp.aiter_lines():
+                    try:
+                        chunk = json.loads(line)
+                    except ValueError:
+                        continue
+                    token = chunk.get('response', '')
+                    if token:
+                        sample.first_byte()
+                    parts.append(token)
+                    obj_text = scanner.feed(token) if scanner is not None else None
+                    if obj_text is not None:
+                        sample.tokens(output_tokens=len(parts))
+                        return parse(obj_text)
                     if chunk.get('done', False):
+                        sample.tokens(input_tokens=chunk.get('prompt_eval_count'), output_tokens=chunk.get('eval_count'))
                         break
-                except Exception:
-                    continue
-            # Extract atomic fields from the LLM output
-            return extract_json_from_response(output)
-    except error.HTTPError as e:
-        raise RuntimeError(f'LLM API error: {e.code} {e.reason}')
-    except error.URLError as e:
-        raise RuntimeError(f'LLM API connection error: {e.reason}')
+                if parse is None:
+                    return ''.join(parts)
+                # Stream ended without a complete object: fall back to extracting from the full output
+                return parse(''.join(parts))
+        except httpx.HTTPError as e:
+            raise RuntimeError(f'LLM API connection error: {e!r}')
+
+async def request_completion(client, prefix, request_prompt, file_content, label, parse=extract_json_from_response,
+                             metrics=None, attempt=1):
+    """
+    Sends one request: the shared `prefix` text, always identical, in front of `request_prompt`.
+    The server's prompt cache skips re-evaluating the prefix; the prompt itself is self-contained.
+    """
+    return await get_llm_completion(client, f"{prefix}{request_prompt}", file_content, label, parse=parse,
+                                    metrics=metrics, attempt=attempt)
 
 # --- Main logic ---
-def main():
-    main_prompt = PROMPT_FILE.read_text(encoding='utf-8')
-    md_files = find_markdown_files(TARGET_DIR)
-    # Set a conservative max prompt size for Gemma context window (e.g. 16000 chars)
-    MAX_PROMPT_CHARS = 16000
-    for file_path in md_files:
-        content = Path(file_path).read_text(encoding='utf-8')
-        frontmatter = extract_frontmatter(content)
-        if not frontmatter:
+async def summarize_with_llm(client, chunk, max_chars, metrics=None):
+    """One map/reduce step of a long file's summary (plain text, no shared prefix)."""
+    return await get_llm_completion(client, summary_prompt(chunk, max_chars), chunk, 'summary', parse=None, metrics=metrics)
+
+async def condense_for_prompt(doc, client, metrics=None):
+    """
+    The file text to put in the prompt: the frontmatter block plus the body, condensed or
+    summarized so the whole stays within MAX_PROMPT_CHARS.
+    """
+    frontmatter = doc['frontmatter']
+    block = frontmatter.original_block()
+    budget = max(MAX_PROMPT_CHARS - len(block), MAX_PROMPT_CHARS // 4)
+    summarize = None
+    if SUMMARIZE_OVER_CHARS:
+        summarize = lambda chunk, max_chars: summarize_with_llm(client, chunk, max_chars, metrics)
+    body, method = await prepare_content(
+        frontmatter.body, budget, summarize, SUMMARIZE_OVER_CHARS or None, concurrency=SUMMARY_CONCURRENCY,
+    )
+    if method != 'full':
+        log.info('condense', "{path}: body {before} -> {after} chars ({method})",
+                 path=doc['path'], before=len(frontmatter.body), after=len(body), method=method)
+    return block + body
+
+def load_candidate(file_path):
+    """Reads a file and returns its audit record, or None if it has no frontmatter or nothing missing."""
+    content = Path(file_path).read_text(encoding='utf-8')
+    frontmatter = extract_frontmatter(content)
+    if frontmatter is None:
+        return None
+    missing = [field for field in ('lede', 'image_prompt') if frontmatter.is_empty(field)]
+    if not missing:
+        return None
+    return {'path': file_path, 'content': content, 'frontmatter': frontmatter, 'missing': missing}
+
+async def plan_packed_jobs(claimed, pack_size, jobs):
+    """
+    Work for a batch of claimed files under --pack: bins (lists of audit records) of short files
+    under the MAX_PROMPT_CHARS budget, and plain paths for long files, bins of one and files on
+    their second claim (put back by a pack, or left by a stopped run). Files with nothing
+    missing are marked done.
+    """
+    planned = []
+    packable = []
+    for claim in claimed:
+        file_path = claim.path
+        if claim.attempts > 1:
+            planned.append(file_path)
             continue
-        # Identify missing or empty fields
-        missing = []
-        if not frontmatter.get('lede') or not frontmatter['lede'].strip():
-            missing.append('lede')
-        if not frontmatter.get('image_prompt') or not frontmatter['image_prompt'].strip():
-            missing.append('image_prompt')
-        if not missing:
+        doc = load_candidate(file_path)
+        if doc is None:
+            await jobs.adone(file_path)
             continue
-        print(f"[AUDIT] {file_path} is missing: {', '.join(missing)}")
-        try:
-            # Construct a focused prompt for only the missing fields
-            missing_fields_str = ', '.join(missing)
-            return_fields = ', '.join([f'\"{field}\"' for field in missing])
-            prompt_instructions = (
-                f"{main_prompt}\n\n***\nIMPORTANT: Do NOT use generic or placeholder text like 'Example citation', 'Example image', or any form of 'placeholder' or 'example'. Be creative, specific, and original. If you return generic or placeholder text, your output will be rejected and you will be asked again until you provide something vivid and creative.\n***\nBelow is the content of the file for which you must generate the following field(s): {missing_fields_str}.\n***\n"
-            )
-            prompt_suffix = (
-                f"\n***\nReturn a JSON object with only the following fields: {return_fields}. Do not include markdown, explanations, or extra text. Only output the JSON object.\n"
-            )
-
-            # --- POST-PROCESSING CHECK FOR GENERIC OUTPUTS ---
-            def is_generic_output(val):
-                if not isinstance(val, str):
-                    return False
-                val_lower = val.lower().strip()
-                generic_patterns = [
-                    'placeholder',
-                    'example',
-                    'this is a placeholder',
-                    'example citation',
-                    'example image',
-                    'sample',
-                    'to be added',
-                    'tbd',
-                    'n/a',
-                ]
-                for pattern in generic_patterns:
-                    if pattern in val_lower:
-                        return True
-                return False
-
-            # Wrap LLM completion with retry logic if output is generic
-            max_attempts = 3
-            attempt = 0
-            while attempt < max_attempts:
-                combined_prompt = f"{prompt_instructions}{content}{prompt_suffix}"
-                llm_result = get_llm_completion(combined_prompt, content, file_path)
-                lede_val = llm_result.get('lede', '')
-                image_prompt_val = llm_result.get('image_prompt', '')
-                if (is_generic_output(lede_val) or is_generic_output(image_prompt_val)):
-                    attempt += 1
-                    print(f"[WARNING] LLM returned generic output for lede or image_prompt (attempt {attempt}). Retrying with sterner warning.")
-                    # Strengthen the warning for subsequent attempts
-                    prompt_instructions = (
-                        f"{main_prompt}\n\n***\nCRITICAL: You MUST NOT use generic or placeholder text. Your previous output was rejected for being generic. Provide only vivid, creative, and original language.\n***\nBelow is the content of the file for which you must generate the following field(s): {missing_fields_str}.\n***\n"
-                    )
-                    continue
-                break
-            else:
-                print("[ERROR] LLM failed to provide creative output after multiple attempts. Using last output.")
-            llm_response = llm_result
-        except Exception as e:
-            print(f"[ERROR] LLM API failed for {file_path}: {e}")
+        if len(doc['content']) <= PACK_MAX_FILE_CHARS:
+            packable.append(doc)
+        else:
+            planned.append(file_path)
+    for bin_docs in pack_bins(packable, size=lambda d: len(d['content']), budget=MAX_PROMPT_CHARS, max_items=pack_size):
+        planned.append(bin_docs if len(bin_docs) > 1 else bin_docs[0]['path'])
+    return planned
+
+def plan_jobs(jobs, mode):
+    """Prepares the queue for this run (see job_queue.plan_run) and logs what is waiting."""
+    queued = job_queue.plan_run(jobs, mode, lambda: [(path, ['lede', 'image_prompt']) for path in select_markdown_files(TARGET_DIR)])
+    counts = jobs.counts()
+    log.info('jobs', "{queued} task(s) queued ({mode}) | {pending} pending | {reclaimed} reclaimed from stopped runs",
+             queued=queued, mode=mode, pending=counts['pending'], reclaimed=jobs.reclaimed)
+    return counts
+
+def report_run(jobs, files, timings, elapsed, concurrency, workers=1):
+    log.info('done', "Audit and fill for lede/image_prompt complete. {files} file(s) in {elapsed:.1f}s (concurrency: {concurrency}, workers: {workers})",
+             files=files, elapsed=elapsed, concurrency=concurrency, workers=workers)
+    job_queue.report_status(jobs, log, limit=0)
+    if timings:
+        ordered = sorted(timings)
+        log.info('timing', "time-to-result over {files} file(s): median {median:.2f}s | max {max:.2f}s",
+                 files=len(ordered), median=ordered[len(ordered) // 2], max=ordered[-1])
+
+async def main_async(dry_run=False, concurrency=DEFAULT_CONCURRENCY, pack_size=1, mode='run', shard=None, run_id=None):
+    """
+    Runs CONCURRENCY workers over one shared, keep-alive httpx client. Match the concurrency to
+    the server's parallel slots (OLLAMA_NUM_PARALLEL) to keep every slot busy.
+    `mode` is the job-queue mode: 'run' (discover + work), 'resume', 'retry_failed' or 'status'.
+    With `shard` = (index, count) this is one --workers process (see main_sharded): the queue is
+    already planned, only the shard's files are claimed, and the results are returned unreported.
+    """
+    jobs = job_queue.JobQueue(job_queue.queue_name('msty', TARGET_DIR), shard=shard)
+    if mode == 'status':
+        job_queue.report_status(jobs, log)
+        jobs.close()
+        return
+    main_prompt = PROMPT_FILE.read_text(encoding='utf-8')
+    # Shared prefix text, sent unchanged in front of every request
+    prefix = build_shared_prefix(main_prompt)
+    counts = plan_jobs(jobs, mode) if shard is None else jobs.counts()
+    writer = BatchedWriter(dry_run=dry_run)
+    # file path -> seconds until a usable answer (see process_file)
+    timings = {}
+    metrics = RunMetrics(METRICS_PATH, run=run_id)
+    started = time.monotonic()
+    leases = asyncio.create_task(job_queue.renew_leases(jobs))
+    try:
+        async with make_llm_client(concurrency) as client:
+            if WARM_PREFIX_CACHE and (counts['pending'] or counts['in_flight']):
+                await warm_prefix_cache(client, prefix, metrics)
+            # Every worker claims files until the job queue is empty (files a pack puts back included)
+            await asyncio.gather(*(worker(jobs, client, prefix, writer, timings, pack_size, metrics) for _ in range(concurrency)))
+    finally:
+        # Land any writes still pending in the current fsync batch (their commits mark tasks
+        # done), then hand back whatever is still held: an interrupted run or a dry run
+        leases.cancel()
+        await writer.aclose()
+        jobs.release_held()
+        if shard is None:
+            metrics.report(log)
+        metrics.close()
+    result = {'files': jobs.claimed, 'timings': list(timings.values()), 'records': metrics.records}
+    if shard is None:
+        report_run(jobs, jobs.claimed, result['timings'], time.monotonic() - started, concurrency)
+    jobs.close()
+    return result
+
+def run_shard(shard, dry_run, concurrency, pack_size, run_id):
+    """Entry point of one --workers process."""
+    return asyncio.run(main_async(dry_run, concurrency, pack_size, 'resume', shard, run_id))
+
+def main_sharded(dry_run, concurrency, pack_size, mode, workers):
+    """
+    Plans the queue once here, then runs `workers` processes that each claim one hash shard of the
+    files with their own client and --concurrency workers; their metrics and timings are merged
+    into this run's report.
+    """
+    jobs = job_queue.JobQueue(job_queue.queue_name('msty', TARGET_DIR))
+    if mode == 'status':
+        job_queue.report_status(jobs, log)
+        jobs.close()
+        return
+    plan_jobs(jobs, mode)
+    jobs.reshard(workers)
+    metrics = RunMetrics(METRICS_PATH)
+    started = time.monotonic()
+    try:
+        results = job_queue.run_shards(run_shard, workers, dry_run, concurrency, pack_size, metrics.run)
+        for result in results:
+            metrics.merge(result['records'])
+        metrics.report(log)
+    finally:
+        metrics.close()
+    report_run(jobs, sum(result['files'] for result in results),
+               [elapsed for result in results for elapsed in result['timings']],
+               time.monotonic() - started, concurrency, workers)
+    jobs.close()
+
+def main(dry_run=False, concurrency=DEFAULT_CONCURRENCY, pack_size=1, mode='run', workers=1):
+    if workers > 1:
+        main_sharded(dry_run, concurrency, pack_size, mode, workers)
+    else:
+        asyncio.run(main_async(dry_run, concurrency, pack_size, mode))
+
+async def worker(jobs, client, prefix, writer, timings, pack_size=1, metrics=None):
+    """
+    Claims files from the job queue (pack_size at a time) until it has nothing left and works
+    through them: a file path, or a bin of files for --pack. One job's failure never stops the worker.
+    Queue calls run in a thread (jobs.aclaim_many() etc.): under --workers they can wait on another
+    process's lock, which must not stall the other requests in flight.
+    """
+    while True:
+        claimed = await jobs.aclaim_many(pack_size)
+        if not claimed:
+            return
+        planned = await plan_packed_jobs(claimed, pack_size, jobs) if pack_size > 1 else [claim.path for claim in claimed]
+        for job in planned:
+            try:
+                if isinstance(job, list):
+                    await process_pack(job, jobs, client, prefix, writer, timings, metrics)
+                else:
+                    await process_file(job, jobs, client, prefix, writer, timings, metrics)
+            except Exception as e:
+                log.error('error', "Unexpected failure for {path}: {error}", error=str(e),
+                          path=lambda: job if not isinstance(job, list) else [str(d['path']) for d in job])
+                for file_path in ([job] if not isinstance(job, list) else [d['path'] for d in job]):
+                    await jobs.afail(file_path, e)
+
+async def process_pack(docs, jobs, client, prefix, writer, timings, metrics=None):
+    """
+    Fills several short files with one request. Files whose entry is missing, incomplete or
+    generic go back to the job queue, to be claimed as single-file jobs (which have their own retry loop).
+    """
+    docs_by_id = {f"f{i}": doc for i, doc in enumerate(docs, 1)}
+    log.info('pack', "{count} file(s) in one request: {names}", count=len(docs),
+             names=lambda: ', '.join(Path(d['path']).name for d in docs))
+    started = time.monotonic()
+    try:
+        results = await request_completion(
+            client, prefix, build_pack_prompt(docs_by_id), None, f"pack of {len(docs)}", parse=parse_packed_response,
+            metrics=metrics,
+        )
+    except Exception as e:
+        log.error('error', "Packed request failed ({error}); re-queueing its {count} file(s) one by one", error=str(e), count=len(docs))
+        for doc in docs:
+            await jobs.arelease(doc['path'])
+        return
+    elapsed = time.monotonic() - started
+    requeued = 0
+    entries = {}
+    for file_id, doc in docs_by_id.items():
+        entry = results.get(file_id)
+        entries[file_id] = {key: entry.get(key) for key in doc['missing']} if isinstance(entry, dict) else {}
+    # One detector scan over every value in the pack
+    candidates = [(file_id, value) for file_id, values in entries.items() for value in values.values()]
+    reasons = GENERIC.check_many([value for _, value in candidates])
+    rejected = {file_id for (file_id, _), reason in zip(candidates, reasons) if reason}
+    for file_id, doc in docs_by_id.items():
+        values = entries[file_id]
+        usable = bool(values) and file_id not in rejected and all(
+            isinstance(value, str) and value.strip() for value in values.values()
+        )
+        if not usable:
+            requeued += 1
+            await jobs.arelease(doc['path'])
             continue
-        updated = False
-        for key in missing:
-            if llm_response.get(key):
-                frontmatter[key] = llm_response[key]
-                updated = True
-                print(f"[UPDATE] {file_path}: set {key}")
-        if updated:
-            write_frontmatter_to_file(file_path, frontmatter)
-            print(f"[WRITE] Updated frontmatter in {file_path}")
-    print('[DONE] Audit and fill for lede/image_prompt complete.')
+        timings[doc['path']] = elapsed
+        frontmatter = doc['frontmatter']
+        for key, value in values.items():
+            frontmatter.set(key, value.strip())
+            log.debug('update', "{path}: set {key}", path=doc['path'], key=key)
+        await write_frontmatter_to_file(doc['path'], frontmatter, writer, on_commit=lambda path=doc['path']: jobs.done(path))
+        log.info('write', "Updated frontmatter in {path}", path=doc['path'], fields=list(values), elapsed=elapsed, packed=len(docs))
+    log.info('timing', "pack of {count}: result in {elapsed:.2f}s ({requeued} file(s) re-queued)",
+             count=len(docs), elapsed=elapsed, requeued=requeued)
+
+async def process_file(file_path, jobs, client, prefix, writer, timings, metrics=None):
+    """
+    Audits one file and, if lede/image_prompt are missing, asks the model for them and writes them back.
+    Fields already present are marked done at once; generated ones once the write lands; the rest failed.
+    """
+    # Identify missing or empty fields
+    doc = load_candidate(file_path)
+    if doc is None:
+        await jobs.adone(file_path)
+        return
+    frontmatter, missing = doc['frontmatter'], doc['missing']
+    await jobs.adone(file_path, [field for field in ('lede', 'image_prompt') if field not in missing])
+    log.info('audit', "{path} is missing: {missing}", path=file_path, missing=missing)
+    started = time.monotonic()
+    try:
+        content = await condense_for_prompt(doc, client, metrics)
+        # Construct a focused prompt for only the missing fields, behind the shared prefix
+        # (which the server's prompt cache has already evaluated).
+        stern = False
+
+        # Wrap LLM completion with retry logic if output is generic
+        max_attempts = 3
+        attempt = 0
+        requests_made = 0
+        while attempt < max_attempts:
+            llm_result = await request_completion(client, prefix, build_file_prompt(missing, content, stern), content, file_path,
+                                                  metrics=metrics, attempt=attempt + 1)
+            requests_made += 1
+            lede_val = llm_result.get('lede', '')
+            image_prompt_val = llm_result.get('image_prompt', '')
+            reasons = GENERIC.check_many([lede_val, image_prompt_val])
+            if any(reasons):
+                attempt += 1
+                detail = '; '.join(f"{field} {reason}" for field, reason in zip(('lede', 'image_prompt'), reasons) if reason)
+                log.warning('warning', "LLM returned generic output for lede or image_prompt (attempt {attempt}): {detail}. Retrying with sterner warning.",
+                            path=file_path, attempt=attempt, detail=detail)
+                # Strengthen the warning for subsequent attempts
+                stern = True
+                continue
+            break
+        else:
+            log.error('error', "LLM failed to provide creative output after multiple attempts. Using last output.", path=file_path)
+        llm_response = llm_result
+        # Time-to-result: from the first request to a usable answer, across all attempts
+        elapsed = time.monotonic() - started
+        timings[file_path] = elapsed
+        log.debug('timing', "{path}: result in {elapsed:.2f}s ({requests} request(s))",
+                  path=file_path, elapsed=elapsed, requests=requests_made)
+    except Exception as e:
+        log.error('error', "LLM API failed for {path}: {error}", path=file_path, error=str(e))
+        await jobs.afail(file_path, e)
+        return
+    updated = []
+    for key in missing:
+        if llm_response.get(key):
+            frontmatter.set(key, llm_response[key])
+            updated.append(key)
+            log.debug('update', "{path}: set {key}", path=file_path, key=key)
+    await jobs.afail(file_path, 'no usable answer', [key for key in missing if key not in updated])
+    if updated:
+        await write_frontmatter_to_file(file_path, frontmatter, writer, on_commit=lambda: jobs.done(file_path, updated))
+        log.info('write', "Updated frontmatter in {path}", path=file_path, fields=updated,
+                 elapsed=elapsed, requests=requests_made)
 
 if __name__ == '__main__':
-    main()
+    parser = argparse.ArgumentParser(description='Fill missing lede/image_prompt fields using the local MSTY/Ollama model.')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print a unified diff of each frontmatter change instead of writing files')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='files processed at once; match the server\'s OLLAMA_NUM_PARALLEL (default: %(default)s)')
+    parser.add_argument('--pack', type=int, default=1,
+                        help='pack up to N short files into one request (default: %(default)s, no packing)')
+    job_queue.add_arguments(parser, workers=DEFAULT_WORKERS)
+    logging_setup.add_arguments(parser)
+    args = parser.parse_args()
+    logging_setup.configure_from_args(args)
+    main(dry_run=args.dry_run, concurrency=max(1, args.concurrency), pack_size=max(1, args.pack), mode=args.jobs_mode,
+         workers=max(1, args.workers))
@@ -1,31 +1,251 @@
 # test_msty_api.py
-# This script probes the Ollama LLM API at http://localhost:10000/api/generate to test text generation.
-# It uses only built-in Python libraries, per project rules.
+# Load test and capacity probe for the local MSTY/Ollama endpoint (POST /api/generate).
+# It uses only built-in Python libraries, per project rules (the shared logger and percentile helper in
+# ai-labs/utils/content_pipeline/ are stdlib-only too; CONTENT_LOG_FORMAT=json for JSON lines).
+#
+# - Ramps concurrency through --levels (default 1,2,4,8,16): at each level, that many threads each
+#   send --rounds streamed requests back to back
+# - Per level: time-to-first-token (p50/p95), per-request generation speed (tokens/sec), aggregate
+#   tokens/sec, queueing delay and error rate. Queueing delay is wall time minus Ollama's reported
+#   total_duration (time spent waiting for a free slot); without it, TTFT minus the level-1 TTFT
+# - A level is healthy while its error rate stays under --max-error-rate and its p95 TTFT under
+#   --max-ttft (default: 4x the level-1 p50); the ramp stops at the first unhealthy level
+# - Recommends the smallest healthy level that reaches 90% of the best healthy aggregate throughput,
+#   i.e. the --concurrency / MSTY_CONCURRENCY for request-local-MSTY-model.py (and the
+#   OLLAMA_NUM_PARALLEL the host should at least run with)
+# - --stub starts the local Ollama stand-in (ai-labs/utils/content_pipeline/stubs.py, needs aiohttp)
+#   on a free port and tests against it, for CI. Exit status is 1 if no level was healthy
+#
+# Usage:
+#   python test_msty_api.py                               # ramp against LOCAL_MODEL_API_SERVICE_MSTY
+#   python test_msty_api.py --levels 1 --rounds 1         # the old single "hello" probe
+#   python test_msty_api.py --stub --stub-num-parallel 4  # offline, e.g. in CI
 
 import os
+import sys
 import json
+import time
+import socket
+import argparse
+import threading
+import subprocess
+from pathlib import Path
 from urllib import request, error
 
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from content_pipeline import log as logging_setup
+from content_pipeline.metrics import percentile
+
+log = logging_setup.get_logger('msty-probe')
+
 api_url = os.environ.get('LOCAL_MODEL_API_SERVICE_MSTY', 'http://localhost:10100')
-generate_url = api_url.rstrip('/') + '/api/generate'
-
-# Minimal valid payload for Ollama (update 'model' as needed)
-payload = {
-    "model": "gemma3:1b",  # Change to the model you have pulled (e.g., "msty", "gemma", etc.)
-    "prompt": "Say hello from MSTY Gemma!"
-}
-data = json.dumps(payload).encode('utf-8')
-headers = {'Content-Type': 'application/json'}
-
-try:
-    req = request.Request(generate_url, data=data, headers=headers, method='POST')
-    with request.urlopen(req, timeout=10) as resp:
-        print(f"[SUCCESS] Status: {resp.status}")
-        print(resp.read().decode('utf-8'))
-except error.HTTPError as e:
-    print(f"[HTTP ERROR] Status: {e.code} - {e.reason}")
-    print(e.read().decode('utf-8'))
-except error.URLError as e:
-    print(f"[URL ERROR] {e.reason}")
-except Exception as e:
-    print(f"[ERROR] {e}")
+STUBS_PATH = Path(__file__).resolve().parents[2] / 'utils' / 'content_pipeline' / 'stubs.py'
+
+# Minimal valid payload for Ollama (update 'model' as needed, or pass --model)
+DEFAULT_MODEL = "gemma3:1b"  # Change to the model you have pulled (e.g., "msty", "gemma", etc.)
+DEFAULT_PROMPT = "Say hello from MSTY Gemma!"
+# A level must reach this share of the best aggregate throughput to be recommended
+THROUGHPUT_SHARE = 0.9
+
+
+def generate_once(generate_url, payload, timeout):
+    """
+    Sends one streamed request and returns its measurements: ok/error, wall, ttft (first
+    non-empty token), tokens, gen_seconds (time generating them) and queue (waiting for a slot).
+    """
+    data = json.dumps(payload).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    result = {'ok': False, 'error': None, 'wall': None, 'ttft': None, 'tokens': 0, 'gen_seconds': None, 'queue': None}
+    started = time.perf_counter()
+    final = {}
+    try:
+        req = request.Request(generate_url, data=data, headers=headers, method='POST')
+        with request.urlopen(req, timeout=timeout) as resp:
+            for line in resp:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+                if chunk.get('response'):
+                    result['tokens'] += 1
+                    if result['ttft'] is None:
+                        result['ttft'] = time.perf_counter() - started
+                if chunk.get('done'):
+                    final = chunk
+                    break
+    except error.HTTPError as e:
+        result['error'] = f"HTTP {e.code}"
+    except error.URLError as e:
+        result['error'] = str(e.reason)
+    except Exception as e:
+        result['error'] = type(e).__name__
+    result['wall'] = time.perf_counter() - started
+    if result['error'] is None:
+        result['ok'] = bool(final) and result['ttft'] is not None
+        if not result['ok']:
+            result['error'] = 'no tokens' if final else 'stream ended early'
+    if result['ok']:
+        # Ollama's own counters are exact; fall back to counted chunks and our clock
+        result['tokens'] = final.get('eval_count') or result['tokens']
+        if final.get('eval_duration'):
+            result['gen_seconds'] = final['eval_duration'] / 1e9
+        else:
+            result['gen_seconds'] = result['wall'] - result['ttft']
+        if final.get('total_duration'):
+            result['queue'] = max(0.0, result['wall'] - final['total_duration'] / 1e9)
+    return result
+
+
+def run_level(generate_url, payload, concurrency, rounds, timeout):
+    """`concurrency` threads, each sending `rounds` requests; returns (results, elapsed seconds)."""
+    results = []
+    lock = threading.Lock()
+    start = threading.Barrier(concurrency + 1)
+
+    def worker():
+        start.wait()
+        for _ in range(rounds):
+            outcome = generate_once(generate_url, payload, timeout)
+            with lock:
+                results.append(outcome)
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def summarize_level(concurrency, results, elapsed, baseline_ttft):
+    ok = [r for r in results if r['ok']]
+    ttfts = sorted(r['ttft'] for r in ok)
+    queues = [r['queue'] for r in ok if r['queue'] is not None]
+    if not queues and baseline_ttft is not None:
+        queues = [max(0.0, r['ttft'] - baseline_ttft) for r in ok]
+    speeds = sorted(r['tokens'] / r['gen_seconds'] for r in ok if r['gen_seconds'])
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'error_rate': round((len(results) - len(ok)) / len(results), 3) if results else 0.0,
+        'ttft_p50': percentile(ttfts, 50),
+        'ttft_p95': percentile(ttfts, 95),
+        'queue_p50': percentile(sorted(queues), 50),
+        'queue_p95': percentile(sorted(queues), 95),
+        'tokens_per_sec_p50': percentile(speeds, 50),
+        'aggregate_tokens_per_sec': round(sum(r['tokens'] for r in ok) / elapsed, 1) if elapsed else 0.0,
+        'elapsed': round(elapsed, 3),
+    }
+
+
+def recommend(levels):
+    """Smallest healthy level within THROUGHPUT_SHARE of the best healthy throughput (None if none)."""
+    healthy = [level for level in levels if level['healthy']]
+    if not healthy:
+        return None
+    best = max(level['aggregate_tokens_per_sec'] for level in healthy)
+    return next(level for level in healthy if level['aggregate_tokens_per_sec'] >= THROUGHPUT_SHARE * best)
+
+
+def _seconds(value):
+    return f"{value:.3f}s" if value is not None else '-'
+
+
+def start_stub(num_parallel, token_rate):
+    """Runs the Ollama stand-in on a free port; returns (process, base URL)."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    proc = subprocess.Popen([sys.executable, str(STUBS_PATH), 'ollama', '--port', str(port),
+                             '--num-parallel', str(num_parallel), '--token-rate', str(token_rate)],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline and proc.poll() is None:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"Ollama stub did not start (is aiohttp installed?): {STUBS_PATH}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ramp concurrency against an Ollama /api/generate endpoint and recommend a setting.")
+    parser.add_argument('--url', default=api_url, help="Ollama base URL (default: LOCAL_MODEL_API_SERVICE_MSTY or http://localhost:10100)")
+    parser.add_argument('--model', default=DEFAULT_MODEL)
+    parser.add_argument('--prompt', default=DEFAULT_PROMPT)
+    parser.add_argument('--max-tokens', type=int, default=128, help="num_predict per request (0 = model default)")
+    parser.add_argument('--levels', default='1,2,4,8,16', help="comma-separated concurrency levels, ascending")
+    parser.add_argument('--rounds', type=int, default=3, help="requests per thread at each level")
+    parser.add_argument('--timeout', type=float, default=120.0, help="seconds per request")
+    parser.add_argument('--max-error-rate', type=float, default=0.05, help="highest healthy error rate")
+    parser.add_argument('--max-ttft', type=float, default=None, help="highest healthy p95 TTFT in seconds (default: 4x level-1 p50)")
+    stub = parser.add_argument_group('stub (offline / CI)')
+    stub.add_argument('--stub', action='store_true', help="start the local Ollama stub and test against it")
+    stub.add_argument('--stub-num-parallel', type=int, default=4, help="the stub's concurrent generations")
+    stub.add_argument('--stub-token-rate', type=float, default=200.0, help="the stub's tokens/sec per request")
+    logging_setup.add_arguments(parser)
+    args = parser.parse_args(argv)
+    logging_setup.configure_from_args(args)
+
+    levels = sorted({int(level) for level in args.levels.split(',') if level.strip()})
+    stub_proc = None
+    base_url = args.url
+    if args.stub:
+        stub_proc, base_url = start_stub(args.stub_num_parallel, args.stub_token_rate)
+        log.info('stub', "Ollama stub on {url} (num_parallel {num_parallel})", url=base_url, num_parallel=args.stub_num_parallel)
+    generate_url = base_url.rstrip('/') + '/api/generate'
+    payload = {"model": args.model, "prompt": args.prompt, "stream": True}
+    if args.max_tokens:
+        payload["options"] = {"num_predict": args.max_tokens}
+
+    measured = []
+    baseline_ttft = None
+    max_ttft = args.max_ttft
+    try:
+        for concurrency in levels:
+            results, elapsed = run_level(generate_url, payload, concurrency, args.rounds, args.timeout)
+            stats = summarize_level(concurrency, results, elapsed, baseline_ttft)
+            if baseline_ttft is None and stats['ttft_p50'] is not None:
+                baseline_ttft = stats['ttft_p50']
+                if max_ttft is None:
+                    max_ttft = 4 * baseline_ttft
+            stats['healthy'] = (stats['error_rate'] <= args.max_error_rate and stats['ttft_p95'] is not None
+                                and (max_ttft is None or stats['ttft_p95'] <= max_ttft))
+            measured.append(stats)
+            log.info('level', "concurrency {concurrency}: {requests} request(s), {errors} error(s) | ttft p50 {t50} p95 {t95} | "
+                     "queue p50 {q50} p95 {q95} | {speed} tok/s per request, {aggregate_tokens_per_sec} tok/s total{flag}",
+                     url=generate_url, **stats, t50=_seconds(stats['ttft_p50']), t95=_seconds(stats['ttft_p95']),
+                     q50=_seconds(stats['queue_p50']), q95=_seconds(stats['queue_p95']),
+                     speed=f"{stats['tokens_per_sec_p50']:.1f}" if stats['tokens_per_sec_p50'] else '-',
+                     flag='' if stats['healthy'] else ' (degraded: stopping)')
+            if not stats['healthy']:
+                for result in results:
+                    if result['error']:
+                        log.warning('error', "{error}", url=generate_url, concurrency=concurrency, error=result['error'])
+                        break
+                break
+    finally:
+        if stub_proc is not None:
+            stub_proc.terminate()
+            stub_proc.wait()
+
+    choice = recommend(measured)
+    if choice is None:
+        log.error('recommend', "No healthy concurrency level (error rate <= {max_error_rate}, p95 TTFT <= {max_ttft}); is the endpoint up?",
+                  url=generate_url, max_error_rate=args.max_error_rate, max_ttft=_seconds(max_ttft))
+        return 1
+    log.info('recommend', "MSTY_CONCURRENCY={concurrency} (request-local-MSTY-model.py --concurrency {concurrency}); "
+             "run Ollama with OLLAMA_NUM_PARALLEL >= {concurrency}. {aggregate_tokens_per_sec} tok/s, p95 TTFT {t95}",
+             url=generate_url, concurrency=choice['concurrency'], aggregate_tokens_per_sec=choice['aggregate_tokens_per_sec'],
+             t95=_seconds(choice['ttft_p95']), max_ttft=max_ttft)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
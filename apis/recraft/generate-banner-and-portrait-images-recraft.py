@@ -6,19 +6,52 @@ load_dotenv()
 Script: generate-banner-images-recraft.py
 Purpose: Generate vector banner images for markdown prompt files using the Recraft API, updating YAML frontmatter using ONLY string manipulation.
 
-- Scans all markdown files in the target directory (recursively)
+- Scans all markdown files in the target directory (recursively) through the shared frontmatter
+  index (ai-labs/utils/content_pipeline/scan.py): only files whose frontmatter lacks a valid
+  banner/portrait URL are opened
 - Extracts YAML frontmatter and prompt
 - Sends prompt to Recraft API for SVG (vector) image generation (16:9)
+- Picks the custom style per file from the style registry (styles-registry-recraft.jsonl, loaded
+  lazily on first lookup): the frontmatter's STYLE_FIELD, else the STYLE_BY_DIR entry for the
+  file's directory, else DEFAULT_STYLE. Files with different styles are handled in the same pass
+- Optionally re-hosts each generated image (ASSET_UPLOADER 'local' or 'imagekit'): the temporary Recraft URL
+  is streamed to disk, deduplicated by content hash, uploaded once and the durable URL is written instead
+  (ai-labs/utils/content_pipeline/assets.py). Re-hosting runs as a second stage fed by the generation
+  workers; SVGs are minified and PNG derivatives rendered in a process pool, recorded as '<field>_srcset'.
+  The derivatives need cairosvg (python-requirements.txt) and the system cairo library: without them
+  only the minified SVG is uploaded and no '<field>_srcset' is recorded
 - Inserts/updates 'banner_image: <URL>' in frontmatter, preserving all other fields and formatting
 - Inserts/updates 'portrait_image: <URL>' in frontmatter, preserving all other fields and formatting
 - Never uses any YAML libraries
+- Runs as a producer/consumer pipeline: one producer parses files, WORKER_COUNT async workers
+  share one aiohttp session, and at most MAX_IN_FLIGHT Recraft requests are open at once
+- Paces requests with a shared adaptive (AIMD token-bucket) rate limiter and retries 429/5xx
+  responses with jittered backoff that honors Retry-After
+- With re-hosting on, reuses the re-hosted URL (and srcset) for identical (normalized prompt, style,
+  size) requests from a local SQLite prompt cache with TTL/LRU eviction instead of calling the API
+  again. Only durable URLs are cached: a temporary Recraft URL would be dead by the time it is hit
+- Records each file's decision in a JSON-lines run manifest next to the script, so unchanged
+  files are skipped on rerun without being opened
+- Works through a durable per-file/per-field job queue (ai-labs/utils/content_pipeline/jobs.py,
+  one queue per PROMPT_DIR): discovery enqueues the candidates, workers claim them under a lease and mark
+  them done once the file is on disk or failed with the reason. --resume finishes an interrupted
+  run without re-walking, --retry-failed reruns only the failures, --jobs-status shows the queue;
+  several processes can share one queue
+- Writes files atomically (temp file + rename, batched fsync) off the event loop;
+  --dry-run prints a unified diff of each frontmatter change instead
+- Reports throughput (files/min, images/min) at the end of the run
+- Records every Recraft request (wall time, time-to-first-byte, retries) in a JSON-lines metrics
+  file (METRICS_PATH) and reports p50/p95/p99 latency and requests/s at the end of the run
+- Logs through the shared structured logger (ai-labs/utils/content_pipeline/log.py): one info event
+  per file decision/update, request payloads and skip-decision traces only at --log-level debug,
+  --log-format json (or CONTENT_LOG_FILE) for JSON-lines records
 - Aggressively comments all logic and function calls
 
 CRITICAL: Never destructively edit or lose any existing frontmatter or markdown content.
 
 REFERENCE: For using custom styles, see:
   - content/lost-in-public/prompts/workflow/Write-an-AI-Model-request-Script.md
-  - ai-labs/recraft/styles-recraft-2025-04-14T21-24-01.json
+  - ai-labs/recraft/styles-registry-recraft.jsonl (styles are created by generate-style-recraft.py)
 
 IMPORTANT: ALL LOGIC RELATING TO 'portrait_image' IS HANDLED IN THE FOLLOWING PLACES:
 - In main_async():
@@ -27,7 +60,7 @@ IMPORTANT: ALL LOGIC RELATING TO 'portrait_image' IS HANDLED IN THE FOLLOWING PL
     - Updates frontmatter with generated portrait image URL.
     - Logs every skip and update condition.
 - In update_portrait_image_in_frontmatter():
-    - Inserts or updates the 'portrait_image' field in the YAML frontmatter string.
+    - Inserts or updates the 'portrait_image' field in the parsed frontmatter (shared content_pipeline.frontmatter).
 
 All skip and update conditions are aggressively logged and commented below. See mirrored comments at function definition and call sites.
 """
@@ -47,20 +80,29 @@ See also: update_portrait_image_in_frontmatter() for actual YAML update logic.
 """
 
 import os
-import re
+import time
 import asyncio
 import aiohttp
 from pathlib import Path
-import json  # For loading custom style JSON
+import sys
+import argparse
+from collections import Counter
 
-# --- LOAD CUSTOM STYLE ---
-# Load the custom style JSON generated by Recraft (see referenced prompt doc)
-STYLE_JSON_PATH = Path(__file__).parent / "styles-recraft-2025-04-14T21-24-01.json"
-with open(STYLE_JSON_PATH, "r", encoding="utf-8") as style_file:
-    # Load the style object from JSON
-    CUSTOM_STYLE_OBJ = json.load(style_file)
-    # Extract the style ID for use in API requests
-    CUSTOM_STYLE_ID = CUSTOM_STYLE_OBJ["id"]
+# --- SHARED PIPELINE HELPERS ---
+# ai-labs/utils/content_pipeline is shared by the recraft and msty scripts; put ai-labs/utils on the path
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from content_pipeline.rate_limit import AdaptiveRateLimiter, RETRYABLE_STATUSES, parse_retry_after, backoff_delay
+from content_pipeline.manifest import RunManifest, content_digest
+from content_pipeline.prompt_cache import PromptCache
+from content_pipeline.frontmatter import Frontmatter
+from content_pipeline.writes import BatchedWriter
+from content_pipeline.scan import FrontmatterIndex, DEFAULT_INDEX_PATH
+from content_pipeline.style_registry import StyleRegistry
+from content_pipeline.assets import AssetStore, AssetPipeline, make_uploader
+from content_pipeline.svg_optimize import AssetOptimizer, raster_backend
+from content_pipeline import log as logging_setup
+from content_pipeline.metrics import RunMetrics, track
+from content_pipeline import jobs as job_queue
 
 # --- ENV VARS ---
 # Loads the RECRAFT_API_TOKEN from environment (assumes .env loaded by shell or system)
@@ -71,10 +113,8 @@ if not RECRAFT_API_TOKEN:
 # --- CONSTANTS ---
 # Overwrite existing banner_image values in frontmatter? If True, always generate a new image and overwrite. If False, skip files with a non-empty banner_image.
 OVERWRITE = False
-# Directory containing markdown prompt files (recursive search)
-PROMPT_DIR = Path('/Users/mpstaton/code/lossless-monorepo/content/essays')
-# Regex for YAML frontmatter (--- ... ---)
-FRONTMATTER_REGEX = re.compile(r'^(---\s*\n.*?\n?)^(---\s*$)', re.DOTALL | re.MULTILINE)
+# Directory containing markdown prompt files (recursive search); RECRAFT_PROMPT_DIR overrides it
+PROMPT_DIR = Path(os.environ.get('RECRAFT_PROMPT_DIR', '/Users/mpstaton/code/lossless-monorepo/content/essays'))
 # Banner/Portrait image run toggles and config
 RUN_BANNERS = True
 RUN_PORTRAITS = True
@@ -82,111 +122,144 @@ BANNER_SIZE = "2048x1024"
 PORTRAIT_SIZE = "1024x1820"
 BANNER_FIELD = 'banner_image'
 PORTRAIT_FIELD = 'portrait_image'
-# Recraft API endpoint
-RECRAFT_API_URL = 'https://external.api.recraft.ai/v1/images/generations'
+FIELD_SIZES = {BANNER_FIELD: BANNER_SIZE, PORTRAIT_FIELD: PORTRAIT_SIZE}
+# --- CUSTOM STYLES ---
+# Named styles -> Recraft style ids, written by generate-style-recraft.py. Read on the first lookup only.
+STYLE_REGISTRY_PATH = Path(os.environ.get('RECRAFT_STYLE_REGISTRY', Path(__file__).parent / 'styles-registry-recraft.jsonl'))
+# Style used when neither the frontmatter nor STYLE_BY_DIR names one (a registry name or a raw style id)
+DEFAULT_STYLE = os.environ.get('RECRAFT_STYLE', 'default')
+# Per-directory styles: path relative to PROMPT_DIR -> style name; the deepest matching directory wins
+# e.g. {'augment-it': 'augment-it', 'lossless/visuals': 'lossless'}
+STYLE_BY_DIR = {}
+# Per-file override: a frontmatter field naming the style (registry name or raw style id)
+STYLE_FIELD = 'image_style'
+# Recraft API endpoint (override with a local stub, see ai-labs/utils/content_pipeline/stubs.py)
+RECRAFT_API_URL = os.environ.get('RECRAFT_API_URL', 'https://external.api.recraft.ai/v1/images/generations')
+# Adaptive rate limit (requests/sec): start at RATE_START, AIMD keeps it between RATE_MIN and RATE_MAX
+RATE_START = float(os.environ.get('RECRAFT_RATE', '2.0'))
+RATE_MIN = 0.2
+RATE_MAX = float(os.environ.get('RECRAFT_RATE_MAX', '10.0'))
+# Retries for 429/5xx/connection errors, with full-jitter exponential backoff (seconds)
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Concurrency: number of async workers consuming parsed files, and the hard cap on
+# Recraft requests open at once across all workers (a file can need two: banner + portrait)
+WORKER_COUNT = int(os.environ.get('RECRAFT_WORKERS', '8'))
+MAX_IN_FLIGHT = int(os.environ.get('RECRAFT_MAX_IN_FLIGHT', '8'))
+# Run manifest: last decision per file keyed by path/mtime/size/hash, lets reruns skip unchanged files unopened
+MANIFEST_PATH = Path(os.environ.get('RECRAFT_MANIFEST', Path(__file__).parent / '.recraft-manifest.jsonl'))
+# Prompt -> re-hosted image URL cache keyed on (normalized prompt, style id, size); also applies when
+# OVERWRITE is True. Off when ASSET_UPLOADER is 'none': Recraft's own URLs expire long before the TTL
+USE_PROMPT_CACHE = os.environ.get('RECRAFT_PROMPT_CACHE', '1') != '0'
+PROMPT_CACHE_PATH = Path(os.environ.get('RECRAFT_PROMPT_CACHE_PATH', Path(__file__).parent / '.recraft-prompt-cache.sqlite3'))
+PROMPT_CACHE_TTL = int(os.environ.get('RECRAFT_PROMPT_CACHE_TTL', str(7 * 24 * 3600)))  # seconds
+PROMPT_CACHE_MAX_ENTRIES = 20000
+# Per-request metrics (JSON lines, appended per run); RECRAFT_METRICS_PATH='' turns the file off
+METRICS_PATH = os.environ.get('RECRAFT_METRICS_PATH', str(Path(__file__).parent / '.recraft-metrics.jsonl')) or None
+# --- ASSET RE-HOSTING ---
+# Recraft image URLs are temporary. 'none' writes them as returned; 'local' or 'imagekit' downloads each image
+# (streamed in chunks, deduplicated by content hash) into ASSET_DIR and writes the re-hosted URL instead.
+# The PNG derivatives (OPTIMIZE_ASSETS below) additionally need `pip install cairosvg` plus the cairo library
+ASSET_UPLOADER = os.environ.get('RECRAFT_ASSET_UPLOADER', 'none')
+ASSET_DIR = Path(os.environ.get('RECRAFT_ASSET_DIR', Path(__file__).parent / '.recraft-assets'))
+ASSET_CONCURRENCY = int(os.environ.get('RECRAFT_ASSET_CONCURRENCY', '8'))
+# 'local': assets are published into ASSET_PUBLIC_DIR, which the site serves under ASSET_BASE_URL
+ASSET_PUBLIC_DIR = Path(os.environ.get('RECRAFT_ASSET_PUBLIC_DIR', '/Users/mpstaton/code/lossless-monorepo/content/visuals/For/Recraft-Generated'))
+ASSET_BASE_URL = os.environ.get('RECRAFT_ASSET_BASE_URL', '/visuals/For/Recraft-Generated')
+# 'imagekit': same environment as ai-labs/apis/imagekit/convertImageToImagkitUrl.cjs
+IMAGEKIT_UPLOAD_ENDPOINT = os.environ.get('IMAGEKIT_UPLOAD_ENDPOINT', 'https://upload.imagekit.io/api/v1/files/upload')
+IMAGEKIT_PRIVATE_KEY = os.environ.get('IMAGEKIT_PRIVATE_KEY')
+IMAGEKIT_FOLDER = os.environ.get('IMAGEKIT_FOLDER', '/uploads/lossless/essays')
+# With re-hosting on: minify SVGs and render PNG derivatives at these widths in a process pool, uploading the
+# minified SVG and recording the derivatives as '<field>_srcset: <url> 480w, <url> 960w, ...'. Without cairosvg
+# the SVG is still minified but no derivatives are rendered and no srcset is recorded
+OPTIMIZE_ASSETS = os.environ.get('RECRAFT_OPTIMIZE', '1') != '0'
+DERIVATIVE_WIDTHS = [int(w) for w in os.environ.get('RECRAFT_DERIVATIVE_WIDTHS', '480,960,1440').split(',') if w.strip()]
+OPTIMIZE_PROCESSES = int(os.environ.get('RECRAFT_OPTIMIZE_PROCESSES', str(min(4, os.cpu_count() or 1))))
+SRCSET_SUFFIX = '_srcset'
+# Atomic writes (temp file + rename) are fsynced and renamed in batches of this many files
+WRITE_BATCH_SIZE = 16
+# Max parsed files waiting for a worker, keeps the producer from reading the whole tree into memory
+QUEUE_SIZE = WORKER_COUNT * 4
 
 # --- HELPER FUNCTIONS ---
 def extract_frontmatter(md_text):
     """
-    Extracts the YAML frontmatter block as a string from a markdown file.
-    Returns (frontmatter_string, rest_of_file_string).
-    Returns (None, md_text) if no frontmatter found.
-    """
-    m = FRONTMATTER_REGEX.search(md_text)
-    if not m:
-        return None, md_text
-    return m.group(0), md_text[m.end():]
-
-def update_banner_image_in_frontmatter(frontmatter, banner_url):
-    """
-    Inserts or updates the 'banner_image' field in the YAML frontmatter string.
-    Preserves all other fields and formatting.
-    Returns the updated frontmatter string.
-    """
-    lines = frontmatter.split('\n')
-    found = False
-    new_lines = []
-    for line in lines:
-        if line.startswith(BANNER_FIELD + ":"):
-            # Replace the existing banner_image line
-            new_lines.append(f"{BANNER_FIELD}: {banner_url}")
-            found = True
-        else:
-            new_lines.append(line)
-    if not found:
-        # Insert just before the closing '---' (if present), else at end
-        for i in range(len(new_lines)-1, -1, -1):
-            if new_lines[i].strip() == '---':
-                new_lines.insert(i, f"{BANNER_FIELD}: {banner_url}")
-                break
-        else:
-            new_lines.append(f"{BANNER_FIELD}: {banner_url}")
-    return '\n'.join(new_lines)
-
-def update_portrait_image_in_frontmatter(frontmatter, portrait_url):
-    """
-    Inserts or updates the 'portrait_image' field in the YAML frontmatter string.
-    Preserves all other fields and formatting.
-    Returns the updated frontmatter string.
-    """
-    lines = frontmatter.split('\n')
-    found = False
-    new_lines = []
-    for line in lines:
-        if line.startswith(PORTRAIT_FIELD + ":"):
-            new_lines.append(f"{PORTRAIT_FIELD}: {portrait_url}")
-            found = True
-        else:
-            new_lines.append(line)
-    if not found:
-        for i in range(len(new_lines)-1, -1, -1):
-            if new_lines[i].strip() == '---':
-                new_lines.insert(i, f"{PORTRAIT_FIELD}: {portrait_url}")
-                break
-        else:
-            new_lines.append(f"{PORTRAIT_FIELD}: {portrait_url}")
-    return '\n'.join(new_lines)
+    Parses the YAML frontmatter of a markdown file in a single pass (shared content_pipeline.frontmatter).
+    Returns a Frontmatter object (fields + untouched body), or None if no frontmatter found.
+    """
+    return Frontmatter.parse(md_text)
+
+def update_banner_image_in_frontmatter(fm, banner_url):
+    """
+    Inserts or updates the 'banner_image' field in the parsed frontmatter.
+    Only that line changes; all other fields and formatting are preserved.
+    """
+    fm.set(BANNER_FIELD, banner_url)
+
+def update_portrait_image_in_frontmatter(fm, portrait_url):
+    """
+    Inserts or updates the 'portrait_image' field in the parsed frontmatter.
+    Only that line changes; all other fields and formatting are preserved.
+    """
+    fm.set(PORTRAIT_FIELD, portrait_url)
 
-def extract_prompt_from_markdown(md_text):
+def extract_prompt_from_markdown(fm):
     """
-    Extracts prompt from markdown file.
-    Looks for a line starting with 'image_prompt:' in frontmatter, else uses first H1/H2 or first paragraph after frontmatter.
+    Extracts prompt from a parsed markdown file.
+    Uses the 'image_prompt' frontmatter field, else the first non-empty line of the body.
     (Modify as needed for your project conventions.)
     """
-    # Try to find 'image_prompt:' in frontmatter
-    m = re.search(r'^image_prompt:\s*(.*)', md_text, re.MULTILINE)
-    if m:
-        return m.group(1).strip()
-    # Else, use first non-empty line after frontmatter
-    after_fm = FRONTMATTER_REGEX.sub('', md_text, count=1)
-    for line in after_fm.split('\n'):
-        if line.strip():
-            return line.strip()
+    # Try 'image_prompt' in frontmatter
+    prompt = fm.get('image_prompt')
+    if prompt and prompt.strip():
+        return prompt.strip()
+    # Else, use first non-empty line after frontmatter (walk lines lazily, the body can be large)
+    body = fm.body
+    pos = 0
+    while pos < len(body):
+        end = body.find('\n', pos)
+        if end == -1:
+            end = len(body)
+        line = body[pos:end].strip()
+        if line:
+            return line
+        pos = end + 1
     return None
 
+# --- LOGGING ---
+# Debug events (payloads, responses, skip-decision traces) cost one level check unless
+# --log-level debug is on; their messages are only formatted when emitted.
+log = logging_setup.get_logger('recraft-images')
+
 def log_request_out(payload):
     """
-    Logs the exact payload sent to the Recraft API.
+    Logs the exact payload sent to the Recraft API (debug).
     """
-    print(f"[REQUEST OUT] Payload to Recraft API: {payload}")
+    log.debug('request_out', "Payload to Recraft API: {payload}", payload=payload)
 
-def log_response_in(response):
+def log_response_in(status, text):
     """
-    Logs the response received from the Recraft API.
+    Logs the response received from the Recraft API (debug).
     """
-    print(f"[RESPONSE IN] Status: {response.status}, Response: {response.text}")
+    log.debug('response_in', "Status: {status}, Response: {response}", status=status, response=text)
 
-def log_file_update(filepath, updated_frontmatter):
+def log_file_update(filepath, fm, fields):
     """
-    Logs the file update and shows exactly what was updated in the frontmatter.
+    Logs the file update: one info event per file naming the updated fields, plus the
+    full updated frontmatter block at debug level (built only when debug is on).
+    `fields` may be a zero-argument callable, so the list is only built when the event is emitted.
     """
-    print(f"[FILE UPDATED] {filepath}\n[UPDATED FRONTMATTER]\n{updated_frontmatter}\n{'-'*40}")
+    log.info('file_updated', "{path} ({fields})", path=filepath, fields=fields)
+    log.debug('updated_frontmatter', "{path}\n{frontmatter}\n{rule}", path=filepath,
+              frontmatter=fm.block, rule='-' * 40)
 
 def is_effectively_empty(val):
     """
     Helper function to check if a value is effectively empty (None, empty string, whitespace, or just quotes)
     """
-    print(f"[DEBUG][is_effectively_empty] Checking value: {repr(val)} (type: {type(val)})")
+    log.debug('is_effectively_empty', "Checking value: {value!r} (type: {type})", value=val, type=lambda: type(val).__name__)
     if val is None:
         return True
     if isinstance(val, str):
@@ -203,38 +276,441 @@ def is_valid_image_url(val):
     if not isinstance(val, str):
         return False
     val = val.strip().strip('"').strip("'")
-    # Accept http/https and known upload patterns
-    return val.startswith('http://') or val.startswith('https://') or 'ik.imagekit.io' in val
+    # Accept http/https, known upload patterns and locally re-hosted assets (ASSET_BASE_URL)
+    return val.startswith(('http://', 'https://', ASSET_BASE_URL.rstrip('/') + '/')) or 'ik.imagekit.io' in val
 
 # --- ASYNC IMAGE GENERATION ---
-async def generate_recraft_image_async(prompt, size, session):
+async def generate_recraft_image_async(prompt, size, session, style_id, limiter=None, metrics=None):
     """
-    Async version: Sends a prompt to the Recraft API to generate a vector (SVG) image of given size.
-    Returns the URL of the generated image.
+    Async version: Sends a prompt to the Recraft API to generate a vector (SVG) image of given size
+    in the custom style `style_id`. Returns the (temporary) URL of the generated image.
+
+    Rate limiting and retries:
+    - Every attempt first takes a token from the shared AdaptiveRateLimiter (if given).
+    - 429/408/5xx responses and connection errors are retried up to MAX_RETRIES times
+      with full-jitter backoff, never sooner than the server's Retry-After.
+    - 429s also tell the limiter to back off (AIMD), 2xx lets it creep back up.
+    - Any other non-200 status is a hard failure and raises RuntimeError immediately.
+
+    Metrics:
+    - With a RunMetrics, each call that reaches the API is one 'recraft.generate' record: wall
+      time (rate-limiter waits and backoff included), time to the response headers of the last
+      attempt, and the number of retries.
     """
     payload = {
         "prompt": prompt,
-        "style_id": CUSTOM_STYLE_ID,
+        "style_id": style_id,
         "size": size
     }
-    log_request_out(payload)
     headers = {
         "Authorization": f"Bearer {RECRAFT_API_TOKEN}",
         "Content-Type": "application/json"
     }
-    async with session.post(RECRAFT_API_URL, json=payload, headers=headers) as resp:
-        text = await resp.text()
-        log_response_in(resp)
-        if resp.status != 200:
-            raise RuntimeError(f"Recraft API error {resp.status}: {text}")
-        data = await resp.json()
-        url = data.get('data', [{}])[0].get('url')
-        if not url:
-            raise RuntimeError(f"No image URL in Recraft API response: {data}")
-        return url
+    with track(metrics, 'recraft.generate', size=size, style_id=style_id) as sample:
+        for attempt in range(1, MAX_RETRIES + 2):
+            if limiter is not None:
+                await limiter.acquire()
+            log_request_out(payload)
+            retry_after = None
+            sample.attempt()
+            try:
+                async with session.post(RECRAFT_API_URL, json=payload, headers=headers) as resp:
+                    sample.first_byte()
+                    text = await resp.text()
+                    log_response_in(resp.status, text)
+                    if resp.status == 200:
+                        if limiter is not None:
+                            limiter.on_success()
+                        data = await resp.json()
+                        url = data.get('data', [{}])[0].get('url')
+                        if not url:
+                            raise RuntimeError(f"No image URL in Recraft API response: {data}")
+                        return url
+                    if resp.status not in RETRYABLE_STATUSES:
+                        raise RuntimeError(f"Recraft API error {resp.status}: {text}")
+                    retry_after = parse_retry_after(resp.headers.get('Retry-After'))
+                    if resp.status == 429 and limiter is not None:
+                        limiter.on_throttle(retry_after)
+                    error_detail = f"Recraft API error {resp.status}: {text}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error_detail = f"Recraft API connection error: {e!r}"
+            if attempt > MAX_RETRIES:
+                raise RuntimeError(f"{error_detail} (gave up after {attempt} attempts)")
+            delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after)
+            log.warning('retry', "{error} | attempt {attempt}/{max_retries}, sleeping {delay:.1f}s",
+                        error=error_detail, attempt=attempt, max_retries=MAX_RETRIES, delay=delay)
+            await asyncio.sleep(delay)
+
+# --- CUSTOM STYLE SELECTION ---
+STYLES = StyleRegistry(STYLE_REGISTRY_PATH)
+
+def style_for(md_path, fm):
+    """
+    Returns (style name, style id) for a file: the frontmatter's STYLE_FIELD if set, else the
+    deepest STYLE_BY_DIR directory containing the file, else DEFAULT_STYLE.
+    Raises LookupError if the chosen name is neither registered nor a raw style id.
+    """
+    name = (fm.get(STYLE_FIELD) or '').strip() if fm is not None else ''
+    if not name and STYLE_BY_DIR:
+        try:
+            relative = md_path.resolve().relative_to(PROMPT_DIR.resolve()).parent
+        except ValueError:
+            relative = None
+        if relative is not None:
+            # Walk up from the file's own directory, so the deepest mapped directory wins
+            for directory in (relative, *relative.parents):
+                name = STYLE_BY_DIR.get(directory.as_posix(), '')
+                if name:
+                    break
+    name = name or DEFAULT_STYLE
+    return name, STYLES.resolve(name)
+
+# --- PIPELINE: PRODUCER ---
+def wanted_fields():
+    """
+    Returns the image fields this run is configured to fill (RUN_BANNERS / RUN_PORTRAITS).
+    """
+    fields = []
+    if RUN_BANNERS:
+        fields.append(BANNER_FIELD)
+    if RUN_PORTRAITS:
+        fields.append(PORTRAIT_FIELD)
+    return fields
+
+def manifest_says_done(entry):
+    """
+    True if a manifest entry records a decision that still holds for this run's config:
+    the file had no frontmatter/prompt, or every wanted field already held a valid image URL.
+    Never consulted when OVERWRITE is True.
+    """
+    if entry['decision'] in ('no_frontmatter', 'no_prompt'):
+        return True
+    return all(field in entry.get('valid', []) for field in wanted_fields())
+
+def select_candidates():
+    """
+    Refreshes the shared frontmatter index for PROMPT_DIR (frontmatter heads only, re-read just
+    for new/changed files) and returns (files under PROMPT_DIR, candidate paths). A candidate has
+    frontmatter and lacks a valid image URL in at least one wanted field; with OVERWRITE every
+    file with frontmatter is a candidate.
+    """
+    def needs_images(entry):
+        return OVERWRITE or any(not is_valid_image_url(entry['fields'].get(field)) for field in wanted_fields())
+    index = FrontmatterIndex(DEFAULT_INDEX_PATH)
+    try:
+        scanned = index.refresh(PROMPT_DIR)
+        return scanned['files'], [Path(path) for path in index.select(PROMPT_DIR, predicate=needs_images)]
+    finally:
+        index.close()
+
+def plan_file(md_path, st, manifest):
+    """
+    Reads and parses a single markdown file and decides which images it needs.
+    Returns a job dict for the workers, or None if the file should be skipped.
+    All skip conditions are logged here (see MIRRORED COMMENT BLOCK above), and every
+    final decision is recorded in the run manifest.
+    """
+    log.debug('processing', "{path}", path=md_path)
+    data = md_path.read_bytes()
+    digest = content_digest(data)
+    # Stat changed but bytes did not (touch, checkout): refresh the manifest entry and skip
+    entry = manifest.get(md_path)
+    if not OVERWRITE and entry and entry['hash'] == digest and manifest_says_done(entry):
+        manifest.record(md_path, st, digest, entry['decision'], valid=entry.get('valid', []))
+        log.info('skip', "Content unchanged since last run in {path} (decision: {decision})",
+                 path=md_path, reason='unchanged', decision=entry['decision'])
+        return None
+    md_text = data.decode('utf-8')
+    # Extract frontmatter (single pass; the body is never scanned)
+    fm = extract_frontmatter(md_text)
+    if fm is None:
+        log.info('skip', "No frontmatter in {path} (portrait_image not generated)", path=md_path, reason='no_frontmatter')
+        manifest.record(md_path, st, digest, 'no_frontmatter')
+        return None
+    # Find the banner_image and portrait_image values in the frontmatter
+    banner_image_val = fm.raw(BANNER_FIELD)
+    portrait_image_val = fm.raw(PORTRAIT_FIELD)
+    # Aggressively commented logic for checking if we should skip image generation for portrait_image and banner_image
+    # Only skip if the value is a valid image URL. If the value is a prompt (e.g., starts with 'image_prompt:'), treat as empty and generate the image.
+    # This replaces the previous logic that treated any non-empty string as a valid image.
+    log.debug('debug', "{path} | RAW portrait_image_val: '{portrait}' | RAW banner_image_val: '{banner}'",
+              path=md_path, portrait=portrait_image_val, banner=banner_image_val)
+    # --- BEGIN OVERWRITE LOGIC FIX ---
+    # If OVERWRITE is True, never skip; always regenerate images even if valid image URLs are present.
+    if OVERWRITE:
+        skip_portrait = False
+        skip_banner = False
+        log.debug('overwrite', "OVERWRITE is True: Forcing regeneration of both portrait and banner images for {path}", path=md_path)
+    else:
+        if is_valid_image_url(portrait_image_val):
+            log.debug('skip', "portrait_image already present and non-empty (and OVERWRITE is False) in {path} (checked value: '{value}')",
+                      path=md_path, field=PORTRAIT_FIELD, value=portrait_image_val)
+            skip_portrait = True
+        else:
+            skip_portrait = False
+        log.debug('skip_portrait_decision', "skip_portrait: {skip} (portrait_image_val: '{value}')", skip=skip_portrait, value=portrait_image_val)
+        if is_valid_image_url(banner_image_val):
+            log.debug('skip', "banner_image already present and non-empty (and OVERWRITE is False) in {path} (checked value: '{value}')",
+                      path=md_path, field=BANNER_FIELD, value=banner_image_val)
+            skip_banner = True
+        else:
+            skip_banner = False
+        log.debug('skip_banner_decision', "skip_banner: {skip} (banner_image_val: '{value}')", skip=skip_banner, value=banner_image_val)
+    # --- END OVERWRITE LOGIC FIX ---
+    # Fields that already hold a valid image URL, remembered in the manifest
+    valid = [field for field, val in ((BANNER_FIELD, banner_image_val), (PORTRAIT_FIELD, portrait_image_val)) if is_valid_image_url(val)]
+    # Extract prompt
+    prompt = extract_prompt_from_markdown(fm)
+    if not prompt:
+        log.info('skip', "No prompt found in {path} (portrait_image not generated)", path=md_path, reason='no_prompt')
+        manifest.record(md_path, st, digest, 'no_prompt', valid=valid)
+        return None
+    # Decide which API calls the workers need to make for this file
+    run_banner = RUN_BANNERS and not skip_banner
+    run_portrait = RUN_PORTRAITS and not skip_portrait
+    if not run_banner and not run_portrait:
+        log.info('skip', "Every wanted image already present in {path}", path=md_path, reason='complete', valid=valid)
+        manifest.record(md_path, st, digest, 'complete', valid=valid)
+        return None
+    # Unknown style: nothing is recorded, so the file is picked up again once the style is registered
+    style, style_id = style_for(md_path, fm)
+    return {
+        'path': md_path,
+        'frontmatter': fm,
+        'prompt': prompt,
+        'style': style,
+        'style_id': style_id,
+        'run_banner': run_banner,
+        'run_portrait': run_portrait,
+        'valid': valid,
+    }
+
+async def settle_skipped(jobs, md_path, entry):
+    """
+    Records a file that needs no API call in the job queue from its manifest entry: done if every
+    wanted image is there, failed with the decision ('no_frontmatter', 'no_prompt') otherwise.
+    """
+    decision = entry['decision'] if entry else 'skipped'
+    if decision == 'complete':
+        await jobs.adone(md_path)
+    else:
+        await jobs.afail(md_path, decision)
+
+async def produce_jobs(queue, manifest, jobs, mode, stats):
+    """
+    Producer: selects candidate files under PROMPT_DIR from the frontmatter index and adds
+    them to the job queue (mode 'run'; --resume and --retry-failed skip the walk), then claims
+    them one file at a time, parses each one and enqueues a job for every file that needs at
+    least one image. Files whose frontmatter already holds every wanted image URL never leave
+    the index; candidates whose mtime and size match a finished manifest entry are skipped from
+    the stat alone, without being opened (unless OVERWRITE is True).
+    The queue is bounded (QUEUE_SIZE) so parsing never runs far ahead of the workers, and other
+    processes sharing the job queue claim the files this one has not reached yet.
+    Puts one None sentinel per worker when the job queue has nothing left. Every job-queue call
+    here and in the workers runs in a thread (jobs.aclaim() etc.), so a wait on the jobs file's
+    lock never stalls the requests in flight.
+    """
+    def discover():
+        files_scanned, candidates = select_candidates()
+        stats['files_scanned'] = files_scanned
+        stats['files_complete'] = files_scanned - len(candidates)
+        return [(md_path, wanted_fields()) for md_path in candidates]
+    # Index refresh is blocking file I/O (in its own thread pool); keep it off the event loop
+    queued = await asyncio.get_running_loop().run_in_executor(None, job_queue.plan_run, jobs, mode, discover)
+    log.info('jobs', "{queued} task(s) queued ({mode}) | {reclaimed} reclaimed from stopped runs",
+             queued=queued, mode=mode, reclaimed=jobs.reclaimed)
+    while True:
+        claimed = await jobs.aclaim()
+        if claimed is None:
+            break
+        md_path = Path(claimed.path)
+        try:
+            st = md_path.stat()
+            if not OVERWRITE:
+                entry = manifest.lookup(md_path, st)
+                if entry and manifest_says_done(entry):
+                    stats['files_unchanged'] += 1
+                    await settle_skipped(jobs, md_path, entry)
+                    continue
+            job = plan_file(md_path, st, manifest)
+        except Exception as e:
+            # Unreadable file: log and keep discovering, never leave the workers waiting
+            log.error('error', "Could not read/parse {path}: {error}", path=md_path, error=str(e))
+            stats['files_failed'] += 1
+            await jobs.afail(md_path, e)
+            continue
+        if job is None:
+            await settle_skipped(jobs, md_path, manifest.get(md_path))
+        else:
+            await queue.put(job)
+        # Yield to the workers between files, parsing is synchronous
+        await asyncio.sleep(0)
+    for _ in range(WORKER_COUNT):
+        await queue.put(None)
+
+# --- PIPELINE: CONSUMERS ---
+async def generate_bounded(prompt, size, style_id, session, in_flight, limiter, metrics):
+    """
+    Wraps generate_recraft_image_async so that no more than MAX_IN_FLIGHT
+    Recraft requests are open at once, across all workers.
+    The shared limiter additionally paces request starts under the provider ceiling.
+    """
+    async with in_flight:
+        return await generate_recraft_image_async(prompt, size, session, style_id, limiter, metrics)
+
+async def process_job(job, session, in_flight, limiter, cache, metrics, asset_queue, manifest, jobs, writer, stats):
+    """
+    Runs the Recraft calls for one job (banner and portrait in parallel when both
+    are needed). Fields the prompt cache has a re-hosted image for are not generated at all.
+    With re-hosting on, the generated URLs are handed to the asset stage (asset_queue) and the
+    worker moves on to its next job; otherwise the file is finished here.
+    On API failure the error is logged, the file is left untouched and its tasks are marked
+    failed with the error, so the next run (or --retry-failed) picks it up again.
+    """
+    md_path = job['path']
+    prompt = job['prompt']
+    fields = [field for field, run in ((BANNER_FIELD, job['run_banner']), (PORTRAIT_FIELD, job['run_portrait'])) if run]
+    # Cache hits are re-hosted URLs (plus their srcset), ready for the frontmatter as they are.
+    # Entries without a 'source' are raw Recraft URLs cached by older runs, long expired: misses.
+    cached_urls, cached_srcsets = {}, {}
+    if cache is not None:
+        for field in fields:
+            entry = cache.lookup(prompt, job['style_id'], FIELD_SIZES[field])
+            if entry is None or not entry[1].get('source'):
+                continue
+            cached_urls[field], metadata = entry
+            if metadata.get('srcset'):
+                cached_srcsets[field] = metadata['srcset']
+            log.info('cache_hit', "{size} | {prompt!r} -> {url}", size=FIELD_SIZES[field], prompt=prompt[:60], url=cached_urls[field])
+    # Map each field we are generating to its pending API call
+    tasks = {
+        field: generate_bounded(prompt, FIELD_SIZES[field], job['style_id'], session, in_flight, limiter, metrics)
+        for field in fields if field not in cached_urls
+    }
+    try:
+        urls = dict(zip(tasks.keys(), await asyncio.gather(*tasks.values())))
+    except Exception as e:
+        log.error('error', "API call failed for {path}: {error} (portrait_image and/or banner_image not generated)",
+                  path=md_path, error=str(e))
+        stats['files_failed'] += 1
+        await jobs.afail(md_path, e)
+        return
+    if asset_queue is not None and urls:
+        await asset_queue.put((job, urls, cached_urls, cached_srcsets))
+        return
+    await finish_job(job, {**urls, **cached_urls}, cached_srcsets, manifest, jobs, writer, stats)
+
+async def finish_job(job, urls, srcsets, manifest, jobs, writer, stats):
+    """
+    Updates the frontmatter with the image URLs (and <field>_srcset values, if any), hands the
+    file to the atomic writer and records it in the manifest and the job queue once the write
+    has landed on disk.
+    """
+    md_path = job['path']
+    fm = job['frontmatter']
+    if BANNER_FIELD in urls:
+        update_banner_image_in_frontmatter(fm, urls[BANNER_FIELD])
+    if PORTRAIT_FIELD in urls:
+        update_portrait_image_in_frontmatter(fm, urls[PORTRAIT_FIELD])
+    for field, srcset in srcsets.items():
+        fm.set(f"{field}{SRCSET_SUFFIX}", srcset)
+    log_file_update(md_path, fm, lambda: sorted(urls) + [f"{field}{SRCSET_SUFFIX}" for field in srcsets])
+    new_md_text = fm.render()
+    digest = content_digest(new_md_text.encode('utf-8'))
+    valid = sorted(set(job['valid']) | set(urls))
+    def on_commit():
+        manifest.record(md_path, md_path.stat(), digest, 'complete', valid=valid)
+    # Temp file + rename off the event loop; the manifest and the job queue only learn about the
+    # file after the rename (a crash before it leaves the tasks in flight, to be claimed again).
+    # The manifest is loop-owned; the job queue's commit stays on the writer thread.
+    await writer.write_async(md_path, new_md_text, before=fm.original_block(), after=fm.block(), on_commit=on_commit,
+                             on_commit_in_thread=lambda: jobs.done(md_path))
+    stats['files_updated'] += 1
+    stats['images_generated'] += len(urls)
+    stats['images_by_style'][job['style']] += len(urls)
+
+async def worker(name, queue, session, in_flight, limiter, cache, metrics, asset_queue, manifest, jobs, writer, stats):
+    """
+    Consumer: pulls jobs off the queue until it receives the None sentinel.
+    Any unexpected error is logged per file so one bad file never stops a worker.
+    """
+    while True:
+        job = await queue.get()
+        try:
+            if job is None:
+                return
+            await process_job(job, session, in_flight, limiter, cache, metrics, asset_queue, manifest, jobs, writer, stats)
+        except Exception as e:
+            log.error('error', "{worker}: Unexpected failure for {path}: {error}", worker=name, path=job['path'], error=str(e))
+            stats['files_failed'] += 1
+            await jobs.afail(job['path'], e)
+        finally:
+            queue.task_done()
+
+# --- PIPELINE: ASSET STAGE ---
+async def asset_worker(name, asset_queue, session, assets, cache, manifest, jobs, writer, stats):
+    """
+    Second stage, running alongside the generation workers: downloads and re-hosts each
+    generated image (minified, with PNG derivatives when OPTIMIZE_ASSETS is on; the
+    optimization runs in a process pool), stores the durable URL and srcset in the prompt
+    cache, then finishes the file with them (and with the fields that were cache hits).
+    A re-hosting failure leaves the file untouched and caches nothing.
+    """
+    while True:
+        item = await asset_queue.get()
+        try:
+            if item is None:
+                return
+            job, urls, cached_urls, cached_srcsets = item
+            try:
+                hosted = await asyncio.gather(*(assets.rehost(session, url) for url in urls.values()))
+            except Exception as e:
+                log.error('error', "Re-hosting failed for {path}: {error} (file left unchanged)", path=job['path'], error=str(e))
+                stats['files_failed'] += 1
+                await jobs.afail(job['path'], e)
+                continue
+            srcsets = dict(cached_srcsets)
+            for field, result in zip(list(urls), hosted):
+                log.debug('asset', "{field} for {path}: {source} -> {url}", field=field, path=job['path'],
+                          source=urls[field], url=result['url'])
+                source, urls[field] = urls[field], result['url']
+                if result['derivatives']:
+                    srcsets[field] = ', '.join(f"{d['url']} {d['width']}w" for d in result['derivatives'])
+                if cache is not None:
+                    cache.put(job['prompt'], job['style_id'], FIELD_SIZES[field], result['url'],
+                              {'srcset': srcsets.get(field), 'source': source})
+            await finish_job(job, {**urls, **cached_urls}, srcsets, manifest, jobs, writer, stats)
+        except Exception as e:
+            log.error('error', "{worker}: Unexpected failure for {path}: {error}", worker=name, path=item[0]['path'], error=str(e))
+            stats['files_failed'] += 1
+            await jobs.afail(item[0]['path'], e)
+        finally:
+            asset_queue.task_done()
+
+def report_throughput(stats, elapsed):
+    """
+    Prints the end-of-run summary: counts plus files/min and images/min.
+    """
+    minutes = elapsed / 60 if elapsed > 0 else 0
+    files_per_min = stats['files_updated'] / minutes if minutes else 0.0
+    images_per_min = stats['images_generated'] / minutes if minutes else 0.0
+    log.info(
+        'summary',
+        "scanned: {files_scanned} | complete (index): {files_complete} | "
+        "unchanged (manifest): {files_unchanged} | updated: {files_updated} | "
+        "failed: {files_failed} | images: {images_generated} | "
+        "elapsed: {elapsed:.1f}s | {files_per_min:.1f} files/min | {images_per_min:.1f} images/min "
+        "(workers: {workers}, max in-flight: {max_in_flight})",
+        **{key: value for key, value in stats.items() if key != 'images_by_style'},
+        elapsed=elapsed, files_per_min=files_per_min, images_per_min=images_per_min,
+        workers=WORKER_COUNT, max_in_flight=MAX_IN_FLIGHT,
+    )
+    if stats['images_by_style']:
+        log.info('styles', "{text}", styles=dict(stats['images_by_style']),
+                 text=lambda: " | ".join(f"{name}: {count}" for name, count in stats['images_by_style'].most_common()))
 
 # --- MAIN ASYNC SCRIPT ---
-async def main_async():
+async def main_async(dry_run=False, mode='run'):
     # --- MIRRORED COMMENT BLOCK: portrait_image LOGIC ---
     # This function processes each markdown file and determines whether to generate/update 'portrait_image'.
     # All logic branches for 'portrait_image':
@@ -245,94 +721,108 @@ async def main_async():
     #   5. If portrait API call fails, logs error and continues.
     #   6. If portrait is generated, updates frontmatter and logs update.
     #   7. All skip/update conditions are logged with file path and reason for traceability.
-    # See also: update_portrait_image_in_frontmatter() for actual YAML update logic.
-    async with aiohttp.ClientSession() as session:
-        for md_path in PROMPT_DIR.rglob('*.md'):
-            print(f"[PROCESSING] {md_path}")
-            with md_path.open('r', encoding='utf-8') as f:
-                md_text = f.read()
-            # Extract frontmatter
-            frontmatter, rest = extract_frontmatter(md_text)
-            if not frontmatter:
-                print(f"[SKIP] No frontmatter in {md_path} (portrait_image not generated)")
-                continue
-            # Find the banner_image and portrait_image values in the frontmatter
-            banner_image_match = re.search(rf'^{BANNER_FIELD}:\s*(.*)', frontmatter, re.MULTILINE)
-            banner_image_val = banner_image_match.group(1) if banner_image_match else ''
-            portrait_image_match = re.search(rf'^{PORTRAIT_FIELD}:\s*(.*)', frontmatter, re.MULTILINE)
-            portrait_image_val = portrait_image_match.group(1) if portrait_image_match else ''
-            # Aggressively commented logic for checking if we should skip image generation for portrait_image and banner_image
-            # Only skip if the value is a valid image URL. If the value is a prompt (e.g., starts with 'image_prompt:'), treat as empty and generate the image.
-            # This replaces the previous logic that treated any non-empty string as a valid image.
-            print(f"[DEBUG] {md_path} | RAW portrait_image_val: '{portrait_image_val}' (type: {type(portrait_image_val)}) | RAW banner_image_val: '{banner_image_val}' (type: {type(banner_image_val)})")
-            # --- BEGIN OVERWRITE LOGIC FIX ---
-            # If OVERWRITE is True, never skip; always regenerate images even if valid image URLs are present.
-            if OVERWRITE:
-                skip_portrait = False
-                skip_banner = False
-                print(f"[DEBUG][OVERWRITE] OVERWRITE is True: Forcing regeneration of both portrait and banner images for {md_path}")
-            else:
-                if is_valid_image_url(portrait_image_val):
-                    print(f"[SKIP] portrait_image already present and non-empty (and OVERWRITE is False) in {md_path} (checked value: '{portrait_image_val}')")
-                    skip_portrait = True
-                else:
-                    skip_portrait = False
-                print(f"[DEBUG][skip_portrait_decision] skip_portrait: {skip_portrait} (portrait_image_val: '{portrait_image_val}')")
-                if is_valid_image_url(banner_image_val):
-                    print(f"[SKIP] banner_image already present and non-empty (and OVERWRITE is False) in {md_path} (checked value: '{banner_image_val}')")
-                    skip_banner = True
-                else:
-                    skip_banner = False
-                print(f"[DEBUG][skip_banner_decision] skip_banner: {skip_banner} (banner_image_val: '{banner_image_val}')")
-            # --- END OVERWRITE LOGIC FIX ---
-            # Extract prompt
-            prompt = extract_prompt_from_markdown(md_text)
-            if not prompt:
-                print(f"[SKIP] No prompt found in {md_path} (portrait_image not generated)")
-                continue
-            # Prepare async API calls as needed
-            banner_task = None
-            portrait_task = None
-            if RUN_BANNERS and not skip_banner:
-                banner_task = generate_recraft_image_async(prompt, BANNER_SIZE, session)
-            if RUN_PORTRAITS and not skip_portrait:
-                portrait_task = generate_recraft_image_async(prompt, PORTRAIT_SIZE, session)
-            # If both tasks are needed, run them in parallel
-            if banner_task and portrait_task:
-                try:
-                    banner_url, portrait_url = await asyncio.gather(banner_task, portrait_task)
-                except Exception as e:
-                    print(f"[ERROR] API call failed for {md_path}: {e} (portrait_image and/or banner_image not generated)")
-                    continue
-                new_frontmatter = update_banner_image_in_frontmatter(frontmatter, banner_url)
-                new_frontmatter = update_portrait_image_in_frontmatter(new_frontmatter, portrait_url)
-                log_file_update(md_path, new_frontmatter)
-                new_md_text = new_frontmatter + rest
-                with md_path.open('w', encoding='utf-8') as f:
-                    f.write(new_md_text)
-            elif banner_task:
-                try:
-                    banner_url = await banner_task
-                except Exception as e:
-                    print(f"[ERROR] Banner API call failed for {md_path}: {e}")
-                    continue
-                new_frontmatter = update_banner_image_in_frontmatter(frontmatter, banner_url)
-                log_file_update(md_path, new_frontmatter)
-                new_md_text = new_frontmatter + rest
-                with md_path.open('w', encoding='utf-8') as f:
-                    f.write(new_md_text)
-            elif portrait_task:
-                try:
-                    portrait_url = await portrait_task
-                except Exception as e:
-                    print(f"[ERROR] Portrait API call failed for {md_path}: {e}")
-                    continue
-                new_frontmatter = update_portrait_image_in_frontmatter(frontmatter, portrait_url)
-                log_file_update(md_path, new_frontmatter)
-                new_md_text = new_frontmatter + rest
-                with md_path.open('w', encoding='utf-8') as f:
-                    f.write(new_md_text)
+    # See also: plan_file() for the skip decisions, process_job() for the API calls,
+    # and update_portrait_image_in_frontmatter() for actual YAML update logic.
+    #
+    # Pipeline: one producer (plan_file) feeds a bounded queue consumed by WORKER_COUNT
+    # workers. All workers share the single aiohttp session, and the in_flight semaphore
+    # caps concurrent Recraft requests at MAX_IN_FLIGHT regardless of worker count.
+    # The producer claims files from the durable job queue (one per PROMPT_DIR), so a stopped run resumes there.
+    jobs = job_queue.JobQueue(job_queue.queue_name('recraft', PROMPT_DIR))
+    if mode == 'status':
+        job_queue.report_status(jobs, log)
+        jobs.close()
+        return
+    stats = {
+        'files_scanned': 0,
+        'files_complete': 0,
+        'files_unchanged': 0,
+        'files_updated': 0,
+        'files_failed': 0,
+        'images_generated': 0,
+        'images_by_style': Counter(),
+    }
+    queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+    limiter = AdaptiveRateLimiter(rate=RATE_START, min_rate=RATE_MIN, max_rate=RATE_MAX)
+    manifest = RunManifest(MANIFEST_PATH)
+    writer = BatchedWriter(dry_run=dry_run, batch_size=WRITE_BATCH_SIZE)
+    # Only re-hosted URLs outlive the cache TTL, so there is nothing to cache without an uploader
+    cache = PromptCache(PROMPT_CACHE_PATH, PROMPT_CACHE_TTL, PROMPT_CACHE_MAX_ENTRIES) if USE_PROMPT_CACHE and ASSET_UPLOADER != 'none' else None
+    metrics = RunMetrics(METRICS_PATH)
+    assets = None
+    asset_queue = None
+    optimizer = None
+    if ASSET_UPLOADER != 'none' and dry_run:
+        log.info('dry_run', "Asset re-hosting ({uploader}) skipped; diffs show the Recraft URLs", uploader=ASSET_UPLOADER)
+    elif ASSET_UPLOADER != 'none':
+        uploader = make_uploader(
+            ASSET_UPLOADER, public_dir=ASSET_PUBLIC_DIR, base_url=ASSET_BASE_URL, private_key=IMAGEKIT_PRIVATE_KEY,
+            upload_endpoint=IMAGEKIT_UPLOAD_ENDPOINT, folder=IMAGEKIT_FOLDER,
+        )
+        if OPTIMIZE_ASSETS:
+            optimizer = AssetOptimizer(DERIVATIVE_WIDTHS, OPTIMIZE_PROCESSES)
+            if DERIVATIVE_WIDTHS and raster_backend() is None:
+                log.warning('optimize', "cairosvg not installed: uploading minified SVGs without PNG derivatives, no srcset is recorded (pip install cairosvg)")
+        assets = AssetPipeline(AssetStore(ASSET_DIR), uploader, ASSET_CONCURRENCY, optimizer)
+        asset_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    started = time.monotonic()
+    leases = asyncio.create_task(job_queue.renew_leases(jobs))
+    try:
+        async with aiohttp.ClientSession() as session:
+            workers = [
+                asyncio.create_task(worker(f"worker-{i+1}", queue, session, in_flight, limiter, cache, metrics, asset_queue, manifest, jobs, writer, stats))
+                for i in range(WORKER_COUNT)
+            ]
+            asset_workers = [
+                asyncio.create_task(asset_worker(f"asset-worker-{i+1}", asset_queue, session, assets, cache, manifest, jobs, writer, stats))
+                for i in range(ASSET_CONCURRENCY if assets is not None else 0)
+            ]
+            await produce_jobs(queue, manifest, jobs, mode, stats)
+            await asyncio.gather(*workers)
+            # Generation is done; let the asset stage drain, then stop it
+            for _ in asset_workers:
+                await asset_queue.put(None)
+            await asyncio.gather(*asset_workers)
+    finally:
+        # Land pending writes first (their commit callbacks update the manifest and the job
+        # queue), then compact the manifest even on Ctrl-C, decisions already made are kept.
+        # Tasks still held (interrupted, or a dry run) go back to pending for the next run.
+        leases.cancel()
+        await writer.aclose()
+        manifest.save()
+        jobs.release_held()
+        if cache is not None:
+            cache.close()
+        if assets is not None:
+            assets.store.close()
+        if optimizer is not None:
+            optimizer.close()
+        # Latency percentiles even for an interrupted run
+        metrics.report(log)
+        metrics.close()
+    report_throughput(stats, time.monotonic() - started)
+    job_queue.report_status(jobs, log, limit=0)
+    jobs.close()
+    log.info('rate_limit', "throttled responses: {throttled} | final rate: {rate:.2f} req/s",
+             throttled=limiter.throttled, rate=limiter.rate)
+    if cache is not None:
+        log.info('prompt_cache', "hits: {hits} | misses: {misses}", hits=cache.hits, misses=cache.misses)
+    if assets is not None:
+        log.info('assets', "downloaded: {downloaded} | reused: {reused} | uploaded ({uploader}): {uploaded}{optimized_text}",
+                 downloaded=assets.store.downloads, reused=assets.store.reused, uploader=assets.uploader.name,
+                 uploaded=assets.uploads, optimized=optimizer.optimized if optimizer is not None else None,
+                 optimized_text=f" | optimized: {optimizer.optimized}" if optimizer is not None else '')
+    if dry_run:
+        log.info('dry_run', "{diffs} file(s) would be updated, nothing was written", diffs=writer.diffs)
 
 # --- ENTRYPOINT ---
 if __name__ == "__main__":
-    asyncio.run(main_async())
+    parser = argparse.ArgumentParser(description="Generate Recraft banner/portrait images for markdown files in PROMPT_DIR.")
+    parser.add_argument('--dry-run', action='store_true',
+                        help="print a unified diff of each frontmatter change instead of writing files")
+    job_queue.add_arguments(parser)
+    logging_setup.add_arguments(parser)
+    args = parser.parse_args()
+    logging_setup.configure_from_args(args)
+    asyncio.run(main_async(dry_run=args.dry_run, mode=args.jobs_mode))
@@ -1,43 +1,99 @@
 """
 Script: generate-style-recraft.py
-Purpose: Generate a custom style for image requests using the Recraft API, following the canonical structure in ai-labs/recraft/generate-image-style-recraft.md.
+Purpose: Generate custom styles for image requests using the Recraft API, following the canonical structure in ai-labs/recraft/generate-image-style-recraft.md.
 
-This script logs all requests, responses, and file outputs, and validates response structure against the sample in the input file. It does NOT hardcode field names or structure, but reads and parses the canonical sample from the markdown file.
+- Takes any number of named image sets (e.g. one per product brand) and creates one Recraft style per set
+- Uploads are streamed: each reference image is sent from its open file in chunks by aiohttp's
+  multipart writer, so memory stays constant however large the images are
+- Styles are created concurrently (at most --concurrency at once) over one pooled aiohttp session,
+  with 429/5xx retried using jittered backoff that honors Retry-After
+- Results are appended to the style registry keyed by set name (styles-registry-recraft.jsonl, see
+  ai-labs/utils/content_pipeline/style_registry.py); sets already registered with the same images are
+  skipped unless --force. The image scripts then pick a style by name
+- Logs through the shared structured logger (ai-labs/utils/content_pipeline/log.py): one info event per
+  set, request/response bodies only at --log-level debug, JSON lines with --log-format json
+- Records each upload's wall time, time-to-first-byte and retries (METRICS_PATH, JSON lines) and
+  reports p50/p95/p99 at the end of the run
+- Validates every response against the sample in the spec file. It does NOT hardcode field names or
+  structure, but reads and parses the canonical sample from the markdown file.
+
+Image sets come from --sets (a JSON file) and/or --set NAME=PATH[,PATH...]; a PATH may be a directory
+(all of its .png files). Without either, the images listed in the spec file form the set "default".
+
+    {"lossless": {"style": "digital_illustration", "images": ["visuals/lossless/"]},
+     "augment-it": ["visuals/augment-it/one.png", "visuals/augment-it/two.png"]}
+
+Usage:
+    python generate-style-recraft.py --sets brand-sets.json --concurrency 4
+    python generate-style-recraft.py --set lossless=visuals/lossless --set augment-it=visuals/augment-it --dry-run
 
 Author: Michael Staton
 """
 
 import os
+import re
 import sys
 import json
-import requests
-import re
-from datetime import datetime
+import time
+import asyncio
+import hashlib
+import argparse
+import contextlib
 from pathlib import Path
+
+import aiohttp
 from dotenv import load_dotenv
 
+# Shared pipeline helpers live in ai-labs/utils/content_pipeline
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+from content_pipeline.rate_limit import RETRYABLE_STATUSES, parse_retry_after, backoff_delay
+from content_pipeline.style_registry import StyleRegistry
+from content_pipeline import log as logging_setup
+from content_pipeline.metrics import RunMetrics, track
+
+log = logging_setup.get_logger('recraft-styles')
+
 # --- ENV VARS ---
 # Load environment variables from .env if present (for local/dev parity)
 load_dotenv()
 RECRAFT_API_TOKEN = os.environ.get("RECRAFT_API_TOKEN")
 if not RECRAFT_API_TOKEN:
-    print("[ERROR] RECRAFT_API_TOKEN not set in environment!")
+    log.error('error', "RECRAFT_API_TOKEN not set in environment!")
     sys.exit(1)
 
 # --- CONFIGURATION ---
 INPUT_SPEC_PATH = Path(__file__).parent / "generate-image-style-recraft.md"
-OUTPUT_PATH = Path(__file__).parent / "styles-recraft.json"
-RECRAFT_API_URL = "https://external.api.recraft.ai/v1/styles"
+REGISTRY_PATH = Path(os.environ.get("RECRAFT_STYLE_REGISTRY", Path(__file__).parent / "styles-registry-recraft.jsonl"))
+RECRAFT_API_URL = os.environ.get("RECRAFT_STYLES_URL", "https://external.api.recraft.ai/v1/styles")
+DEFAULT_BASE_STYLE = "digital_illustration"
+DEFAULT_CONCURRENCY = int(os.environ.get("RECRAFT_STYLE_CONCURRENCY", "4"))
+# Per-request latency records (JSON lines, see content_pipeline/metrics.py); "" turns the file off
+METRICS_PATH = os.environ.get("RECRAFT_STYLE_METRICS_PATH", str(Path(__file__).parent / ".recraft-style-metrics.jsonl")) or None
+
+# API limits for one style (see the spec): at most 5 PNG images, 5MB in total
+MAX_IMAGES_PER_STYLE = 5
+MAX_TOTAL_BYTES = 5 * 1024 * 1024
+IMAGE_SUFFIXES = ('.png',)
+
+# --- RETRY POLICY ---
+MAX_RETRIES = 4
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+# Uploads can be slow; only fail a request that makes no progress for this long
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=120)
+HASH_CHUNK = 1024 * 1024
 
 # --- LOGGING HELPERS ---
-def log_request_out(url, headers, files, data):
-    print(f"[REQUEST OUT] URL: {url}\nHeaders: {headers}\nFiles: {list(files.keys())}\nData: {data}\n{'-'*40}")
+# Request/response dumps are debug events: a single level check unless --log-level debug
+def log_request_out(set_name, url, images, data):
+    log.debug('request_out', "[{set}] URL: {url}\nFiles: {files}\nData: {data}", set=set_name, url=url,
+              files=lambda: [str(p) for p in images], data=data)
 
-def log_response_in(resp):
-    print(f"[RESPONSE IN] Status: {resp.status_code}\nResponse: {resp.text}\n{'-'*40}")
+def log_response_in(set_name, status, text):
+    log.debug('response_in', "[{set}] Status: {status}\nResponse: {response}", set=set_name, status=status, response=text)
 
 def log_file_output(filepath, content):
-    print(f"[FILE OUTPUT] {filepath}\nContent:\n{content}\n{'-'*40}")
+    log.debug('file_output', "{path}\nContent:\n{content}", path=filepath, content=content)
 
 # --- UTILITY: Parse canonical structure from markdown spec ---
 def extract_sample_json_from_md(md_path):
@@ -51,67 +107,242 @@ def extract_sample_json_from_md(md_path):
         try:
             return json.loads(match.group(1))
         except Exception as e:
-            print(f"[ERROR] Failed to parse JSON example from spec: {e}")
+            log.error('error', "Failed to parse JSON example from spec: {error}", error=str(e))
             return None
-    print("[ERROR] No JSON example found in spec.")
+    log.error('error', "No JSON example found in spec.")
     return None
 
+def extract_spec_images(md_path):
+    """
+    Returns the image paths listed under '## Images to input for Style:' in the spec (one
+    backticked path per line), used as the "default" set when no sets are given.
+    """
+    text = md_path.read_text(encoding="utf-8")
+    section = text.split("## Images to input for Style:", 1)
+    if len(section) < 2:
+        return []
+    return re.findall(r'^`([^`]+)`\s*$', section[1], re.MULTILINE)
+
+# --- IMAGE SETS ---
+def expand_images(paths, base_dir):
+    """
+    Resolves a list of image paths (relative to base_dir) into files; a directory contributes
+    its PNG files in name order.
+    """
+    images = []
+    for raw in paths:
+        path = Path(raw).expanduser()
+        if not path.is_absolute():
+            path = base_dir / path
+        if path.is_dir():
+            images.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            images.append(path)
+    return images
+
+def load_sets(sets_file, set_args, base_style):
+    """
+    Builds {set name: {'style': ..., 'images': [Path, ...]}} from --sets and --set arguments.
+    Falls back to the spec's image list as the set "default".
+    """
+    sets = {}
+    if sets_file:
+        sets_path = Path(sets_file)
+        with open(sets_path, encoding="utf-8") as f:
+            raw_sets = json.load(f)
+        for name, spec in raw_sets.items():
+            if isinstance(spec, (str, list)):
+                spec = {"images": spec}
+            paths = spec.get("images", [])
+            if isinstance(paths, str):
+                paths = [paths]
+            sets[name] = {
+                "style": spec.get("style", base_style),
+                "images": expand_images(paths, sets_path.parent),
+            }
+    for arg in set_args or []:
+        name, sep, paths = arg.partition("=")
+        if not sep or not name or not paths:
+            raise ValueError(f"--set expects NAME=PATH[,PATH...], got {arg!r}")
+        sets[name] = {"style": base_style, "images": expand_images(paths.split(","), Path.cwd())}
+    if not sets:
+        sets["default"] = {"style": base_style, "images": expand_images(extract_spec_images(INPUT_SPEC_PATH), Path.cwd())}
+    return sets
+
+def validate_set(name, image_set):
+    """
+    Returns a list of problems with a set (missing files, wrong type, over the API limits);
+    empty if it can be uploaded.
+    """
+    images = image_set["images"]
+    problems = []
+    if not images:
+        problems.append("no images")
+    if len(images) > MAX_IMAGES_PER_STYLE:
+        problems.append(f"{len(images)} images (max {MAX_IMAGES_PER_STYLE})")
+    total = 0
+    for path in images:
+        if not path.is_file():
+            problems.append(f"not a file: {path}")
+            continue
+        if path.suffix.lower() not in IMAGE_SUFFIXES:
+            problems.append(f"not a PNG: {path}")
+        total += path.stat().st_size
+    if total > MAX_TOTAL_BYTES:
+        problems.append(f"{total / 1024 / 1024:.1f}MB of images (max {MAX_TOTAL_BYTES // 1024 // 1024}MB)")
+    return problems
+
+def set_fingerprint(image_set):
+    """
+    Hash of the base style and every image's name and bytes (read in chunks), so a set whose
+    images change is recreated on the next run while an unchanged one is skipped.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(image_set["style"].encode("utf-8"))
+    for path in image_set["images"]:
+        digest.update(b"\0" + path.name.encode("utf-8") + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+# --- API CALL ---
+async def create_style(session, name, image_set, canonical, metrics=None):
+    """
+    Uploads one image set and returns the validated style JSON. The multipart body is rebuilt
+    for every attempt from freshly opened files; aiohttp streams each file in chunks.
+    With a RunMetrics, the upload is one 'recraft.style' record (wall time, TTFB, retries).
+    """
+    headers = {"Authorization": f"Bearer {RECRAFT_API_TOKEN}"}
+    data = {"style": image_set["style"]}
+    with track(metrics, "recraft.style", set=name, images=len(image_set["images"])) as sample:
+        for attempt in range(1, MAX_RETRIES + 2):
+            log_request_out(name, RECRAFT_API_URL, image_set["images"], data)
+            retry_after = None
+            sample.attempt()
+            try:
+                with contextlib.ExitStack() as stack:
+                    form = aiohttp.FormData()
+                    form.add_field("style", image_set["style"])
+                    for idx, path in enumerate(image_set["images"]):
+                        form.add_field(f"file{idx+1}", stack.enter_context(open(path, "rb")),
+                                       filename=path.name, content_type="image/png")
+                    async with session.post(RECRAFT_API_URL, headers=headers, data=form) as resp:
+                        sample.first_byte()
+                        text = await resp.text()
+                        log_response_in(name, resp.status, text)
+                        if resp.status == 200:
+                            response_json = json.loads(text)
+                            # Only check that all canonical keys exist at top-level
+                            missing = [k for k in canonical if k not in response_json]
+                            if missing:
+                                raise RuntimeError(f"Missing required fields in response: {missing}")
+                            return response_json
+                        if resp.status not in RETRYABLE_STATUSES:
+                            raise RuntimeError(f"Recraft API error {resp.status}: {text}")
+                        retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+                        error_detail = f"Recraft API error {resp.status}: {text}"
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error_detail = f"Recraft API connection error: {e!r}"
+            if attempt > MAX_RETRIES:
+                raise RuntimeError(f"{error_detail} (gave up after {attempt} attempts)")
+            delay = backoff_delay(attempt, RETRY_BASE_DELAY, RETRY_MAX_DELAY, retry_after)
+            log.warning('retry', "[{set}] {error} | attempt {attempt}/{max_retries}, sleeping {delay:.1f}s",
+                        set=name, error=error_detail, attempt=attempt, max_retries=MAX_RETRIES, delay=delay)
+            await asyncio.sleep(delay)
+
 # --- MAIN LOGIC ---
-def main():
+async def main_async(sets, concurrency, force=False, dry_run=False):
     # 1. Extract canonical structure from spec
     canonical = extract_sample_json_from_md(INPUT_SPEC_PATH)
     if not canonical:
-        print("[ERROR] Could not determine canonical output structure. Aborting.")
-        sys.exit(1)
+        log.error('error', "Could not determine canonical output structure. Aborting.")
+        return 1
 
-    # 2. Prepare request (see sample in spec)
-    # For demonstration, use the sample images and style from the markdown spec
-    files = {}
-    images = [
-        "/Users/mpstaton/code/lossless-monorepo/content/visuals/Illustration__Creative-Assembly-Line.png",
-        "/Users/mpstaton/code/lossless-monorepo/content/visuals/pictographOf_AI-Consumer.png",
-        "/Users/mpstaton/code/lossless-monorepo/content/visuals/pictographOf_Assembly-Line.png",
-        "/Users/mpstaton/code/lossless-monorepo/content/visuals/pictographOf_BusinessStrategy.png",
-    ]
-    for idx, img_path in enumerate(images):
-        files[f"file{idx+1}"] = open(img_path, "rb")
-    data = {"style": "digital_illustration"}
-    headers = {"Authorization": f"Bearer {RECRAFT_API_TOKEN}"}
+    # 2. Validate every set and skip the ones the registry already has (same images, same base style)
+    registry = StyleRegistry(REGISTRY_PATH)
+    todo = {}
+    failed = []
+    for name, image_set in sets.items():
+        problems = validate_set(name, image_set)
+        if problems:
+            log.warning('skip', "[{set}] {problems}", set=name, reason='invalid', problems='; '.join(problems))
+            failed.append(name)
+            continue
+        image_set["fingerprint"] = set_fingerprint(image_set)
+        known = registry.get(name)
+        if known and known.get("fingerprint") == image_set["fingerprint"] and not force:
+            log.info('skip', "[{set}] already registered as style {style_id} (use --force to recreate)",
+                     set=name, reason='registered', style_id=known.get('id'))
+            continue
+        todo[name] = image_set
+    log.info('plan', "{sets} set(s): {create} to create, {invalid} invalid, {registered} already registered",
+             sets=len(sets), create=len(todo), invalid=len(failed), registered=len(sets) - len(todo) - len(failed))
+    if dry_run:
+        for name, image_set in todo.items():
+            log.info('dry_run', "[{set}] would create a {style} style from {images} image(s)",
+                     set=name, style=image_set['style'], images=len(image_set['images']))
+        return 1 if failed else 0
+
+    # 3. Create the styles concurrently over one pooled session; each success is appended to the
+    #    registry right away, so a crash mid-run keeps the styles already paid for
+    started = time.monotonic()
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    created = []
+    metrics = RunMetrics(METRICS_PATH)
+
+    async def run_one(session, name, image_set):
+        async with semaphore:
+            try:
+                response_json = await create_style(session, name, image_set, canonical, metrics)
+            except Exception as e:
+                log.error('error', "[{set}] {error}", set=name, error=str(e))
+                failed.append(name)
+                return
+        registry.register(
+            name, response_json.get("id"),
+            style=image_set["style"],
+            images=[str(p) for p in image_set["images"]],
+            fingerprint=image_set["fingerprint"],
+            response=response_json,
+        )
+        created.append(name)
+        log.info('created', "[{set}] style {style_id}", set=name, style_id=response_json.get('id'))
 
-    # 3. Log outgoing request
-    log_request_out(RECRAFT_API_URL, headers, files, data)
     try:
-        resp = requests.post(RECRAFT_API_URL, headers=headers, files=files, data=data)
+        async with aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT) as session:
+            await asyncio.gather(*(run_one(session, name, image_set) for name, image_set in todo.items()))
     finally:
-        for f in files.values():
-            f.close()
+        metrics.report(log)
+        metrics.close()
 
-    # 4. Log incoming response
-    log_response_in(resp)
-    if resp.status_code != 200:
-        print(f"[ERROR] API returned error: {resp.status_code} {resp.text}")
-        sys.exit(1)
-    try:
-        response_json = resp.json()
-    except Exception as e:
-        print(f"[ERROR] Failed to parse JSON from response: {e}")
-        sys.exit(1)
+    # 4. Report
+    if created:
+        log_file_output(REGISTRY_PATH, lambda: json.dumps({name: registry.get(name) for name in created}, indent=2))
+    log.info('done', "created: {created} | failed: {failed} | elapsed: {elapsed:.1f}s (concurrency: {concurrency})",
+             created=len(created), failed=len(failed), elapsed=time.monotonic() - started, concurrency=concurrency)
+    return 1 if failed else 0
 
-    # 5. Validate response structure
-    # Only check that all canonical keys exist at top-level
-    missing = [k for k in canonical if k not in response_json]
-    if missing:
-        print(f"[ERROR] Missing required fields in response: {missing}")
+def main():
+    parser = argparse.ArgumentParser(description="Create Recraft styles from one or more image sets.")
+    parser.add_argument("--sets", help="JSON file mapping set name -> image paths/dirs (or {style, images})")
+    parser.add_argument("--set", dest="set_args", action="append", metavar="NAME=PATH[,PATH...]",
+                        help="add an image set; a PATH may be a directory of PNGs (repeatable)")
+    parser.add_argument("--style", default=DEFAULT_BASE_STYLE, help=f"base style (default: {DEFAULT_BASE_STYLE})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"styles created at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--force", action="store_true", help="recreate sets already in the registry")
+    parser.add_argument("--dry-run", action="store_true", help="validate the sets and print the plan only")
+    logging_setup.add_arguments(parser)
+    args = parser.parse_args()
+    logging_setup.configure_from_args(args)
+    try:
+        sets = load_sets(args.sets, args.set_args, args.style)
+    except (OSError, ValueError) as e:
+        log.error('error', "Could not load image sets: {error}", error=str(e))
         sys.exit(1)
-
-    # 6. Write output file (with timestamp if needed)
-    out_path = OUTPUT_PATH
-    if out_path.exists():
-        ts = datetime.now().strftime("%Y-%m-%dT%H-%M-%S")
-        out_path = out_path.with_name(f"styles-recraft-{ts}.json")
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(response_json, f, indent=2)
-    log_file_output(out_path, json.dumps(response_json, indent=2))
+    sys.exit(asyncio.run(main_async(sets, max(1, args.concurrency), args.force, args.dry_run)))
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,32 @@
+"""
+Package: content_pipeline
+Shared helpers for the content-generation scripts under ai-labs/apis (Recraft, MSTY/Ollama, Anthropic).
+
+The scripts themselves live in hyphenated files and cannot import each other, so anything
+two or more of them need lives here. Each script puts ai-labs/utils on sys.path before importing:
+
+    sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'utils'))
+    from content_pipeline.rate_limit import AdaptiveRateLimiter
+
+Modules:
+- frontmatter: single-pass, lossless frontmatter parser/writer (O(1) field get/set, only changed lines rewritten)
+- json_stream: incremental scanner that detects the first complete JSON object in streamed model output
+- rate_limit: token-bucket limiter with AIMD backoff, Retry-After parsing and jittered retry delays
+- manifest: JSON-lines run manifest keyed by path/mtime/size/content hash, for incremental reruns
+- prompt_cache: SQLite prompt -> generated-URL cache with TTL and LRU eviction
+- writes: atomic temp-file + rename writer with batched fsync, thread-pool async writes and a dry-run diff mode
+- condense: token-budgeted markdown condensing (headings, section openers, key sections) and map-reduce summaries
+- generic: precompiled single-regex generic/placeholder-output detector with pattern files and a batch check_many()
+- scan: os.scandir tree walk + SQLite frontmatter index (heads re-read only for changed files) to select work without opening every file
+- style_registry: append-only JSON-lines registry of named Recraft styles, indexed in memory on first lookup
+- assets: streamed, content-addressed download store with a JSON-lines log and pluggable uploaders (local dir, ImageKit)
+- svg_optimize: SVG minifier and process-pool PNG derivative renderer (optional cairosvg) for generated vector assets
+- log: shared structured logging (level-gated, lazily formatted, text or JSON lines)
+- metrics: per-request wall time, TTFB, retries and tokens to JSON lines, with p50/p95/p99 run reports
+- jobs: durable SQLite per-file/per-field job queue with leases, resume, failure retry, multi-process claims and --workers hash sharding
+- packing: first-fit-decreasing binning of small items into shared requests under a size budget
+- stubs: local aiohttp stand-ins for the provider APIs, for offline runs
+
+bench_frontmatter.py compares the shared parser against the old regex + split/join approach.
+bench_pipelines.py runs the scripts end to end against the stubs on a synthetic corpus (files/sec, peak memory, p95).
+"""
@@ -0,0 +1,372 @@
+"""
+Module: assets
+Local asset pipeline for generated images: download once, store by content hash, re-host, and
+hand back a durable URL for the frontmatter (provider URLs such as Recraft's are temporary).
+
+- AssetStore streams each download to a temp file in CHUNK_SIZE pieces while hashing it, then
+  moves it to <root>/<digest[:2]>/<digest>.<ext>. Image bytes are never held in memory, and two
+  URLs with identical bytes share one file.
+- Every download and upload is appended to <root>/assets.jsonl (last record wins, like the run
+  manifest), so a URL seen before is never fetched again and a digest already hosted by an
+  uploader is never uploaded again. Concurrent requests for the same URL share one download.
+- Optimized variants of an asset (minified SVG, PNG derivatives; see svg_optimize.py) are stored
+  next to it as <digest><variant>.<ext> and logged too, so they are produced and uploaded once.
+- Uploaders are pluggable: anything with `name` and `async upload(session, path, asset)` returning
+  a URL. LocalUploader publishes into a directory served by the site (hard link, else copy);
+  ImageKitUploader streams the file to the ImageKit upload API as multipart. Both get the caller's
+  pooled aiohttp session.
+
+Usage:
+    store = AssetStore(Path('.recraft-assets'))
+    pipeline = AssetPipeline(store, make_uploader('local', public_dir=..., base_url='/visuals/recraft'), concurrency=8)
+    hosted = await pipeline.rehost(session, recraft_url)   # {'url': ..., 'derivatives': [...]}
+    store.close()
+"""
+
+import os
+import json
+import base64
+import shutil
+import asyncio
+import hashlib
+import tempfile
+import contextlib
+from pathlib import Path
+
+import aiohttp
+
+from .rate_limit import RETRYABLE_STATUSES, parse_retry_after, backoff_delay
+from .log import get_logger
+
+CHUNK_SIZE = 64 * 1024
+MAX_RETRIES = 3
+
+log = get_logger('assets')
+
+# content-type -> file extension for the formats the image APIs return
+EXTENSIONS = {
+    'image/svg+xml': 'svg',
+    'image/png': 'png',
+    'image/jpeg': 'jpg',
+    'image/webp': 'webp',
+    'image/gif': 'gif',
+}
+
+
+def _extension(content_type, url):
+    ext = EXTENSIONS.get((content_type or '').split(';')[0].strip().lower())
+    if ext:
+        return ext
+    suffix = Path(url.split('?', 1)[0]).suffix.lstrip('.').lower()
+    return suffix if suffix.isalnum() and len(suffix) <= 5 else 'bin'
+
+
+async def _with_retries(label, attempt_once):
+    """Runs `attempt_once()` (returns a result, or raises _Retryable) with jittered backoff."""
+    for attempt in range(1, MAX_RETRIES + 2):
+        try:
+            return await attempt_once()
+        except _Retryable as e:
+            detail, retry_after = str(e), e.retry_after
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            detail, retry_after = f"connection error: {e!r}", None
+        if attempt > MAX_RETRIES:
+            raise RuntimeError(f"{label}: {detail} (gave up after {attempt} attempts)")
+        delay = backoff_delay(attempt, 1.0, 30.0, retry_after)
+        log.warning('asset_retry', "{label}: {error} | attempt {attempt}/{max_retries}, sleeping {delay:.1f}s",
+                    label=label, error=detail, attempt=attempt, max_retries=MAX_RETRIES, delay=delay)
+        await asyncio.sleep(delay)
+
+
+class _Retryable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _check_status(resp, text=''):
+    if resp.status in RETRYABLE_STATUSES:
+        raise _Retryable(f"HTTP {resp.status} {text[:200]}", parse_retry_after(resp.headers.get('Retry-After')))
+    if resp.status >= 400:
+        raise RuntimeError(f"HTTP {resp.status} {text[:200]}")
+
+
+class AssetStore:
+    """
+    Content-addressed asset directory plus its JSON-lines log. Not thread-safe; one per process
+    (async callers share it freely).
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.log_path = self.root / 'assets.jsonl'
+        self.by_url = {}      # source URL -> asset {'digest', 'ext', 'size', 'content_type'}
+        self.hosted = {}      # (uploader name, digest, variant) -> durable URL
+        self.variants = {}    # digest -> optimized variant assets (minified first)
+        self.downloads = 0
+        self.reused = 0
+        self._pending = {}    # source URL -> Future of an in-progress download
+        self._log = None
+        self.load()
+
+    def load(self):
+        """Reads the log, tolerating a truncated last line from an interrupted run."""
+        if not self.log_path.exists():
+            return
+        with self.log_path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get('kind') == 'upload':
+                    self.hosted[(record['uploader'], record['digest'], record.get('variant', ''))] = record['hosted_url']
+                elif record.get('kind') == 'variants':
+                    self.variants[record['digest']] = record['variants']
+                else:
+                    self.by_url[record['url']] = {k: record[k] for k in ('digest', 'ext', 'size', 'content_type')}
+
+    def _append(self, record):
+        if self._log is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._log = self.log_path.open('a', encoding='utf-8')
+        self._log.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self._log.flush()
+
+    def path_for(self, asset):
+        return self.root / asset['digest'][:2] / f"{asset['digest']}{asset.get('variant', '')}.{asset['ext']}"
+
+    async def fetch(self, session, url):
+        """
+        Returns the stored asset for `url`, downloading it only if this URL was never stored (or
+        its file went missing). Simultaneous calls for one URL wait on the same download.
+        """
+        asset = self.by_url.get(url)
+        if asset is not None and self.path_for(asset).exists():
+            self.reused += 1
+            return asset
+        pending = self._pending.get(url)
+        if pending is not None:
+            self.reused += 1
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[url] = future
+        try:
+            asset = await _with_retries(f"download {url}", lambda: self._download(session, url))
+            future.set_result(asset)
+            return asset
+        except BaseException as e:
+            future.set_exception(e)
+            # Nobody else may be waiting; don't let the event loop warn about an unretrieved error
+            future.exception()
+            raise
+        finally:
+            del self._pending[url]
+
+    async def _download(self, session, url):
+        """One streamed download: chunks go to a temp file and into the hash, never into a buffer."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.blake2b(digest_size=16)
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=str(self.root), prefix='.download-', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                async with session.get(url) as resp:
+                    _check_status(resp)
+                    content_type = resp.headers.get('Content-Type', '')
+                    async for chunk in resp.content.iter_chunked(CHUNK_SIZE):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        size += len(chunk)
+            asset = {'digest': digest.hexdigest(), 'ext': _extension(content_type, url), 'size': size,
+                     'content_type': content_type.split(';')[0].strip()}
+            final_path = self.path_for(asset)
+            if final_path.exists():
+                # Same bytes already stored under another URL: keep the existing file
+                os.unlink(tmp_path)
+            else:
+                final_path.parent.mkdir(parents=True, exist_ok=True)
+                # mkstemp files are owner-only; published (hard-linked) assets must be readable by the web server
+                os.chmod(tmp_path, 0o644)
+                os.replace(tmp_path, final_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(tmp_path)
+            raise
+        self.downloads += 1
+        self.by_url[url] = asset
+        self._append({'kind': 'download', 'url': url, **asset})
+        return asset
+
+    def hosted_url(self, uploader, asset):
+        return self.hosted.get((uploader, asset['digest'], asset.get('variant', '')))
+
+    def record_upload(self, uploader, asset, hosted_url):
+        variant = asset.get('variant', '')
+        self.hosted[(uploader, asset['digest'], variant)] = hosted_url
+        self._append({'kind': 'upload', 'uploader': uploader, 'digest': asset['digest'], 'variant': variant,
+                      'hosted_url': hosted_url})
+
+    def variants_for(self, asset):
+        """The recorded optimized variants of an asset, or None if missing (or any file is gone)."""
+        variants = self.variants.get(asset['digest'])
+        if variants and all(self.path_for(v).exists() for v in variants):
+            return variants
+        return None
+
+    def record_variants(self, asset, found):
+        """Stores the variant descriptions returned by the optimizer as assets of their own."""
+        variants = [{'digest': asset['digest'], **variant} for variant in found]
+        self.variants[asset['digest']] = variants
+        self._append({'kind': 'variants', 'digest': asset['digest'], 'variants': variants})
+        return variants
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+
+class LocalUploader:
+    """
+    Publishes assets into `public_dir` (e.g. the site's public/ folder) and returns
+    `base_url`/<digest[:2]>/<digest>.<ext>. Stand-in for a CDN on local and offline runs.
+    """
+
+    name = 'local'
+
+    def __init__(self, public_dir, base_url):
+        self.public_dir = Path(public_dir)
+        self.base_url = base_url.rstrip('/')
+
+    def _publish(self, path, relative):
+        target = self.public_dir / relative
+        if target.exists():
+            return
+        target.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(path, target)
+        except OSError:
+            shutil.copyfile(path, target)
+
+    async def upload(self, session, path, asset):
+        relative = Path(asset['digest'][:2]) / path.name
+        await asyncio.get_running_loop().run_in_executor(None, self._publish, path, relative)
+        return f"{self.base_url}/{relative.as_posix()}"
+
+
+class ImageKitUploader:
+    """
+    Uploads to ImageKit (POST multipart to the upload endpoint, HTTP Basic auth with the private
+    key). Files are named by digest with useUniqueFileName=false, so a re-upload of the same
+    bytes lands on the same URL.
+    """
+
+    name = 'imagekit'
+
+    def __init__(self, private_key, upload_endpoint='https://upload.imagekit.io/api/v1/files/upload',
+                 folder='/uploads/lossless', tags=()):
+        if not private_key:
+            raise ValueError("IMAGEKIT_PRIVATE_KEY is required for the imagekit uploader")
+        self.upload_endpoint = upload_endpoint
+        self.folder = folder
+        self.tags = list(tags)
+        token = base64.b64encode(f"{private_key}:".encode('utf-8')).decode('ascii')
+        self.headers = {'Authorization': f"Basic {token}"}
+
+    async def upload(self, session, path, asset):
+        async def attempt():
+            with open(path, 'rb') as f:
+                form = aiohttp.FormData()
+                # The file object is streamed by aiohttp's multipart writer, not read up front
+                form.add_field('file', f, filename=path.name, content_type=asset['content_type'] or 'application/octet-stream')
+                form.add_field('fileName', path.name)
+                form.add_field('folder', self.folder)
+                form.add_field('useUniqueFileName', 'false')
+                if self.tags:
+                    form.add_field('tags', ','.join(self.tags))
+                async with session.post(self.upload_endpoint, data=form, headers=self.headers) as resp:
+                    text = await resp.text()
+                    _check_status(resp, text)
+                    url = json.loads(text).get('url')
+                    if not url:
+                        raise RuntimeError(f"No url in ImageKit response: {text[:200]}")
+                    return url
+        return await _with_retries(f"upload {path.name}", attempt)
+
+
+def make_uploader(kind, **options):
+    """
+    'local' -> LocalUploader(public_dir, base_url); 'imagekit' -> ImageKitUploader(private_key,
+    upload_endpoint, folder, tags). Unused options are ignored, so callers can pass one config dict.
+    """
+    if kind == 'local':
+        return LocalUploader(options['public_dir'], options['base_url'])
+    if kind == 'imagekit':
+        keys = ('private_key', 'upload_endpoint', 'folder', 'tags')
+        return ImageKitUploader(**{k: options[k] for k in keys if options.get(k) is not None})
+    raise ValueError(f"unknown uploader {kind!r} (expected 'local' or 'imagekit')")
+
+
+class AssetPipeline:
+    """
+    Download (deduplicated) + optional optimization (minified SVG and PNG derivatives, in the
+    optimizer's process pool) + upload (once per file and uploader) -> durable URLs.
+    At most `concurrency` re-hosts touch the network at once; optimization holds no network slot.
+    """
+
+    def __init__(self, store, uploader, concurrency=8, optimizer=None):
+        self.store = store
+        self.uploader = uploader
+        self.optimizer = optimizer
+        self.uploads = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._running = {}  # key -> Task, so one digest is optimized/uploaded once even when requested twice at once
+
+    def _once(self, key, make_coro):
+        task = self._running.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            self._running[key] = task
+            task.add_done_callback(lambda _: self._running.pop(key, None))
+        return asyncio.shield(task)
+
+    async def rehost(self, session, url):
+        """
+        Returns {'url': durable URL, 'derivatives': [{'url', 'width', 'height'}, ...]} for a
+        generated image. With an optimizer, an SVG is replaced by its minified version and the
+        derivatives are its PNG renders; otherwise 'derivatives' is empty.
+        """
+        async with self._slots:
+            asset = await self.store.fetch(session, url)
+        files = [asset]
+        if self.optimizer is not None and asset['ext'] == 'svg':
+            files = await self._once(('optimize', asset['digest']), lambda: self._optimize(asset))
+        async with self._slots:
+            hosted = await asyncio.gather(*(
+                self._once(('upload', f['digest'], f.get('variant', '')), lambda f=f: self._upload(session, f))
+                for f in files
+            ))
+        return {
+            'url': hosted[0],
+            'derivatives': [
+                {'url': hosted_url, 'width': f.get('width'), 'height': f.get('height')}
+                for f, hosted_url in zip(files[1:], hosted[1:])
+            ],
+        }
+
+    async def _optimize(self, asset):
+        variants = self.store.variants_for(asset)
+        if variants is None:
+            found = await self.optimizer.optimize(self.store.path_for(asset), asset['digest'], self.store.path_for(asset).parent)
+            variants = self.store.record_variants(asset, found)
+        return variants
+
+    async def _upload(self, session, asset):
+        hosted = self.store.hosted_url(self.uploader.name, asset)
+        if hosted:
+            return hosted
+        hosted = await self.uploader.upload(session, self.store.path_for(asset), asset)
+        self.store.record_upload(self.uploader.name, asset, hosted)
+        self.uploads += 1
+        return hosted
@@ -0,0 +1,93 @@
+"""
+Script: bench_frontmatter.py
+Micro-benchmark: shared single-pass Frontmatter vs the regex + split/join approach the Recraft
+script used before (FRONTMATTER_REGEX twice, one re.search per field, one split/join per update).
+
+Both sides do the same work per document: read banner_image, portrait_image and image_prompt,
+set banner_image and portrait_image, render the full document.
+
+Usage:
+    python utils/content_pipeline/bench_frontmatter.py [--repeat 20]
+"""
+
+import re
+import sys
+import timeit
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from content_pipeline.frontmatter import Frontmatter
+
+# --- Legacy approach (as in generate-banner-and-portrait-images-recraft.py before the shared parser) ---
+FRONTMATTER_REGEX = re.compile(r'^(---\s*\n.*?\n?)^(---\s*$)', re.DOTALL | re.MULTILINE)
+
+
+def legacy_update(frontmatter, field, url):
+    lines = frontmatter.split('\n')
+    found = False
+    new_lines = []
+    for line in lines:
+        if line.startswith(field + ":"):
+            new_lines.append(f"{field}: {url}")
+            found = True
+        else:
+            new_lines.append(line)
+    if not found:
+        for i in range(len(new_lines) - 1, -1, -1):
+            if new_lines[i].strip() == '---':
+                new_lines.insert(i, f"{field}: {url}")
+                break
+        else:
+            new_lines.append(f"{field}: {url}")
+    return '\n'.join(new_lines)
+
+
+def legacy(md_text):
+    m = FRONTMATTER_REGEX.search(md_text)
+    frontmatter, rest = m.group(0), md_text[m.end():]
+    re.search(r'^banner_image:\s*(.*)', frontmatter, re.MULTILINE)
+    re.search(r'^portrait_image:\s*(.*)', frontmatter, re.MULTILINE)
+    if not re.search(r'^image_prompt:\s*(.*)', md_text, re.MULTILINE):
+        FRONTMATTER_REGEX.sub('', md_text, count=1)
+    frontmatter = legacy_update(frontmatter, 'banner_image', 'https://example.com/b.svg')
+    frontmatter = legacy_update(frontmatter, 'portrait_image', 'https://example.com/p.svg')
+    return frontmatter + rest
+
+
+def single_pass(md_text):
+    fm = Frontmatter.parse(md_text)
+    fm.raw('banner_image')
+    fm.raw('portrait_image')
+    fm.get('image_prompt')
+    fm.set('banner_image', 'https://example.com/b.svg')
+    fm.set('portrait_image', 'https://example.com/p.svg')
+    return fm.render()
+
+
+def make_document(fields, body_kb, with_prompt):
+    lines = ['---'] + [f'field_{i}: value number {i} for this essay' for i in range(fields)]
+    if with_prompt:
+        lines.append('image_prompt: a lighthouse made of index cards')
+    lines.append('---')
+    paragraph = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 16 + '\n\n'
+    body = paragraph * max(1, (body_kb * 1024) // len(paragraph))
+    return '\n'.join(lines) + '\n' + body
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args(argv)
+    print(f"{'document':<38} {'legacy ms':>10} {'single-pass ms':>15} {'speedup':>8}")
+    for fields, body_kb, with_prompt in [(20, 8, True), (60, 512, True), (60, 512, False), (200, 4096, False)]:
+        doc = make_document(fields, body_kb, with_prompt)
+        assert Frontmatter.parse(doc) is not None
+        t_legacy = min(timeit.repeat(lambda: legacy(doc), number=1, repeat=args.repeat)) * 1000
+        t_single = min(timeit.repeat(lambda: single_pass(doc), number=1, repeat=args.repeat)) * 1000
+        label = f"{fields} fields, {body_kb} KB body, prompt={'yes' if with_prompt else 'no'}"
+        print(f"{label:<38} {t_legacy:>10.3f} {t_single:>15.3f} {t_legacy / t_single:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
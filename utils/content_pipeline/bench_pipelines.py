@@ -0,0 +1,369 @@
+"""
+Script: bench_pipelines.py
+Offline end-to-end benchmark: runs the real scripts against the local provider stubs (stubs.py)
+on a synthetic markdown corpus and reports files/sec, peak memory and p95 request latency, so
+releases can be compared on the same machine without API keys or network.
+
+- Starts one stub process per provider (Recraft, Ollama, Anthropic) on a free port, with the
+  configured latency, error rate, placeholder-answer rate and streaming speed
+- Builds a throwaway monorepo in --workdir (package.json, tidyverse/, a copy of ai-labs/apis and
+  ai-labs/utils, the copywriter prompt) so the scripts resolve their paths as they do at home
+- Writes a seeded corpus of --files markdown documents (body sizes from a few lines to tens of KB)
+  fresh for every pipeline, and points each script's index, job queue, manifest, cache and metrics files
+  into the workdir: nothing outside it is read or written
+- Pipelines: recraft (banner/portrait images), msty (Ollama lede + image_prompt), cascade
+  (Anthropic lede + image_prompt), styles (Recraft style uploads from synthetic PNG sets)
+- files/sec counts files actually completed (fields filled / styles registered), peak memory is
+  the script's max RSS (os.wait4), p95 comes from the script's own metrics file (metrics.py)
+- --results appends one JSON line per pipeline run, tagged with --label (default: git describe);
+  each run is compared against the last result with the same pipeline and settings
+
+Usage:
+    python utils/content_pipeline/bench_pipelines.py --files 200 [--pipelines recraft,msty,cascade,styles]
+        [--latency 0.2] [--error-rate 0.05] [--workers 4] [--results bench-results.jsonl] [--label v1.4]
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import shutil
+import socket
+import struct
+import argparse
+import tempfile
+import threading
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from content_pipeline.frontmatter import Frontmatter
+from content_pipeline.metrics import percentile
+
+AI_LABS = Path(__file__).resolve().parents[2]
+STUBS = Path(__file__).resolve().parent / 'stubs.py'
+PIPELINES = ['recraft', 'msty', 'cascade', 'styles']
+CORPUS_DIR = 'content/lost-in-public/prompts/data-integrity'
+PROMPT_FILE = 'content/lost-in-public/prompts/workflow/Ask-Local-LLM-to-Be-a-Copywriter.md'
+# Each script's main request op in its metrics file (the p95 column)
+MAIN_OP = {'recraft': 'recraft.generate', 'msty': 'ollama.generate', 'cascade': 'anthropic.fill', 'styles': 'recraft.style'}
+# ru_maxrss is in kilobytes on Linux and bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+WORDS = ('knowledge systems notes graph index essay lighthouse archive pattern signal memory '
+         'workflow garden library network thread draft river atlas ledger compass').split()
+
+
+# --- STUBS ---
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_stub(service, args, log_dir):
+    """Starts `stubs.py <service>` on a free port and waits until it accepts connections."""
+    port = free_port()
+    out = open(log_dir / f"stub-{service}.log", 'w')
+    proc = subprocess.Popen([sys.executable, str(STUBS), service, '--port', str(port), *args],
+                            stdout=out, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{service} stub exited with {proc.returncode} (see {out.name})")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    proc.kill()
+    raise RuntimeError(f"{service} stub did not start on port {port}")
+
+
+def stub_args(service, args):
+    common = ['--error-rate', str(args.error_rate)]
+    if service == 'recraft':
+        return common + ['--latency', str(args.latency), '--ceiling-rps', str(args.ceiling_rps)]
+    if service == 'anthropic':
+        return common + ['--latency', str(args.latency), '--generic-rate', str(args.generic_rate)]
+    return common + ['--generic-rate', str(args.generic_rate), '--num-parallel', str(args.num_parallel),
+                     '--token-rate', str(args.token_rate), '--ramble-tokens', str(args.ramble_tokens)]
+
+
+# --- SANDBOX + CORPUS ---
+def build_monorepo(root):
+    """package.json + tidyverse/ + ai-labs/{apis,utils} + the copywriter prompt, as the scripts expect."""
+    root.mkdir(parents=True, exist_ok=True)
+    (root / 'package.json').write_text('{}\n')
+    (root / 'tidyverse').mkdir(exist_ok=True)
+    ignore = shutil.ignore_patterns('.*', '__pycache__', '*.pyc')
+    for part in ('apis', 'utils'):
+        shutil.rmtree(root / 'ai-labs' / part, ignore_errors=True)
+        shutil.copytree(AI_LABS / part, root / 'ai-labs' / part, ignore=ignore)
+    prompt = root / PROMPT_FILE
+    prompt.parent.mkdir(parents=True, exist_ok=True)
+    prompt.write_text("You are a copywriter. Read the document and answer with a JSON object "
+                      "{\"lede\": ..., \"image_prompt\": ...}: a one-sentence lede and a short image prompt.\n")
+
+
+def sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(8, 16))
+    return ' '.join(words).capitalize() + '.'
+
+
+def make_document(i, rng, with_prompt):
+    """One synthetic essay: 0-3 filler sections mostly, now and then a long one (up to ~60KB)."""
+    fields = [f"title: Synthetic essay {i}", f"date_created: 2025-01-{1 + i % 28:02d}", "lede: ''"]
+    fields.append(f"image_prompt: {' '.join(rng.choices(WORDS, k=6))}, essay {i}" if with_prompt else "image_prompt: ''")
+    fields += ["banner_image: ''", "portrait_image: ''", f"tags: [{', '.join(rng.sample(WORDS, 3))}]"]
+    sections = rng.choice([0, 1, 1, 2, 3, 3, 8, 40]) if rng.random() > 0.02 else 200
+    body = [f"# Synthetic essay {i}\n", ' '.join(sentence(rng) for _ in range(3)) + '\n']
+    for s in range(sections):
+        body.append(f"## Section {s + 1}\n")
+        body.append('\n\n'.join(' '.join(sentence(rng) for _ in range(4)) for _ in range(3)) + '\n')
+    return '---\n' + '\n'.join(fields) + '\n---\n' + '\n'.join(body)
+
+
+def write_corpus(target, files, seed, with_prompt):
+    shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True)
+    rng = random.Random(seed)
+    total = 0
+    for i in range(files):
+        text = make_document(i, rng, with_prompt)
+        (target / f"essay-{i:05d}.md").write_text(text, encoding='utf-8')
+        total += len(text)
+    return total
+
+
+def png_bytes(width, height, seed):
+    """A small valid RGB PNG of noise (the style stub only reads the bytes)."""
+    rng = random.Random(seed)
+    raw = b''.join(b'\x00' + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw)) + chunk(b'IEND', b''))
+
+
+def write_style_sets(target, sets, seed):
+    """sets.json with `sets` image sets of 3 PNGs each; returns its path."""
+    shutil.rmtree(target, ignore_errors=True)
+    target.mkdir(parents=True)
+    spec = {}
+    for n in range(sets):
+        set_dir = target / f"set{n:03d}"
+        set_dir.mkdir()
+        for k in range(3):
+            (set_dir / f"img{k}.png").write_bytes(png_bytes(64, 64, seed * 1000 + n * 10 + k))
+        spec[f"bench-{n:03d}"] = set_dir.name
+    (target / 'sets.json').write_text(json.dumps(spec, indent=2))
+    return target / 'sets.json'
+
+
+# --- PIPELINE RUNS ---
+def pipeline_command(name, root, state, urls, args):
+    """(argv, env overrides, cwd, how to count completed items) for one pipeline."""
+    scripts = root / 'ai-labs' / 'apis'
+    corpus = root / CORPUS_DIR
+    env = {'CONTENT_INDEX_PATH': str(state / f"{name}-index.sqlite3"), 'CONTENT_JOBS_PATH': str(state / 'jobs.sqlite3'),
+           'CONTENT_LOG_LEVEL': 'warning'}
+    if name == 'recraft':
+        env.update({
+            'RECRAFT_API_TOKEN': 'bench', 'RECRAFT_API_URL': urls['recraft'] + '/v1/images/generations',
+            'RECRAFT_PROMPT_DIR': str(corpus), 'RECRAFT_MANIFEST': str(state / 'recraft-manifest.jsonl'),
+            'RECRAFT_PROMPT_CACHE_PATH': str(state / 'recraft-prompt-cache.sqlite3'),
+            'RECRAFT_METRICS_PATH': str(state / 'recraft-metrics.jsonl'),
+        })
+        argv = [str(scripts / 'recraft' / 'generate-banner-and-portrait-images-recraft.py')]
+        return argv, env, root, lambda: count_filled(corpus, ('banner_image', 'portrait_image'))
+    if name == 'msty':
+        env.update({'LOCAL_MODEL_API_SERVICE_MSTY': urls['ollama'], 'MSTY_METRICS_PATH': str(state / 'msty-metrics.jsonl'),
+                    'MSTY_WORKERS': str(args.workers)})
+        argv = [str(scripts / 'msty' / 'request-local-MSTY-model.py')]
+        return argv, env, root, lambda: count_filled(corpus, ('lede', 'image_prompt'))
+    if name == 'cascade':
+        env.update({'ANTHROPIC_API_KEY': 'bench', 'ANTHROPIC_BASE_URL': urls['anthropic'],
+                    'CASCADE_METRICS_PATH': str(state / 'cascade-metrics.jsonl'), 'CASCADE_WORKERS': str(args.workers)})
+        argv = [str(scripts / 'msty' / 'ask-cascade-to-perform-prompt-for-dir.py'), str(corpus)]
+        return argv, env, root, lambda: count_filled(corpus, ('lede', 'image_prompt'))
+    registry = state / 'recraft-styles.jsonl'
+    env.update({'RECRAFT_API_TOKEN': 'bench', 'RECRAFT_STYLES_URL': urls['recraft'] + '/v1/styles',
+                'RECRAFT_STYLE_REGISTRY': str(registry), 'RECRAFT_STYLE_METRICS_PATH': str(state / 'styles-metrics.jsonl')})
+    argv = [str(scripts / 'recraft' / 'generate-style-recraft.py'), '--sets', str(root / 'style-sets' / 'sets.json')]
+    return argv, env, root, lambda: count_lines(registry)
+
+
+def count_filled(corpus, fields):
+    done = 0
+    for path in corpus.glob('*.md'):
+        fm = Frontmatter.parse(path.read_text(encoding='utf-8'))
+        if fm is not None and all(str(fm.get(field) or '').strip() for field in fields):
+            done += 1
+    return done
+
+
+def count_lines(path):
+    if not path.exists():
+        return 0
+    with open(path, encoding='utf-8') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def request_stats(metrics_path, op):
+    """(requests, retries, p95 wall seconds) of `op` from a metrics.py JSON-lines file."""
+    walls, retries = [], 0
+    if metrics_path.exists():
+        with open(metrics_path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('type') == 'request' and record.get('op') == op:
+                    walls.append(record['wall'])
+                    retries += record.get('retries', 0)
+    return len(walls), retries, percentile(sorted(walls), 95)
+
+
+def run_script(argv, env, cwd, log_path, timeout):
+    """Runs one script to completion; returns (exit status, seconds, peak RSS bytes)."""
+    with open(log_path, 'w') as out:
+        started = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, *argv], cwd=cwd, env={**os.environ, **env},
+                                stdout=out, stderr=subprocess.STDOUT)
+        killer = threading.Timer(timeout, proc.kill)
+        killer.start()
+        try:
+            _, status, usage = os.wait4(proc.pid, 0)
+        finally:
+            killer.cancel()
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        return proc.returncode, time.perf_counter() - started, usage.ru_maxrss * RSS_UNIT
+
+
+def run_pipeline(name, root, urls, args):
+    state = root / 'state' / name
+    shutil.rmtree(state, ignore_errors=True)
+    state.mkdir(parents=True)
+    if name == 'styles':
+        write_style_sets(root / 'style-sets', args.style_sets, args.seed)
+        items, corpus_bytes = args.style_sets, 0
+    else:
+        items = args.files
+        corpus_bytes = write_corpus(root / CORPUS_DIR, args.files, args.seed, with_prompt=(name == 'recraft'))
+    argv, env, cwd, count_done = pipeline_command(name, root, state, urls, args)
+    code, seconds, peak = run_script(argv, env, cwd, root / 'logs' / f"{name}.log", args.timeout)
+    done = count_done()
+    metrics_file = next(state.glob('*-metrics.jsonl'), state / 'missing')
+    requests, retries, p95 = request_stats(metrics_file, MAIN_OP[name])
+    return {
+        'pipeline': name, 'exit': code, 'items': items, 'done': done, 'corpus_kb': round(corpus_bytes / 1024),
+        'seconds': round(seconds, 3), 'files_per_sec': round(done / seconds, 3) if seconds else None,
+        'peak_mb': round(peak / 1024 / 1024, 1), 'requests': requests, 'retries': retries,
+        'p95': round(p95, 4) if p95 is not None else None,
+    }
+
+
+# --- RESULTS ---
+def git_label():
+    try:
+        out = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=AI_LABS,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or 'unknown'
+    except (OSError, subprocess.SubprocessError):
+        return 'unknown'
+
+
+def load_previous(path, pipeline, config):
+    """The last result in `path` with the same pipeline and settings, or None."""
+    previous = None
+    if path and Path(path).exists():
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('pipeline') == pipeline and record.get('config') == config:
+                    previous = record
+    return previous
+
+
+def change(now, before):
+    if now is None or not before:
+        return ''
+    return f"{(now - before) / before * 100:+.0f}%"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[2])
+    parser.add_argument('--files', type=int, default=100, help='markdown files in the synthetic corpus')
+    parser.add_argument('--style-sets', type=int, default=8, help='image sets uploaded by the styles pipeline')
+    parser.add_argument('--pipelines', default=','.join(PIPELINES), help=f"comma-separated subset of {', '.join(PIPELINES)}")
+    parser.add_argument('--seed', type=int, default=7, help='corpus and image seed')
+    parser.add_argument('--workers', type=int, default=1, help='--workers processes for the msty and cascade scripts')
+    stubs = parser.add_argument_group('stubs')
+    stubs.add_argument('--latency', type=float, default=0.2, help='Recraft/Anthropic seconds per request')
+    stubs.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 5xx')
+    stubs.add_argument('--generic-rate', type=float, default=0.0, help='fraction of model answers that are placeholder text')
+    stubs.add_argument('--ceiling-rps', type=float, default=20.0, help='Recraft requests/sec before 429s (0 = unlimited)')
+    stubs.add_argument('--num-parallel', type=int, default=4, help='Ollama concurrent generations')
+    stubs.add_argument('--token-rate', type=float, default=200.0, help='Ollama streamed tokens/sec per request')
+    stubs.add_argument('--ramble-tokens', type=int, default=0, help='Ollama tokens streamed after the JSON answer')
+    parser.add_argument('--workdir', help='sandbox directory (default: a temporary directory)')
+    parser.add_argument('--keep', action='store_true', help='keep the sandbox (logs, corpus, metrics) afterwards')
+    parser.add_argument('--timeout', type=float, default=600.0, help='seconds before a pipeline run is killed')
+    parser.add_argument('--results', help='append results to this JSON-lines file and compare with earlier runs')
+    parser.add_argument('--label', help='release label stored with the results (default: git describe)')
+    args = parser.parse_args(argv)
+
+    pipelines = [p.strip() for p in args.pipelines.split(',') if p.strip()]
+    unknown = sorted(set(pipelines) - set(PIPELINES))
+    if unknown:
+        parser.error(f"unknown pipeline(s): {', '.join(unknown)}")
+    label = args.label or git_label()
+    config = {key: getattr(args, key) for key in ('files', 'style_sets', 'seed', 'latency', 'error_rate', 'generic_rate',
+                                                  'ceiling_rps', 'num_parallel', 'token_rate', 'ramble_tokens')}
+    if args.workers > 1:
+        # Only recorded when sharded, so single-process results stay comparable with older ones
+        config['workers'] = args.workers
+    root = Path(args.workdir or tempfile.mkdtemp(prefix='bench-pipelines-')).resolve()
+    build_monorepo(root)
+    (root / 'logs').mkdir(exist_ok=True)
+
+    services = {'recraft': 'recraft', 'styles': 'recraft', 'msty': 'ollama', 'cascade': 'anthropic'}
+    procs, urls = [], {}
+    results = []
+    try:
+        for service in sorted({services[p] for p in pipelines}):
+            proc, urls[service] = start_stub(service, stub_args(service, args), root / 'logs')
+            procs.append(proc)
+        print(f"{'pipeline':<9} {'done':>11} {'seconds':>8} {'files/s':>8} {'peak MB':>8} {'p95 s':>7} "
+              f"{'requests':>8} {'retries':>7}  vs previous")
+        for name in pipelines:
+            result = {'label': label, 'ts': time.time(), 'config': config, **run_pipeline(name, root, urls, args)}
+            previous = load_previous(args.results, name, config)
+            versus = ''
+            if previous:
+                versus = (f"{previous['label']}: files/s {change(result['files_per_sec'], previous['files_per_sec'])}, "
+                          f"peak {change(result['peak_mb'], previous['peak_mb'])}, p95 {change(result['p95'], previous['p95'])}")
+            p95 = f"{result['p95']:.3f}" if result['p95'] is not None else '-'
+            status = '' if result['exit'] == 0 else f"  (exit {result['exit']}, see {root / 'logs' / (name + '.log')})"
+            print(f"{name:<9} {result['done']:>5}/{result['items']:<5} {result['seconds']:>8.2f} {result['files_per_sec']:>8.2f} "
+                  f"{result['peak_mb']:>8.1f} {p95:>7} {result['requests']:>8} {result['retries']:>7}  {versus}{status}")
+            results.append(result)
+            if args.results:
+                with open(args.results, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(result) + '\n')
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+        if args.keep or args.workdir:
+            print(f"Sandbox kept at {root}")
+        else:
+            shutil.rmtree(root, ignore_errors=True)
+    return 0 if all(r['exit'] == 0 for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
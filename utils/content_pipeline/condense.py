@@ -0,0 +1,225 @@
+"""
+Module: condense
+Keeps model input roughly constant-size per file, however long the document.
+
+- estimate_tokens(): cheap chars/4 estimate (no tokenizer dependency), good enough for budgets.
+- condense_markdown(): deterministic, no model call. Keeps every heading, the opening paragraph
+  of each section and all of the "key" sections (summary, overview, introduction, conclusion,
+  tl;dr), then fills what is left of the budget with later paragraphs in document order. Code
+  fences, tables, images and HTML go last. Omitted stretches are marked with "[…]".
+- map_reduce_summary(): for very long documents. Splits the text into chunks on paragraph
+  boundaries, summarizes them concurrently (map), then summarizes the joined partial summaries
+  again (reduce) until the result fits the budget. The model call is passed in by the script.
+- prepare_content() picks between them: unchanged, condensed, or outline + summary.
+- summary_prompt() is the per-chunk instruction, so every script summarizes the same way.
+
+Usage:
+    text, method = await prepare_content(body, budget_chars=16000, summarize=my_summarize)
+"""
+
+import re
+import asyncio
+
+OMITTED = '[…]'
+# Sections whose whole text is kept before any other section's later paragraphs
+KEY_SECTION = re.compile(r'^#+\s*(tl;?dr|summary|overview|introduction|abstract|conclusions?|key (points|takeaways))\b', re.IGNORECASE)
+HEADING_MAX_CHARS = 200
+# Don't bother keeping a truncated paragraph shorter than this
+MIN_FRAGMENT_CHARS = 200
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 chars per token for English prose)."""
+    return (len(text) + 3) // 4
+
+
+def split_blocks(text):
+    """
+    Splits markdown into blocks separated by blank lines. A fenced code block stays one block,
+    blank lines included.
+    """
+    blocks = []
+    current = []
+    in_fence = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(('```', '~~~')):
+            in_fence = not in_fence
+        if not stripped and not in_fence:
+            if current:
+                blocks.append('\n'.join(current))
+                current = []
+            continue
+        current.append(line)
+    if current:
+        blocks.append('\n'.join(current))
+    return blocks
+
+
+def _is_heading(block):
+    return block.startswith('#') and '\n' not in block
+
+
+def _is_aside(block):
+    # Code, tables, images and raw HTML: least useful for writing a lede
+    return block.lstrip().startswith(('```', '~~~', '|', '![', '<'))
+
+
+def _truncate(block, limit):
+    """Cuts a block to at most `limit` chars, at a sentence or word boundary where possible."""
+    if len(block) <= limit:
+        return block
+    cut = block[:max(0, limit - 2)]
+    for boundary in ('. ', '\n', ' '):
+        pos = cut.rfind(boundary)
+        if pos > limit // 2:
+            cut = cut[:pos + 1]
+            break
+    return cut.rstrip() + ' …'
+
+
+def condense_markdown(text, budget_chars):
+    """
+    Returns `text` unchanged if it fits, otherwise the highest-value blocks (in their original
+    order) within `budget_chars`, with "[…]" where blocks were left out.
+    """
+    if len(text) <= budget_chars:
+        return text
+    blocks = split_blocks(text)
+    # Priority per block: 0 headings, 1 opening paragraph of each section / key sections,
+    # 2 other prose, 3 code, tables, images, HTML
+    priorities = []
+    section_started = False
+    key_section = False
+    for block in blocks:
+        if _is_heading(block):
+            priorities.append(0)
+            section_started = False
+            key_section = bool(KEY_SECTION.match(block))
+        elif _is_aside(block):
+            priorities.append(3)
+        elif key_section or not section_started:
+            priorities.append(1)
+            section_started = True
+        else:
+            priorities.append(2)
+    kept = {}
+    # Each kept block costs its text, a separator, and possibly an omission marker next to it
+    overhead = len(OMITTED) + 4
+    remaining = budget_chars
+    for level in range(4):
+        for i, block in enumerate(blocks):
+            if priorities[i] != level or i in kept:
+                continue
+            if level == 0:
+                block = _truncate(block, HEADING_MAX_CHARS)
+            cost = len(block) + overhead
+            if cost <= remaining:
+                kept[i] = block
+                remaining -= cost
+            elif level <= 1 and remaining - overhead >= MIN_FRAGMENT_CHARS:
+                kept[i] = _truncate(block, remaining - overhead)
+                remaining -= len(kept[i]) + overhead
+    parts = []
+    previous = -1
+    for i in sorted(kept):
+        if i != previous + 1:
+            parts.append(OMITTED)
+        parts.append(kept[i])
+        previous = i
+    if previous != len(blocks) - 1:
+        parts.append(OMITTED)
+    return '\n\n'.join(parts)[:budget_chars]
+
+
+def split_chunks(text, chunk_chars):
+    """Groups blocks into chunks of at most ~`chunk_chars` (an oversized block is cut up)."""
+    chunks = []
+    current = []
+    size = 0
+    for block in split_blocks(text):
+        if len(block) > chunk_chars and current:
+            chunks.append('\n\n'.join(current))
+            current, size = [], 0
+        while len(block) > chunk_chars:
+            chunks.append(block[:chunk_chars])
+            block = block[chunk_chars:]
+        if current and size + len(block) + 2 > chunk_chars:
+            chunks.append('\n\n'.join(current))
+            current, size = [], 0
+        current.append(block)
+        size += len(block) + 2
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def outline(text, budget_chars):
+    """The document's headings, one per line, within `budget_chars`."""
+    lines = []
+    size = 0
+    for block in split_blocks(text):
+        if _is_heading(block):
+            heading = _truncate(block, HEADING_MAX_CHARS)
+            if size + len(heading) + 1 > budget_chars:
+                break
+            lines.append(heading)
+            size += len(heading) + 1
+    return '\n'.join(lines)
+
+
+def summary_prompt(chunk, max_chars):
+    """The map/reduce step prompt both LLM scripts send for one chunk."""
+    return (
+        f"Summarize the following part of a longer document in at most about {max(30, max_chars // 6)} words. "
+        "Keep the main argument, named tools, people and projects, and any concrete claims. "
+        "Output only the summary, as plain prose.\n***\n"
+        f"{chunk}\n"
+    )
+
+
+async def map_reduce_summary(text, summarize, budget_chars, chunk_chars, concurrency=4, max_rounds=3):
+    """
+    Summarizes `text` down to `budget_chars`. `summarize(chunk, max_chars)` is an async callable
+    returning a summary of `chunk` in at most about `max_chars` characters. Chunks are summarized
+    concurrently (at most `concurrency` at once); the partial summaries are joined in order and
+    reduced again while they are still over budget.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarize_one(chunk, max_chars):
+        async with semaphore:
+            return (await summarize(chunk, max_chars) or '').strip()
+
+    joined = text
+    for _ in range(max_rounds):
+        chunks = split_chunks(joined, chunk_chars)
+        # Share the budget between the chunks so the joined result lands near it
+        per_chunk = max(MIN_FRAGMENT_CHARS, budget_chars // len(chunks))
+        partials = await asyncio.gather(*(summarize_one(chunk, per_chunk) for chunk in chunks))
+        joined = '\n\n'.join(p for p in partials if p)
+        if len(joined) <= budget_chars:
+            return joined
+    return condense_markdown(joined, budget_chars)
+
+
+async def prepare_content(text, budget_chars, summarize=None, summarize_over=None, chunk_chars=None, concurrency=4,
+                          summary_input_chars=None):
+    """
+    Returns (text, method) with len(text) <= budget_chars. method is 'full' (unchanged),
+    'condensed' (condense_markdown) or 'summarized' (heading outline + map-reduce summary, only
+    when `summarize` is given and the text is over `summarize_over` chars, 4x the budget by default).
+    The summary reads at most `summary_input_chars` (8x the budget by default) of condensed text,
+    so even a book-length file costs a bounded number of model calls.
+    """
+    if len(text) <= budget_chars:
+        return text, 'full'
+    if summarize is None or len(text) <= (summarize_over or 4 * budget_chars):
+        return condense_markdown(text, budget_chars), 'condensed'
+    headings = outline(text, budget_chars // 5)
+    header = f"Outline:\n{headings}\n\nSummary:\n" if headings else 'Summary:\n'
+    source = condense_markdown(text, summary_input_chars or 8 * budget_chars)
+    summary = await map_reduce_summary(
+        source, summarize, budget_chars - len(header), chunk_chars or budget_chars, concurrency,
+    )
+    return (header + summary)[:budget_chars], 'summarized'
@@ -0,0 +1,190 @@
+"""
+Module: frontmatter
+Single-pass, lossless YAML frontmatter reader/writer for markdown files. String handling only,
+no YAML library (same rule as the scripts that use it).
+
+- Frontmatter.parse(text) walks the frontmatter lines ONCE, line by line up to the closing '---',
+  and never scans the body. Top-level keys are indexed to their line number, so get/set are O(1).
+- Every original line is kept verbatim (including its newline style and any nested/list lines),
+  so render() of an unmodified document returns the input unchanged.
+- set() only re-formats the line(s) of the key being changed; new keys go just before the
+  closing '---'. Keys whose value spans continuation lines (lists, block scalars) have those
+  lines dropped when overwritten with a scalar.
+- Values are written following the quoting rules in ai-labs/utils/yamlFrontmatter.ts:
+  bare URLs, single quotes around YAML-reserved characters, double quotes when the value itself
+  contains a single quote, never block scalars.
+
+Usage:
+    fm = Frontmatter.parse(md_text)          # None if the file has no frontmatter
+    if fm is not None and not fm.get('lede'):
+        fm.set('lede', 'A sweeping overview ...')
+        new_text = fm.render()
+"""
+
+import json
+import re
+
+DELIMITER = '---'
+
+# Characters that force a quoted scalar (see yamlFrontmatter.ts RULES)
+_RESERVED = set(':#>|{}[],&*!?-<=%@`\'"')
+# Plain scalars YAML would read as something other than a string
+_NON_STRING = re.compile(r'^(true|false|yes|no|on|off|null|~|[-+]?[0-9][0-9_.:eE+-]*)$', re.IGNORECASE)
+
+
+def unquote(raw):
+    """Turns a raw scalar from a frontmatter line into its string value."""
+    raw = raw.strip()
+    if len(raw) >= 2 and raw[0] == raw[-1] == "'":
+        return raw[1:-1].replace("''", "'")
+    if len(raw) >= 2 and raw[0] == raw[-1] == '"':
+        try:
+            return json.loads(raw)
+        except ValueError:
+            return raw[1:-1]
+    return raw
+
+
+def format_scalar(value):
+    """Formats a value as a single-line YAML scalar (never a block scalar)."""
+    text = ' '.join(str(value).split())
+    if text.startswith(('http://', 'https://')) and ' ' not in text:
+        return text
+    if text and not _NON_STRING.match(text) and not any(ch in _RESERVED for ch in text):
+        return text
+    if "'" in text:
+        # Rules 2 and 4: double quotes, escaping backslashes and double quotes
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return "'" + text + "'"
+
+
+class Frontmatter:
+    """
+    Parsed frontmatter block plus the untouched body of the document.
+    Build with Frontmatter.parse(); the constructor is internal.
+    """
+
+    __slots__ = ('lines', 'body', 'newline', '_index', '_dirty', '_original')
+
+    def __init__(self, lines, body, newline):
+        # lines[0] is the opening '---', lines[-1] the closing '---'
+        self.lines = lines
+        # Original lines as parsed, for diffs (tuple of references, no copying of text)
+        self._original = tuple(lines)
+        self.body = body
+        self.newline = newline
+        self._index = {}
+        self._dirty = False
+        for i in range(1, len(lines) - 1):
+            line = lines[i]
+            if line[:1] in (' ', '\t', '-', '#') or ':' not in line:
+                continue
+            key = line.split(':', 1)[0].rstrip()
+            # First occurrence wins, matching what a YAML reader keeps for the scripts' flat keys
+            self._index.setdefault(key, i)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Splits `text` into frontmatter lines and body in one forward pass.
+        Returns None if the document does not open with a '---' line or never closes it.
+        """
+        end = text.find('\n')
+        if end == -1 or text[:end].rstrip() != DELIMITER:
+            return None
+        newline = '\r\n' if text[end - 1:end] == '\r' else '\n'
+        lines = [text[:end + 1]]
+        pos = end + 1
+        length = len(text)
+        while pos < length:
+            end = text.find('\n', pos)
+            line = text[pos:] if end == -1 else text[pos:end + 1]
+            lines.append(line)
+            pos = length if end == -1 else end + 1
+            if line.rstrip() == DELIMITER:
+                return cls(lines, text[pos:], newline)
+        return None
+
+    @classmethod
+    def empty(cls, body=''):
+        """A new, empty frontmatter block in front of `body` (for files that have none yet)."""
+        newline = '\r\n' if '\r\n' in body[:4096] else '\n'
+        return cls([DELIMITER + newline, DELIMITER + newline], body, newline)
+
+    # --- reading ---
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return list(self._index)
+
+    def raw(self, key, default=''):
+        """The value text after 'key:' exactly as written (quotes included), or `default`."""
+        i = self._index.get(key)
+        if i is None:
+            return default
+        return self.lines[i].split(':', 1)[1].strip()
+
+    def get(self, key, default=None):
+        """The unquoted string value of a top-level key, or `default` if absent."""
+        i = self._index.get(key)
+        if i is None:
+            return default
+        value = self.lines[i].split(':', 1)[1].strip()
+        if value[:1] in ('|', '>'):
+            # Block scalar written by another tool: fold its indented lines into one string
+            parts = []
+            for line in self.lines[i + 1:-1]:
+                if line[:1] not in (' ', '\t'):
+                    break
+                parts.append(line.strip())
+            return ' '.join(p for p in parts if p)
+        return unquote(value)
+
+    def is_empty(self, key):
+        """True if the key is absent or its value is blank / just quotes."""
+        value = self.get(key)
+        return value is None or not value.strip()
+
+    # --- writing ---
+    @property
+    def dirty(self):
+        """True once any set() changed a line."""
+        return self._dirty
+
+    def set(self, key, value):
+        """Inserts or replaces a top-level key with a single-line scalar value."""
+        line = f"{key}: {format_scalar(value)}{self.newline}"
+        i = self._index.get(key)
+        if i is None:
+            closing = len(self.lines) - 1
+            self.lines.insert(closing, line)
+            self._index[key] = closing
+            self._dirty = True
+            return
+        # Drop continuation lines (nested lists / block scalars) that belonged to the old value
+        stop = i + 1
+        while stop < len(self.lines) - 1 and self.lines[stop][:1] in (' ', '\t', '-'):
+            stop += 1
+        if stop > i + 1:
+            del self.lines[i + 1:stop]
+            removed = stop - i - 1
+            for k, j in self._index.items():
+                if j > i:
+                    self._index[k] = j - removed
+            self._dirty = True
+        if self.lines[i] != line:
+            self.lines[i] = line
+            self._dirty = True
+
+    def block(self):
+        """The frontmatter block, delimiters included."""
+        return ''.join(self.lines)
+
+    def original_block(self):
+        """The frontmatter block as it was when parsed, before any set()."""
+        return ''.join(self._original)
+
+    def render(self):
+        """The full document: frontmatter block followed by the unchanged body."""
+        return self.block() + self.body
@@ -0,0 +1,129 @@
+"""
+Module: generic
+Shared detector for generic / placeholder / meta model output ("This is a placeholder...",
+"Example image", "lede: ..."), used by both LLM scripts to reject an answer and ask again.
+
+- The pattern list is compiled ONCE into a single alternation regex, so checking a value is one
+  scan. The alternation has no capture groups (named groups make Python's matcher ~10x slower);
+  the reason is recovered from the matched text only for values that do match.
+- Pattern lists live in text files (generic_patterns/*.txt): one pattern per line, matched as a
+  case-insensitive substring; lines starting with 're:' are regular expressions, '#' comments.
+- check_many() scores a whole list of candidates with one scan over their joined text and
+  returns a reason (or None) per candidate, always the same as check() gives each one. Literal
+  patterns cannot match across the separator; a 're:' pattern can (or see past it with '.*', '$'
+  or a lookaround), so a detector with any of those checks each candidate on its own.
+
+Usage:
+    detector = GenericDetector.from_file(PATTERNS_DIR / 'claude.txt', min_length=10, reject_prefixes=('{',))
+    detector.is_generic("This is a placeholder.")      # True
+    detector.check("lede: ...")                       # "matched 'lede:'"
+    detector.check_many(["A vivid lede", "TBD"])      # [None, "matched 'tbd'"]
+"""
+
+import re
+from bisect import bisect_right
+from pathlib import Path
+
+PATTERNS_DIR = Path(__file__).resolve().parent / 'generic_patterns'
+# Joins candidates for check_many(); literal patterns can never match across it ('re:' ones can)
+_SEPARATOR = '\x00'
+
+
+def load_patterns(path):
+    """Reads a pattern file: one pattern per line, blank lines and '#' comments ignored."""
+    patterns = []
+    for line in Path(path).read_text(encoding='utf-8').splitlines():
+        line = line.strip()
+        if line and not line.startswith('#'):
+            patterns.append(line)
+    return patterns
+
+
+class GenericDetector:
+    """
+    Compiled generic-output check. `min_length` and `reject_prefixes` add the cheap structural
+    checks; `non_string_is_generic` decides what a non-string value (None, a list) counts as.
+    """
+
+    def __init__(self, patterns, min_length=0, reject_prefixes=(), non_string_is_generic=False):
+        self.patterns = list(patterns)
+        self.min_length = min_length
+        self.reject_prefixes = tuple(reject_prefixes)
+        self.non_string_is_generic = non_string_is_generic
+        alternatives = []
+        # matched text -> pattern for literal patterns; (compiled, pattern) for 're:' patterns
+        self._literals = {}
+        self._expressions = []
+        for pattern in self.patterns:
+            if pattern.startswith('re:'):
+                body = pattern[3:]
+                self._expressions.append((re.compile(body), pattern))
+            else:
+                body = re.escape(pattern.lower())
+                self._literals.setdefault(pattern.lower(), pattern)
+            alternatives.append(f'(?:{body})')
+        self._regex = re.compile('|'.join(alternatives)) if alternatives else None
+
+    @classmethod
+    def from_file(cls, path, **options):
+        return cls(load_patterns(path), **options)
+
+    def _reason_for(self, match):
+        text = match.group()
+        pattern = self._literals.get(text)
+        if pattern is None:
+            pattern = next((p for regex, p in self._expressions if regex.fullmatch(text)), text)
+        return f"matched {pattern!r}"
+
+    def _structural(self, value):
+        """Reason from the non-pattern checks, or None. `value` is already lowercased and stripped."""
+        if len(value) < self.min_length:
+            return f"too short (< {self.min_length} chars)"
+        if self.reject_prefixes and value.startswith(self.reject_prefixes):
+            return f"starts with {value[:1]!r}"
+        return None
+
+    def check(self, value):
+        """Why `value` is generic, or None if it looks like real output."""
+        if not isinstance(value, str):
+            return 'not a string' if self.non_string_is_generic else None
+        text = value.lower().strip()
+        if self._regex is not None:
+            match = self._regex.search(text)
+            if match:
+                return self._reason_for(match)
+        return self._structural(text)
+
+    def is_generic(self, value):
+        return self.check(value) is not None
+
+    def check_many(self, values):
+        """
+        check() for a list of values in one regex scan: the candidates are joined and every match
+        is mapped back to the candidate it falls in. Returns a list of reasons (None = fine).
+        With 're:' patterns the joined scan could match across candidates, so each is checked alone.
+        """
+        if self._expressions:
+            return [self.check(value) for value in values]
+        reasons = [None] * len(values)
+        texts = []
+        starts = []
+        position = 0
+        for i, value in enumerate(values):
+            if not isinstance(value, str):
+                reasons[i] = 'not a string' if self.non_string_is_generic else None
+                text = ''
+            else:
+                text = value.lower().strip()
+            starts.append(position)
+            texts.append(text)
+            position += len(text) + len(_SEPARATOR)
+        if self._regex is not None:
+            for match in self._regex.finditer(_SEPARATOR.join(texts)):
+                i = bisect_right(starts, match.start()) - 1
+                if reasons[i] is None and isinstance(values[i], str):
+                    reasons[i] = self._reason_for(match)
+        for i, text in enumerate(texts):
+            if reasons[i] is None and isinstance(values[i], str):
+                reasons[i] = self._structural(text)
+        return reasons
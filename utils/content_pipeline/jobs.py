@@ -0,0 +1,433 @@
+"""
+Module: jobs
+Durable per-file/per-field work queue in SQLite, so a long backfill can be stopped and resumed,
+its failures retried on their own, and its files shared between several processes on one box.
+
+- One row per (queue, path, field): queue is the script and the directory it works on
+  (queue_name('cascade', target_dir) -> 'cascade:/abs/target/dir'), field the frontmatter field
+  the task fills. States: pending -> in_flight -> done | failed (with the reason). Every script
+  shares one jobs file, so a run on one directory never claims, retries or reports the leftovers
+  of an interrupted run on another.
+- claim() takes every pending task of one file at once (a file is only ever rewritten by one
+  worker) and leases it to this process for `lease_seconds`. A lease that runs out, or whose
+  process on this host has died, puts the task back to pending; renew_leases() keeps the leases
+  of a live run fresh (and re-queues expired ones). `attempts` counts claims since the task was
+  last queued. Claims only read pending rows through the (queue, state, path) index, so draining
+  a queue stays linear however many tasks are already done.
+- enqueue_many() is how a run's discovery feeds the queue: new tasks are added, finished or
+  failed ones re-queued, tasks that are pending or in flight are left as they are. A run that
+  skips discovery (--resume) only works through what is already queued; --retry-failed re-queues
+  the failures and does the same.
+- done()/fail()/release() only touch tasks this process still holds, so a worker whose lease was
+  taken over never overwrites the other worker's outcome. Record done() when the result is on disk
+  (the writers' on_commit), so a crash before the rename leaves the task to be redone.
+  Async workers call aclaim()/adone()/afail()/arelease(), which run the write in a thread.
+- WAL mode + BEGIN IMMEDIATE claims: any number of processes can share the file.
+- Sharding (--workers N): every task stores a stable hash of its path (path_hash), and reshard(N)
+  sets its `shard` column to hash % N. run_shards() then starts N processes, each with a
+  JobQueue(shard=(i, N)) that only claims shard i's pending rows (through the (queue, shard,
+  state, path) index), and returns their results to the parent. A file, and any task put back for
+  it, always lands in the same shard.
+
+Usage:
+    jobs = JobQueue(queue_name('recraft', PROMPT_DIR))
+    plan_run(jobs, 'run', lambda: [(path, ['banner_image', 'portrait_image']) for path in candidates])
+    job = jobs.claim()                  # Job(path, fields, attempts) or None when nothing is left
+    jobs.done(job.path)                 # or jobs.fail(job.path, 'HTTP 503'), jobs.release(job.path)
+    jobs.release_held()
+    jobs.close()
+"""
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from . import log as logging_setup
+
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+# Shared by every script unless CONTENT_JOBS_PATH says otherwise (ai-labs/.content-jobs.sqlite3)
+DEFAULT_JOBS_PATH = Path(os.environ.get('CONTENT_JOBS_PATH', Path(__file__).resolve().parents[2] / '.content-jobs.sqlite3'))
+LEASE_SECONDS = float(os.environ.get('CONTENT_JOBS_LEASE', '600'))
+MAX_REASON_CHARS = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    queue TEXT NOT NULL,
+    path TEXT NOT NULL,
+    field TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_until REAL,
+    error TEXT,
+    updated_at REAL NOT NULL,
+    hash INTEGER NOT NULL DEFAULT 0,
+    shard INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (queue, path, field)
+);
+"""
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (queue, state, path);
+CREATE INDEX IF NOT EXISTS jobs_shard ON jobs (queue, shard, state, path);
+"""
+
+Job = namedtuple('Job', 'path fields attempts')
+
+
+def queue_name(script, directory):
+    """The queue of `script`'s tasks for the files under `directory` ('msty:/abs/dir')."""
+    return f"{script}:{Path(directory).resolve()}"
+
+
+def path_hash(path):
+    """A 32-bit hash of `path` that is the same in every process and on every run."""
+    digest = hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def shard_of(path, count):
+    """The shard (0..count-1) that reshard(count) gives `path`."""
+    return path_hash(path) % count
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+class JobQueue:
+    """
+    The tasks of one queue in the shared jobs file (path=None for an in-memory queue). Safe to use
+    from the event loop and the writer threads of one process; one instance per process.
+    `shard` = (index, count) restricts claims to the files of that shard (see reshard()).
+    """
+
+    def __init__(self, queue, path=DEFAULT_JOBS_PATH, lease_seconds=LEASE_SECONDS, worker_id=None, shard=None):
+        self.queue = queue
+        self.shard = shard
+        self.path = Path(path) if path else None
+        self.lease_seconds = lease_seconds
+        self.host = socket.gethostname()
+        self.worker_id = worker_id or f"{self.host}:{os.getpid()}"
+        self.claimed = 0
+        self.reclaimed = 0
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit; claims open their own BEGIN IMMEDIATE transaction
+        self._db = sqlite3.connect(str(self.path) if self.path else ':memory:', timeout=30,
+                                   isolation_level=None, check_same_thread=False)
+        if self.path is not None:
+            self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript(SCHEMA)
+        self._add_shard_columns()
+        self._db.executescript(INDEXES)
+        self.reclaimed = self._reclaim_orphans() + self._requeue_expired(time.time())
+
+    def _add_shard_columns(self):
+        # Jobs files from before sharding: add the columns and hash the paths already queued
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        if 'hash' in columns:
+            return
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+                if 'hash' not in columns:
+                    self._db.execute('ALTER TABLE jobs ADD COLUMN hash INTEGER NOT NULL DEFAULT 0')
+                    self._db.execute('ALTER TABLE jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0')
+                    paths = [path for (path,) in self._db.execute('SELECT DISTINCT path FROM jobs')]
+                    self._db.executemany('UPDATE jobs SET hash = ? WHERE path = ?', [(path_hash(path), path) for path in paths])
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+
+    def _reclaim_orphans(self):
+        """Puts back tasks leased to processes on this host that no longer exist (a killed run)."""
+        prefix = f"{self.host}:"
+        rows = self._db.execute(
+            "SELECT DISTINCT worker FROM jobs WHERE queue = ? AND state = 'in_flight' AND worker LIKE ?",
+            (self.queue, prefix + '%'),
+        ).fetchall()
+        dead = [worker for (worker,) in rows
+                if worker != self.worker_id and worker[len(prefix):].isdigit() and not _pid_alive(int(worker[len(prefix):]))]
+        reclaimed = 0
+        for worker in dead:
+            reclaimed += self._db.execute(
+                "UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE queue = ? AND state = 'in_flight' AND worker = ?",
+                (time.time(), self.queue, worker),
+            ).rowcount
+        return reclaimed
+
+    def _requeue_expired(self, now):
+        """Puts back in-flight tasks whose lease ran out (a hung or partitioned worker). Returns how many."""
+        return self._db.execute(
+            "UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL, updated_at = ? "
+            "WHERE queue = ? AND state = 'in_flight' AND lease_until < ?",
+            (now, self.queue, now),
+        ).rowcount
+
+    def enqueue_many(self, items):
+        """
+        Queues (path, fields) pairs. New tasks start pending with no attempts; done and failed ones
+        go back to pending; pending and in-flight tasks are untouched. Returns the rows changed.
+        """
+        now = time.time()
+        rows = []
+        for path, fields in items:
+            path = os.path.abspath(path)
+            rows += [(self.queue, path, field, path_hash(path), now) for field in fields]
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                before = self._db.total_changes
+                self._db.executemany(
+                    "INSERT INTO jobs (queue, path, field, hash, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (queue, path, field) DO UPDATE SET state = 'pending', attempts = 0, worker = NULL, "
+                    "lease_until = NULL, updated_at = excluded.updated_at WHERE jobs.state IN ('done', 'failed')",
+                    rows,
+                )
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            return self._db.total_changes - before
+
+    def reshard(self, count):
+        """Assigns every unfinished task to shard hash % count, for JobQueue(shard=(i, count)) claims."""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET shard = hash % ? WHERE queue = ? AND state IN ('pending', 'in_flight') AND shard != hash % ?",
+                (count, self.queue, count),
+            ).rowcount
+
+    def _pending_query(self, limit):
+        """(sql, params) selecting the next `limit` files with pending tasks (this shard's, if sharded)."""
+        sql = "SELECT DISTINCT path FROM jobs WHERE queue = ? AND state = 'pending'"
+        params = [self.queue]
+        if self.shard is not None:
+            sql += " AND shard = ?"
+            params.append(self.shard[0])
+        return sql + " ORDER BY path LIMIT ?", params + [limit]
+
+    def claim_many(self, limit):
+        """Leases the claimable tasks of up to `limit` files; returns a Job per file, in path order."""
+        now = time.time()
+        jobs = []
+        sql, params = self._pending_query(limit)
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                paths = [path for (path,) in self._db.execute(sql, params)]
+                # Nothing (or too little) pending: the queue is draining, so this is when leases that
+                # ran out are worth looking for (only in-flight rows are read)
+                if len(paths) < limit and self._requeue_expired(now):
+                    paths = [path for (path,) in self._db.execute(sql, params)]
+                for path in paths:
+                    self._db.execute(
+                        "UPDATE jobs SET state = 'in_flight', worker = ?, lease_until = ?, attempts = attempts + 1, "
+                        "updated_at = ? WHERE queue = ? AND path = ? AND state = 'pending'",
+                        (self.worker_id, now + self.lease_seconds, now, self.queue, path),
+                    )
+                    rows = self._db.execute(
+                        "SELECT field, attempts FROM jobs WHERE queue = ? AND path = ? AND state = 'in_flight' AND worker = ? "
+                        "ORDER BY field",
+                        (self.queue, path, self.worker_id),
+                    ).fetchall()
+                    jobs.append(Job(path, [field for field, _ in rows], max(attempts for _, attempts in rows)))
+                self._db.execute('COMMIT')
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+        self.claimed += len(jobs)
+        return jobs
+
+    def claim(self):
+        """The next file's claimable tasks as a Job, or None when the queue has nothing left to hand out."""
+        jobs = self.claim_many(1)
+        return jobs[0] if jobs else None
+
+    def _finish(self, path, state, fields=None, error=None):
+        sql = ("UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, error = ?, updated_at = ? "
+               "WHERE queue = ? AND path = ? AND state = 'in_flight' AND worker = ?")
+        params = [state, error, time.time(), self.queue, os.path.abspath(path), self.worker_id]
+        if fields is not None:
+            fields = list(fields)
+            if not fields:
+                return 0
+            sql += f" AND field IN ({', '.join('?' * len(fields))})"
+            params += fields
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def done(self, path, fields=None):
+        """Marks this process's tasks for `path` (all, or just `fields`) done."""
+        return self._finish(path, DONE, fields)
+
+    def fail(self, path, reason, fields=None):
+        """Marks this process's tasks for `path` failed, keeping the reason."""
+        return self._finish(path, FAILED, fields, str(reason)[:MAX_REASON_CHARS])
+
+    def release(self, path, fields=None):
+        """Hands this process's tasks for `path` back to the queue (their attempts are kept)."""
+        return self._finish(path, PENDING, fields)
+
+    def release_held(self):
+        """Hands back every task this process still holds (end of a run, Ctrl-C, dry run)."""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET state = 'pending', worker = NULL, lease_until = NULL, updated_at = ? "
+                "WHERE queue = ? AND state = 'in_flight' AND worker = ?",
+                (time.time(), self.queue, self.worker_id),
+            ).rowcount
+
+    def renew(self):
+        """Extends the lease of every task this process holds, and re-queues other workers' expired ones."""
+        now = time.time()
+        with self._lock:
+            renewed = self._db.execute(
+                "UPDATE jobs SET lease_until = ?, updated_at = ? WHERE queue = ? AND state = 'in_flight' AND worker = ?",
+                (now + self.lease_seconds, now, self.queue, self.worker_id),
+            ).rowcount
+            self._requeue_expired(now)
+            return renewed
+
+    # Every call above is a committing write that can wait on another process's lock (WAL, --workers N).
+    # Async workers use these instead, so that wait runs in a thread and never stalls the event loop.
+    async def aclaim(self):
+        return await asyncio.to_thread(self.claim)
+
+    async def aclaim_many(self, limit):
+        return await asyncio.to_thread(self.claim_many, limit)
+
+    async def adone(self, path, fields=None):
+        return await asyncio.to_thread(self.done, path, fields)
+
+    async def afail(self, path, reason, fields=None):
+        return await asyncio.to_thread(self.fail, path, reason, fields)
+
+    async def arelease(self, path, fields=None):
+        return await asyncio.to_thread(self.release, path, fields)
+
+    def retry_failed(self):
+        """Re-queues every failed task (the reason is kept until it succeeds). Returns how many."""
+        with self._lock:
+            return self._db.execute(
+                "UPDATE jobs SET state = 'pending', updated_at = ? WHERE queue = ? AND state = 'failed'",
+                (time.time(), self.queue),
+            ).rowcount
+
+    def counts(self):
+        """{state: tasks} for every state."""
+        counts = dict.fromkeys(STATES, 0)
+        with self._lock:
+            for state, count in self._db.execute(
+                'SELECT state, COUNT(*) FROM jobs WHERE queue = ? GROUP BY state', (self.queue,)
+            ):
+                counts[state] = count
+        return counts
+
+    def failures(self, limit=20):
+        """[(path, field, reason, attempts)] of the most recently failed tasks."""
+        with self._lock:
+            return self._db.execute(
+                "SELECT path, field, error, attempts FROM jobs WHERE queue = ? AND state = 'failed' "
+                "ORDER BY updated_at DESC LIMIT ?",
+                (self.queue, limit),
+            ).fetchall()
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+async def renew_leases(jobs, interval=None):
+    """Renews `jobs`' leases every third of the lease until cancelled; run it as a task alongside the workers."""
+    while True:
+        await asyncio.sleep(interval or jobs.lease_seconds / 3)
+        await asyncio.to_thread(jobs.renew)
+
+
+def _run_shard(entry, shard, log_settings, args):
+    # Runs in the worker process: same log threshold and sinks as the parent, whole lines on stdout
+    # so the workers' output interleaves line by line
+    logging_setup.configure(**log_settings)
+    sys.stdout.reconfigure(line_buffering=True)
+    return entry(shard, *args)
+
+
+def run_shards(entry, workers, *args):
+    """
+    Calls entry((index, workers), *args) in `workers` fresh processes (spawned, so each builds its
+    own HTTP client and queue connection) and returns their results in shard order. `entry` must be
+    a module-level function; the parent should have enqueued the work and called reshard(workers).
+    """
+    log_settings = logging_setup.settings()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(_run_shard, entry, (index, workers), log_settings, args) for index in range(workers)]
+        return [future.result() for future in futures]
+
+
+def add_arguments(parser, workers=None):
+    """
+    Adds --resume, --retry-failed and --jobs-status (stored as args.jobs_mode) to a script's parser,
+    and --workers (default `workers`) when the script can run sharded.
+    """
+    if workers is not None:
+        parser.add_argument('--workers', type=int, default=workers,
+                            help=f"processes to shard the files across by path hash (default {workers}); "
+                                 "each gets the full --concurrency and its own HTTP client")
+    group = parser.add_argument_group('job queue').add_mutually_exclusive_group()
+    group.add_argument('--resume', dest='jobs_mode', action='store_const', const='resume',
+                       help="skip discovery: finish the queued and interrupted tasks only")
+    group.add_argument('--retry-failed', dest='jobs_mode', action='store_const', const='retry_failed',
+                       help="re-queue the failed tasks and run only those (plus anything still queued)")
+    group.add_argument('--jobs-status', dest='jobs_mode', action='store_const', const='status',
+                       help="print the queue's task counts and recent failures, then exit")
+    parser.set_defaults(jobs_mode='run')
+    return parser
+
+
+def plan_run(jobs, mode, discover):
+    """
+    Prepares the queue for a run: 'run' enqueues discover()'s (path, fields) pairs, 'retry_failed'
+    re-queues failures, 'resume' changes nothing. Returns how many tasks were (re)queued.
+    """
+    if mode == 'retry_failed':
+        return jobs.retry_failed()
+    if mode == 'run':
+        return jobs.enqueue_many(discover())
+    return 0
+
+
+def report_status(jobs, log, limit=20):
+    """Logs the queue's counts and its most recent failures."""
+    counts = jobs.counts()
+    log.info('jobs', "{queue}: {pending} pending | {in_flight} in flight | {done} done | {failed} failed",
+             queue=jobs.queue, path=jobs.path, **counts)
+    for path, field, reason, attempts in jobs.failures(limit):
+        log.info('failed', "{path} ({field}, {attempts} attempt(s)): {reason}", path=path, field=field, reason=reason, attempts=attempts)
+    return counts
@@ -0,0 +1,74 @@
+"""
+Module: json_stream
+Incremental scanner that spots the first complete top-level JSON object in streamed model output.
+
+Models often emit the requested {...} object and then keep talking. Feeding each streamed
+token to JsonObjectScanner lets the caller stop reading (and close the request) the moment the
+object's closing brace arrives, instead of waiting for `done`.
+
+- Each character is looked at once; braces inside strings (and escaped quotes) are ignored.
+- Text before the first '{' (code fences, "Here is the JSON:") is skipped.
+
+Usage:
+    scanner = JsonObjectScanner()
+    for token in stream:
+        obj_text = scanner.feed(token)
+        if obj_text is not None:
+            break            # obj_text is the complete '{...}' source
+"""
+
+
+class JsonObjectScanner:
+
+    __slots__ = ('_parts', '_depth', '_in_string', '_escape', '_started')
+
+    def __init__(self):
+        self._parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._started = False
+
+    def feed(self, text):
+        """
+        Consumes the next chunk of output. Returns the complete object text once its closing
+        brace has been seen (later calls keep returning None), otherwise None.
+        """
+        if self._depth < 0:
+            return None
+        if not self._started:
+            start = text.find('{')
+            if start == -1:
+                return None
+            self._started = True
+            text = text[start:]
+        return self._scan(text)
+
+    def _scan(self, text):
+        depth = self._depth
+        in_string = self._in_string
+        escape = self._escape
+        for i, ch in enumerate(text):
+            if in_string:
+                if escape:
+                    escape = False
+                elif ch == '\\':
+                    escape = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == '{':
+                depth += 1
+            elif ch == '}':
+                depth -= 1
+                if depth == 0:
+                    self._parts.append(text[:i + 1])
+                    result = ''.join(self._parts)
+                    # Reset so further feeds are ignored until a new scanner is made
+                    self._parts = []
+                    self._depth = -1
+                    return result
+        self._parts.append(text)
+        self._depth, self._in_string, self._escape = depth, in_string, escape
+        return None
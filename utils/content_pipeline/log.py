@@ -0,0 +1,171 @@
+"""
+Module: log
+Shared structured logging for the ai-labs scripts: level-gated, lazily formatted, one event
+record per call, rendered as the familiar "[TAG] message" lines or as JSON lines.
+
+- Every call is an event: log.info('skip', "No prompt in {path}", path=md_path). The event name is
+  the tag ('rate_limit' prints as [RATE LIMIT]); keyword fields become the record (path=..., attempt=...).
+- A suppressed level costs one integer comparison: the message template is only formatted, and
+  the fields only serialized, when the record is actually emitted. A field value may be a
+  zero-argument callable (lambda: fm.block()) so that expensive values are never even built.
+- Output goes to stdout ('text' keeps the old "[TAG] message" look; 'json' writes one object per
+  line: {"ts", "level", "logger", "event", "msg", ...fields}). CONTENT_LOG_FILE additionally
+  appends JSON lines to a file, handy for grepping/jq over a long run.
+- Configured once per process from the environment (CONTENT_LOG_LEVEL=debug|info|warning|error,
+  CONTENT_LOG_FORMAT=text|json, CONTENT_LOG_FILE=path) or from the scripts' --log-level /
+  --log-format / --log-file flags via add_arguments() + configure_from_args().
+
+Usage:
+    log = get_logger('recraft')
+    log.debug('request_out', "Payload to Recraft API: {payload}", payload=lambda: payload)
+    log.info('file_updated', "Updated {path}", path=md_path, fields=['banner_image'])
+"""
+
+import os
+import sys
+import json
+import time
+import threading
+from datetime import datetime, timezone
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVELS = {'debug': DEBUG, 'info': INFO, 'warning': WARNING, 'error': ERROR}
+LEVEL_NAMES = {value: name for name, value in LEVELS.items()}
+
+
+class _Config:
+    """Process-wide sinks and threshold, shared by every Logger."""
+
+    def __init__(self):
+        self.level = INFO
+        self.format = 'text'
+        self.stream = None  # sys.stdout at write time
+        self.file = None
+        self.file_path = None
+        self.lock = threading.Lock()
+
+    def apply(self, level=None, fmt=None, file=None):
+        if level is not None:
+            self.level = LEVELS[level.lower()] if isinstance(level, str) else int(level)
+        if fmt is not None:
+            if fmt not in ('text', 'json'):
+                raise ValueError(f"log format must be 'text' or 'json', got {fmt!r}")
+            self.format = fmt
+        if file is not None:
+            if self.file is not None:
+                self.file.close()
+            self.file = open(file, 'a', encoding='utf-8') if file else None
+            self.file_path = file or None
+
+
+_config = _Config()
+_config.apply(
+    os.environ.get('CONTENT_LOG_LEVEL', 'info'),
+    os.environ.get('CONTENT_LOG_FORMAT', 'text'),
+    os.environ.get('CONTENT_LOG_FILE') or None,
+)
+
+
+def configure(level=None, fmt=None, file=None):
+    """Changes the threshold and/or sinks for every logger in the process."""
+    _config.apply(level, fmt, file)
+
+
+def settings():
+    """The current threshold and sinks as configure() keyword arguments (to set up a child process alike)."""
+    return {'level': _config.level, 'fmt': _config.format, 'file': _config.file_path}
+
+
+def add_arguments(parser):
+    """Adds --log-level, --log-format and --log-file to a script's argparse parser."""
+    group = parser.add_argument_group('logging')
+    group.add_argument('--log-level', choices=sorted(LEVELS, key=LEVELS.get),
+                       help="lowest level printed (default: CONTENT_LOG_LEVEL or info)")
+    group.add_argument('--log-format', choices=['text', 'json'],
+                       help="stdout as '[TAG] message' lines or JSON lines (default: CONTENT_LOG_FORMAT or text)")
+    group.add_argument('--log-file', help="also append JSON-lines records to this file (default: CONTENT_LOG_FILE)")
+    return parser
+
+
+def configure_from_args(args):
+    configure(getattr(args, 'log_level', None), getattr(args, 'log_format', None), getattr(args, 'log_file', None))
+
+
+def _value(value):
+    return value() if callable(value) else value
+
+
+class Logger:
+    """
+    Named logger. debug/info/warning/error(event, msg=None, **fields); `msg` is a str.format
+    template over the fields (list fields are shown comma-joined). enabled(level) lets callers
+    skip building a whole record.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def enabled(self, level):
+        return level >= _config.level
+
+    def debug(self, event, msg=None, **fields):
+        if DEBUG >= _config.level:
+            self._emit(DEBUG, event, msg, fields)
+
+    def info(self, event, msg=None, **fields):
+        if INFO >= _config.level:
+            self._emit(INFO, event, msg, fields)
+
+    def warning(self, event, msg=None, **fields):
+        if WARNING >= _config.level:
+            self._emit(WARNING, event, msg, fields)
+
+    def error(self, event, msg=None, **fields):
+        if ERROR >= _config.level:
+            self._emit(ERROR, event, msg, fields)
+
+    def _emit(self, level, event, msg, fields):
+        fields = {key: _value(value) for key, value in fields.items()}
+        text = msg or ''
+        if msg and fields:
+            try:
+                # Lists read better joined in a message; the record keeps them as lists
+                text = msg.format(**{key: ', '.join(map(str, value)) if isinstance(value, (list, tuple)) else value
+                                     for key, value in fields.items()})
+            except (KeyError, IndexError, ValueError):
+                # Literal braces in a message (e.g. an embedded JSON snippet): print it as-is
+                pass
+        if _config.format == 'text':
+            line = f"[{event.upper().replace('_', ' ')}] {text}\n"
+        else:
+            line = None
+        record = None
+        if _config.format == 'json' or _config.file is not None:
+            record = {
+                'ts': datetime.fromtimestamp(time.time(), timezone.utc).isoformat(timespec='milliseconds'),
+                'level': LEVEL_NAMES.get(level, str(level)),
+                'logger': self.name,
+                'event': event,
+                'msg': text,
+                **fields,
+            }
+            record = json.dumps(record, default=str, ensure_ascii=False) + '\n'
+        with _config.lock:
+            (_config.stream or sys.stdout).write(line if line is not None else record)
+            if _config.file is not None:
+                _config.file.write(record)
+                _config.file.flush()
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    """The process-wide Logger for `name`."""
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = Logger(name)
+    return logger
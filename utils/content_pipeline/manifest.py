@@ -0,0 +1,91 @@
+"""
+Module: manifest
+Persistent per-file run manifest, so reruns over a large content tree skip unchanged files
+without opening them.
+
+- One JSON object per line: {"path", "mtime_ns", "size", "hash", "decision", ...extra fields}
+- Records are appended as the run goes (a crash loses nothing already decided); the last
+  record for a path wins when loading, and save() compacts the file to one line per path.
+- lookup() matches on (mtime_ns, size) from os.stat only, which is the no-open fast path.
+  When the stat changed but the content did not (touch, git checkout), callers can compare
+  content_digest() of the bytes they read against the stored hash.
+"""
+
+import os
+import json
+import hashlib
+from pathlib import Path
+
+
+def content_digest(data):
+    """Short, fast content hash of a file's bytes."""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class RunManifest:
+    """
+    Usage:
+        manifest = RunManifest(Path(__file__).parent / '.my-script-manifest.jsonl')
+        entry = manifest.lookup(path, path.stat())   # None if new or changed on disk
+        manifest.record(path, st, digest, decision='complete', valid=['banner_image'])
+        manifest.save()
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        self._log = None
+        self.load()
+
+    def load(self):
+        """Reads the manifest, tolerating a truncated last line from an interrupted run."""
+        self.entries = {}
+        if not self.path.exists():
+            return
+        with self.path.open('r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                self.entries[entry['path']] = entry
+
+    def get(self, path):
+        """Returns the last recorded entry for a path regardless of whether it changed, or None."""
+        return self.entries.get(str(path))
+
+    def lookup(self, path, st):
+        """Returns the entry for a path only if its mtime and size still match `st`."""
+        entry = self.entries.get(str(path))
+        if entry and entry['mtime_ns'] == st.st_mtime_ns and entry['size'] == st.st_size:
+            return entry
+        return None
+
+    def record(self, path, st, digest, decision, **extra):
+        """Stores (and appends to disk) the decision made for a file in its current state."""
+        entry = {
+            'path': str(path),
+            'mtime_ns': st.st_mtime_ns,
+            'size': st.st_size,
+            'hash': digest,
+            'decision': decision,
+            **extra,
+        }
+        self.entries[entry['path']] = entry
+        if self._log is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._log = self.path.open('a', encoding='utf-8')
+        self._log.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._log.flush()
+        return entry
+
+    def save(self):
+        """Compacts the manifest to one line per path (temp file + rename, never half-written)."""
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,226 @@
+"""
+Module: metrics
+Per-request latency, retry and token metrics for the provider calls (Recraft, Anthropic, Ollama),
+written to a JSON-lines file and summarized as p50/p95/p99 plus throughput at the end of a run.
+
+- RunMetrics.track(op, **fields) is a context manager around one logical request. The sample it
+  yields is filled in by the caller: attempt() at the start of every (re)try, first_byte() when the
+  response headers or first streamed chunk arrive, tokens(...) from the usage block. Wall time and
+  success/failure are recorded on exit.
+- Wall time is the whole call as the caller sees it (retries and backoff included); TTFB is
+  measured for the last attempt, from sending it to the first byte back. `retries` counts
+  transport-level re-sends; a caller that re-asks after rejecting an answer passes attempt=N as a
+  field, and those requests are counted as re-asks in the summary.
+- httpx_event_hooks() stamps attempts and TTFB for clients we do not drive ourselves (the
+  Anthropic SDK): the hooks find the active sample through a context variable, so concurrent
+  requests in different tasks never mix.
+- One JSON object per request is appended to the metrics file as it finishes
+  ({"type": "request", "run", "ts", "op", "wall", "ttfb", "retries", "ok", tokens..., fields...}),
+  and one {"type": "summary"} record per op when the run is closed. Every run has its own "run" id.
+
+Usage:
+    metrics = RunMetrics(Path('.recraft-metrics.jsonl'))
+    with metrics.track('recraft.generate', size=size) as sample:
+        sample.attempt()
+        ...
+        sample.first_byte()
+    metrics.report(log)
+    metrics.close()
+"""
+
+import json
+import time
+import contextlib
+import contextvars
+from datetime import datetime, timezone
+
+PERCENTILES = (50, 95, 99)
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cached_tokens', 'cache_write_tokens')
+
+# The sample of the request running in the current task (see httpx_event_hooks)
+_current = contextvars.ContextVar('content_pipeline_metrics_sample', default=None)
+
+
+def percentile(ordered, pct):
+    """Nearest-rank percentile of an already sorted list (None if it is empty)."""
+    if not ordered:
+        return None
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Sample:
+    """Measurements for one logical request; see RunMetrics.track()."""
+
+    def __init__(self, op, fields):
+        self.op = op
+        self.fields = fields
+        self.started = time.perf_counter()
+        self.attempt_started = self.started
+        self.attempts = 0
+        self.ttfb = None
+        self.ok = True
+        self.error = None
+        self.token_counts = {}
+
+    def attempt(self):
+        """Marks the start of an attempt; every attempt after the first counts as a retry."""
+        self.attempts += 1
+        self.attempt_started = time.perf_counter()
+        self.ttfb = None
+
+    def first_byte(self):
+        """Marks the first byte of the current attempt's response (only the first call counts)."""
+        if self.ttfb is None:
+            self.ttfb = time.perf_counter() - self.attempt_started
+
+    def tokens(self, **counts):
+        """Adds token counts (input_tokens, output_tokens, cached_tokens, cache_write_tokens); None is skipped."""
+        for key, value in counts.items():
+            if value is not None:
+                self.token_counts[key] = self.token_counts.get(key, 0) + value
+
+    def as_record(self):
+        return {
+            'op': self.op,
+            'wall': round(time.perf_counter() - self.started, 4),
+            'ttfb': round(self.ttfb, 4) if self.ttfb is not None else None,
+            'retries': max(0, self.attempts - 1),
+            'ok': self.ok,
+            **({'error': self.error} if self.error else {}),
+            **self.token_counts,
+            **self.fields,
+        }
+
+
+class RunMetrics:
+    """
+    Collects request records for one run. `path` may be None (report only, no file). The file is
+    opened on the first record, so constructing a RunMetrics costs nothing if no request is made.
+    Worker processes of one run pass the parent's `run` id and hand their records back to it
+    (merge()), so the run is reported once.
+    """
+
+    def __init__(self, path=None, run=None):
+        self.path = path
+        self.run = run or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S.%fZ')
+        self.started = time.monotonic()
+        self.records = []
+        self._file = None
+
+    @contextlib.contextmanager
+    def track(self, op, **fields):
+        sample = Sample(op, fields)
+        token = _current.set(sample)
+        try:
+            yield sample
+        except BaseException as e:
+            sample.ok = False
+            sample.error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self.record(sample.as_record())
+
+    def merge(self, records):
+        """Adds records measured elsewhere (a worker process) to the summary; they are not written again."""
+        self.records.extend(records)
+
+    def record(self, record):
+        self.records.append(record)
+        self._write({'type': 'request', 'run': self.run, 'ts': time.time(), **record})
+
+    def _write(self, record):
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, default=str) + '\n')
+        self._file.flush()
+
+    def summary(self):
+        """op -> {requests, failed, retries, reasks, per_second, wall/ttfb percentiles, token totals}."""
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        by_op = {}
+        for record in self.records:
+            by_op.setdefault(record['op'], []).append(record)
+        summary = {}
+        for op, records in by_op.items():
+            walls = sorted(r['wall'] for r in records)
+            ttfbs = sorted(r['ttfb'] for r in records if r['ttfb'] is not None)
+            stats = {
+                'requests': len(records),
+                'failed': sum(1 for r in records if not r['ok']),
+                'retries': sum(r['retries'] for r in records),
+                'reasks': sum(1 for r in records if (r.get('attempt') or 1) > 1),
+                'per_second': round(len(records) / elapsed, 3),
+            }
+            for pct in PERCENTILES:
+                stats[f'wall_p{pct}'] = percentile(walls, pct)
+                stats[f'ttfb_p{pct}'] = percentile(ttfbs, pct)
+            for key in TOKEN_FIELDS:
+                total = sum(r.get(key, 0) for r in records)
+                if total:
+                    stats[key] = total
+            if stats.get('output_tokens'):
+                stats['output_tokens_per_second'] = round(stats['output_tokens'] / elapsed, 1)
+            summary[op] = stats
+        return summary
+
+    def report(self, log):
+        """Logs one 'metrics' event per op and writes the summary records to the metrics file."""
+        for op, stats in self.summary().items():
+            self._write({'type': 'summary', 'run': self.run, 'op': op, **stats})
+            log.info('metrics', "{op}: {text}", op=op, **stats, text=lambda stats=stats: _summary_text(stats))
+        if self.path is not None and self.records:
+            log.info('metrics', "{requests} request record(s) appended to {path}", requests=len(self.records), path=self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _seconds(value):
+    return f"{value:.2f}s" if value is not None else '-'
+
+
+def _summary_text(stats):
+    parts = [
+        f"{stats['requests']} request(s) ({stats['failed']} failed, {stats['retries']} retries, {stats['reasks']} re-asks)",
+        'wall ' + ' '.join(f"p{pct} {_seconds(stats[f'wall_p{pct}'])}" for pct in PERCENTILES),
+    ]
+    if stats['ttfb_p50'] is not None:
+        parts.append('ttfb ' + ' '.join(f"p{pct} {_seconds(stats[f'ttfb_p{pct}'])}" for pct in PERCENTILES))
+    parts.append(f"{stats['per_second']:.2f} req/s")
+    tokens = [f"{key.replace('_tokens', '')} {stats[key]}" for key in TOKEN_FIELDS if key in stats]
+    if tokens:
+        parts.append('tokens ' + ', '.join(tokens))
+    if 'output_tokens_per_second' in stats:
+        parts.append(f"{stats['output_tokens_per_second']:.1f} output tokens/s")
+    return ' | '.join(parts)
+
+
+def track(metrics, op, **fields):
+    """metrics.track(op, **fields), or a sample that is simply not recorded when metrics is None."""
+    if metrics is None:
+        return contextlib.nullcontext(Sample(op, fields))
+    return metrics.track(op, **fields)
+
+
+def httpx_event_hooks():
+    """
+    event_hooks for an httpx (or Anthropic SDK) client: every request sent inside a track() block
+    counts as an attempt, and the response headers stamp the attempt's TTFB.
+    """
+    async def on_request(request):
+        sample = _current.get()
+        if sample is not None:
+            sample.attempt()
+
+    async def on_response(response):
+        sample = _current.get()
+        if sample is not None:
+            sample.first_byte()
+
+    return {'request': [on_request], 'response': [on_response]}
@@ -0,0 +1,31 @@
+"""
+Module: packing
+Bins several small items into shared requests under a size budget.
+
+A local model spends most of a short file's round-trip on fixed per-request cost (the prompt
+prefix, scheduling, the first token). Sending several short files in one request amortizes that.
+
+- pack_bins() is first-fit decreasing: largest items first, each into the first bin with room.
+  Bins never exceed `budget` (summed `size`) or `max_items`.
+- Items larger than the budget get a bin of their own; callers usually send those unpacked.
+
+Usage:
+    bins = pack_bins(docs, size=lambda d: len(d['content']), budget=16000, max_items=6)
+"""
+
+
+def pack_bins(items, size=len, budget=16000, max_items=8):
+    """Returns a list of bins (lists of items). Each bin's summed size stays within `budget`."""
+    bins = []
+    loads = []
+    for item in sorted(items, key=size, reverse=True):
+        cost = size(item)
+        for i, load in enumerate(loads):
+            if load + cost <= budget and len(bins[i]) < max_items:
+                bins[i].append(item)
+                loads[i] += cost
+                break
+        else:
+            bins.append([item])
+            loads.append(cost)
+    return bins
@@ -0,0 +1,115 @@
+"""
+Module: prompt_cache
+Content-addressed prompt -> generated-asset cache, stored in a single SQLite file.
+
+- Key: blake2b of (normalized prompt, style id, size). Normalizing folds case, collapses
+  whitespace and drops wrapping quotes / trailing punctuation, so trivially different
+  prompts share one entry.
+- Value: a URL plus a JSON metadata blob. Store URLs that outlive the TTL (re-hosted assets), not
+  a provider's temporary ones: a hit is written out as it is.
+- Eviction: entries older than `ttl_seconds` are treated as misses and removed; when the cache
+  grows past `max_entries`, the least recently used entries are dropped (LRU on last_used).
+"""
+
+import re
+import json
+import time
+import sqlite3
+import hashlib
+from pathlib import Path
+
+_WHITESPACE = re.compile(r'\s+')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prompt_cache (
+    key TEXT PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    style_id TEXT,
+    size TEXT,
+    url TEXT NOT NULL,
+    metadata TEXT NOT NULL DEFAULT '{}',
+    created_at REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS prompt_cache_last_used ON prompt_cache (last_used);
+"""
+
+
+def normalize_prompt(prompt):
+    """Canonical form of a prompt for cache keys."""
+    text = _WHITESPACE.sub(' ', prompt or '').strip().strip('"').strip("'").strip()
+    return text.rstrip('.!').lower()
+
+
+def cache_key(prompt, style_id, size):
+    raw = json.dumps([normalize_prompt(prompt), style_id, size], separators=(',', ':'))
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class PromptCache:
+    """
+    Usage:
+        cache = PromptCache(Path(__file__).parent / '.recraft-prompt-cache.sqlite3')
+        url = cache.get(prompt, style_id, size)            # None on miss or expiry
+        url, metadata = cache.lookup(prompt, style_id, size) or (None, {})
+        cache.put(prompt, style_id, size, url, {'model': ...})
+        cache.close()
+    """
+
+    def __init__(self, path, ttl_seconds=86400, max_entries=10000):
+        self.path = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+        self.purge_expired()
+
+    def purge_expired(self):
+        """Drops every entry older than the TTL."""
+        if self.ttl_seconds:
+            with self._db:
+                self._db.execute('DELETE FROM prompt_cache WHERE created_at < ?', (time.time() - self.ttl_seconds,))
+
+    def get(self, prompt, style_id, size):
+        """Returns the cached URL for (prompt, style_id, size), or None. Refreshes LRU position on hit."""
+        entry = self.lookup(prompt, style_id, size)
+        return entry[0] if entry is not None else None
+
+    def lookup(self, prompt, style_id, size):
+        """Like get(), but returns (url, metadata dict) on a hit."""
+        key = cache_key(prompt, style_id, size)
+        row = self._db.execute('SELECT url, created_at, metadata FROM prompt_cache WHERE key = ?', (key,)).fetchone()
+        now = time.time()
+        if row is None or (self.ttl_seconds and now - row[1] > self.ttl_seconds):
+            if row is not None:
+                with self._db:
+                    self._db.execute('DELETE FROM prompt_cache WHERE key = ?', (key,))
+            self.misses += 1
+            return None
+        with self._db:
+            self._db.execute('UPDATE prompt_cache SET last_used = ?, hits = hits + 1 WHERE key = ?', (now, key))
+        self.hits += 1
+        return row[0], json.loads(row[2])
+
+    def put(self, prompt, style_id, size, url, metadata=None):
+        """Stores a generated URL, then trims the cache back to max_entries (least recently used first)."""
+        now = time.time()
+        with self._db:
+            self._db.execute(
+                'INSERT OR REPLACE INTO prompt_cache (key, prompt, style_id, size, url, metadata, created_at, last_used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (cache_key(prompt, style_id, size), prompt, style_id, size, url, json.dumps(metadata or {}), now, now),
+            )
+            if self.max_entries:
+                self._db.execute(
+                    'DELETE FROM prompt_cache WHERE key IN ('
+                    'SELECT key FROM prompt_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,),
+                )
+
+    def close(self):
+        self._db.close()
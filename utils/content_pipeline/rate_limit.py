@@ -0,0 +1,124 @@
+"""
+Module: rate_limit
+Adaptive client-side rate limiting for bulk API runs.
+
+- AdaptiveRateLimiter is a token bucket whose refill rate follows AIMD:
+  every success adds `increase_step` requests/sec, every throttle multiplies the rate by
+  `decrease_factor`. A run therefore settles just under the provider ceiling instead of
+  bouncing off it.
+- A Retry-After from the server pauses ALL callers sharing the limiter, not only the one
+  request that received it.
+- parse_retry_after() and backoff_delay() are the retry helpers used by the callers.
+"""
+
+import time
+import random
+import asyncio
+from email.utils import parsedate_to_datetime
+
+# Statuses worth retrying: throttling plus transient server-side failures
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket with additive-increase / multiplicative-decrease on the refill rate.
+
+    Usage:
+        limiter = AdaptiveRateLimiter(rate=2.0, max_rate=10.0)
+        await limiter.acquire()        # before every request
+        limiter.on_success()           # after a 2xx
+        limiter.on_throttle(retry_after)  # after a 429 (retry_after in seconds, or None)
+    """
+
+    def __init__(self, rate=2.0, burst=None, min_rate=0.2, max_rate=20.0,
+                 increase_step=0.1, decrease_factor=0.5):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase_step = float(increase_step)
+        self.decrease_factor = float(decrease_factor)
+        # Burst defaults to one second worth of requests at the starting rate
+        self.burst = float(burst) if burst is not None else max(1.0, self.rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._lock = asyncio.Lock()
+        # Counters for the end-of-run summary
+        self.throttled = 0
+        self.acquired = 0
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        if elapsed > 0:
+            self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+            self._updated = now
+
+    async def acquire(self):
+        """
+        Waits until a token is available (and any Retry-After pause is over), then takes it.
+        The lock serialises waiters so tokens are handed out in FIFO order.
+        """
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    self.acquired += 1
+                    return
+                await asyncio.sleep((1.0 - self._tokens) / self.rate)
+
+    def on_success(self):
+        """Additive increase: creep the rate back up towards max_rate."""
+        self.rate = min(self.max_rate, self.rate + self.increase_step)
+
+    def on_throttle(self, retry_after=None):
+        """
+        Multiplicative decrease, applied at most once per current request interval so a
+        burst of 429s from requests that were already in flight only counts once.
+        If the server sent Retry-After, every caller waits at least that long.
+        """
+        now = time.monotonic()
+        self.throttled += 1
+        if now - self._last_decrease >= 1.0 / self.rate:
+            self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+            self._last_decrease = now
+            # Drop saved-up tokens so the lower rate takes effect immediately
+            self._tokens = min(self._tokens, 1.0)
+        if retry_after:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+
+def parse_retry_after(value):
+    """
+    Parses a Retry-After header value (delay in seconds, or an HTTP date).
+    Returns seconds to wait as a float, or None if the header is missing or unparseable.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0, retry_after=None):
+    """
+    Full-jitter exponential backoff for retry number `attempt` (1-based).
+    Never returns less than the server's Retry-After, when one was given.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** (attempt - 1))))
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
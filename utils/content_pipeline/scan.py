@@ -0,0 +1,201 @@
+"""
+Module: scan
+Parallel markdown tree scanner backed by a persistent frontmatter index, so the scripts can
+select their work (files missing lede, image_prompt, banner_image, ...) without opening every file.
+
+- The tree is walked with os.scandir: file/directory types come from the directory listing
+  itself, so only .md files cost a stat call.
+- Only files that are new or whose (mtime_ns, size) changed are read, in a thread pool, and
+  only their frontmatter head: the first HEAD_CHUNK bytes, doubled until the closing '---' is
+  in the buffer (at most HEAD_MAX_BYTES). Bodies are never loaded.
+- The index (SQLite, one row per file: path, mtime_ns, size, has-frontmatter, top-level field
+  values) is shared by all scripts and keyed by absolute path, so any root can be refreshed.
+  A warm refresh of a 10k-file tree is a walk + stat per file and a handful of re-reads.
+
+Usage:
+    index = FrontmatterIndex(DEFAULT_INDEX_PATH)
+    index.refresh(TARGET_DIR)
+    for path in index.select(TARGET_DIR, missing_any=('lede', 'image_prompt')):
+        ...
+    index.close()
+"""
+
+import os
+import json
+import sqlite3
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+from .frontmatter import Frontmatter
+from .log import get_logger
+
+log = get_logger('scan')
+
+# Shared by every script unless CONTENT_INDEX_PATH says otherwise (ai-labs/.content-index.sqlite3)
+DEFAULT_INDEX_PATH = Path(os.environ.get('CONTENT_INDEX_PATH', Path(__file__).resolve().parents[2] / '.content-index.sqlite3'))
+HEAD_CHUNK = 8 * 1024
+HEAD_MAX_BYTES = 1024 * 1024
+# Field values are stored for selection only (the scripts re-read the files they work on)
+MAX_VALUE_CHARS = 1024
+
+
+def walk_markdown(root):
+    """Yields (absolute path, stat) for every .md file under `root`, using os.scandir."""
+    stack = [os.path.abspath(root)]
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.name.endswith('.md') and entry.is_file():
+                            yield entry.path, entry.stat()
+                    except OSError:
+                        continue
+        except OSError as e:
+            log.warning('scan', "Cannot list {path}: {error}", path=directory, error=str(e))
+
+
+def read_frontmatter_head(path, chunk=HEAD_CHUNK, limit=HEAD_MAX_BYTES):
+    """
+    Parses the frontmatter from the head of a file without reading the body.
+    Returns a Frontmatter (its body is whatever partial text followed) or None.
+    """
+    with open(path, 'rb') as f:
+        data = f.read(chunk)
+        if not data.startswith(b'---'):
+            return None
+        while True:
+            fm = Frontmatter.parse(data.decode('utf-8', errors='replace'))
+            # A closing '---' with no newline yet may be the start of a longer line: read on
+            if fm is not None and (fm.lines[-1].endswith('\n') or fm.body):
+                return fm
+            if len(data) >= limit:
+                return fm
+            more = f.read(len(data))
+            if not more:
+                return fm
+            data += more
+
+
+def read_entry(path, st):
+    """Index row for one file in its current state."""
+    try:
+        fm = read_frontmatter_head(path)
+    except (OSError, ValueError) as e:
+        log.warning('scan', "Cannot read {path}: {error}", path=path, error=str(e))
+        fm = None
+    fields = {}
+    if fm is not None:
+        for key in fm.keys():
+            value = fm.get(key) or ''
+            fields[key] = value[:MAX_VALUE_CHARS]
+    return {
+        'path': path,
+        'mtime_ns': st.st_mtime_ns,
+        'size': st.st_size,
+        'frontmatter': fm is not None,
+        'fields': fields,
+    }
+
+
+def missing_fields(entry, fields):
+    """The subset of `fields` that are absent or blank in an index entry."""
+    values = entry['fields']
+    return [field for field in fields if not values.get(field, '').strip()]
+
+
+class FrontmatterIndex:
+    """
+    path -> {mtime_ns, size, frontmatter, fields} for every markdown file seen, persisted in
+    SQLite (pass path=None for an in-memory index). Not thread-safe; one per process.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX_PATH):
+        self.path = Path(path) if path else None
+        self.entries = {}
+        self._db = None
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS files ('
+                ' path TEXT PRIMARY KEY, mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL,'
+                ' frontmatter INTEGER NOT NULL, fields TEXT NOT NULL)'
+            )
+            for path, mtime_ns, size, frontmatter, fields in self._db.execute('SELECT * FROM files'):
+                self.entries[path] = {
+                    'path': path, 'mtime_ns': mtime_ns, 'size': size,
+                    'frontmatter': bool(frontmatter), 'fields': json.loads(fields),
+                }
+
+    def refresh(self, root, max_workers=8):
+        """
+        Brings the index up to date for everything under `root`: new and changed files are
+        re-read (frontmatter head only, in a thread pool), deleted files are dropped.
+        Returns {'files', 'read', 'removed'}.
+        """
+        root = os.path.abspath(root)
+        prefix = root.rstrip(os.sep) + os.sep
+        stats = {}
+        stale = []
+        for path, st in walk_markdown(root):
+            stats[path] = st
+            entry = self.entries.get(path)
+            if entry is None or entry['mtime_ns'] != st.st_mtime_ns or entry['size'] != st.st_size:
+                stale.append(path)
+        removed = [path for path in self.entries if path.startswith(prefix) and path not in stats]
+        fresh = []
+        if stale:
+            with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='scan') as pool:
+                fresh = list(pool.map(lambda path: read_entry(path, stats[path]), stale))
+        for path in removed:
+            del self.entries[path]
+        for entry in fresh:
+            self.entries[entry['path']] = entry
+        if self._db is not None and (fresh or removed):
+            with self._db:
+                self._db.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in removed])
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)',
+                    [(e['path'], e['mtime_ns'], e['size'], int(e['frontmatter']), json.dumps(e['fields']))
+                     for e in fresh],
+                )
+        return {'files': len(stats), 'read': len(fresh), 'removed': len(removed)}
+
+    def get(self, path):
+        return self.entries.get(os.path.abspath(path))
+
+    def select(self, root, missing_any=(), require_frontmatter=True, predicate=None):
+        """
+        Sorted paths under `root` whose entry has any of `missing_any` blank (all files if empty),
+        has frontmatter (unless require_frontmatter=False) and passes `predicate(entry)`.
+        """
+        prefix = os.path.abspath(root).rstrip(os.sep) + os.sep
+        selected = []
+        for path, entry in self.entries.items():
+            if not path.startswith(prefix):
+                continue
+            if require_frontmatter and not entry['frontmatter']:
+                continue
+            if missing_any and not missing_fields(entry, missing_any):
+                continue
+            if predicate is not None and not predicate(entry):
+                continue
+            selected.append(path)
+        selected.sort()
+        return selected
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
+def scan(root, index_path=DEFAULT_INDEX_PATH, max_workers=8):
+    """Opens the index, refreshes `root` and returns (index, refresh stats)."""
+    index = FrontmatterIndex(index_path)
+    return index, index.refresh(root, max_workers)
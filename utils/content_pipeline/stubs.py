@@ -0,0 +1,523 @@
+"""
+Module: stubs
+Local aiohttp stand-ins for the provider APIs, so the scripts can be exercised offline.
+
+Recraft stub:
+- POST /v1/images/generations returns {"data": [{"url": ...}]} after `latency` seconds. The URL is
+  served by the stub itself (GET /assets/{name}): an SVG of about `asset_bytes` bytes, streamed in
+  chunks, whose bytes depend only on (prompt, size), so repeated prompts give identical content
+- Enforces a server-side ceiling of `ceiling_rps` requests/sec; anything above it gets a
+  429 with a Retry-After header (the behaviour the adaptive limiter is tuned against)
+- Fails a random `error_rate` fraction of requests with a 503
+- POST /v1/styles reads the multipart upload in chunks and returns a style {"id", "style", ...}
+  (same ceiling, latency and error rate); counts files and bytes on app[STATS]
+
+Ollama stub:
+- POST /api/generate streams NDJSON chunks like Ollama: one {"response": token} per token at
+  `token_rate` tokens/sec, then a final {"done": true, ...} chunk with eval counts
+- Prompt evaluation costs len(prompt) / `prompt_rate` chars/sec before the first token
+- At most `num_parallel` generations run at once (OLLAMA_NUM_PARALLEL); the rest queue
+- The answer is a {"lede", "image_prompt"} JSON object followed by `ramble_tokens` of extra text;
+  a packed prompt ('### FILE <id> ###' sections) gets one such object per file id
+- Prompt cache: like the server's per-slot KV cache, the longest common prefix with one of the
+  last `num_parallel` prompts is already evaluated; only the rest is charged (time and
+  prompt_eval_count). "stream": false returns one JSON object
+
+Anthropic stub:
+- POST /v1/messages answers like the Messages API with the same JSON object as text
+- Prompt caching: the system/message prefix up to the last `cache_control` block is kept for
+  `cache_ttl` seconds; repeats are reported as cache_read_input_tokens and cost no processing
+  time, everything else costs `latency` + uncached chars / `input_rate`
+- Fails a random `error_rate` fraction of requests with a 529 overloaded_error
+- Message Batches: POST /v1/messages/batches, GET /v1/messages/batches/{id} and its results_url
+  (JSONL). A batch ends `batch_latency` seconds after creation; failed requests come back errored
+
+ImageKit stub:
+- POST /api/v1/files/upload reads the multipart upload in chunks and answers {"url", "fileId", "size"}
+  with url https://ik.imagekit.io/stub<folder>/<fileName>; counts uploads and bytes on app[STATS]
+
+Both model stubs answer a random `generic_rate` fraction with placeholder text (exercises the retry paths).
+
+Usage (then point the scripts at it with RECRAFT_API_URL=http://127.0.0.1:8765/v1/images/generations,
+LOCAL_MODEL_API_SERVICE_MSTY=http://127.0.0.1:10100 or ANTHROPIC_BASE_URL=http://127.0.0.1:8766):
+    python utils/content_pipeline/stubs.py recraft --port 8765 --ceiling-rps 5 --error-rate 0.05
+    python utils/content_pipeline/stubs.py ollama --port 10100 --num-parallel 4
+    python utils/content_pipeline/stubs.py anthropic --port 8766 --input-rate 50000
+    python utils/content_pipeline/stubs.py imagekit --port 8767
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import asyncio
+import argparse
+from aiohttp import web
+
+# Every stub's request/byte counters: app[STATS]
+STATS = web.AppKey('stats', dict)
+
+
+def make_recraft_app(latency=0.2, ceiling_rps=5.0, error_rate=0.0, retry_after=1, asset_bytes=2048):
+    """
+    Builds the Recraft stub application. Counters are exposed on app[STATS].
+    """
+    app = web.Application()
+    stats = {'requests': 0, 'ok': 0, 'throttled': 0, 'errors': 0, 'styles': 0, 'style_files': 0, 'style_bytes': 0,
+             'asset_downloads': 0}
+    # Asset name -> (prompt, size) it was generated for; the bytes are rebuilt on download
+    assets = {}
+    # Server-side token bucket holding the ceiling
+    bucket = {'tokens': float(ceiling_rps), 'updated': time.monotonic()}
+
+    def admit():
+        if not ceiling_rps:
+            return True
+        now = time.monotonic()
+        bucket['tokens'] = min(ceiling_rps, bucket['tokens'] + (now - bucket['updated']) * ceiling_rps)
+        bucket['updated'] = now
+        if bucket['tokens'] >= 1.0:
+            bucket['tokens'] -= 1.0
+            return True
+        return False
+
+    async def generate(request):
+        stats['requests'] += 1
+        payload = await request.json()
+        if not admit():
+            stats['throttled'] += 1
+            return web.json_response(
+                {'code': 'too_many_requests'}, status=429,
+                headers={'Retry-After': str(retry_after)},
+            )
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            return web.json_response({'code': 'unavailable'}, status=503)
+        stats['ok'] += 1
+        name = f"{stats['ok']}-{payload.get('size', '')}.svg"
+        assets[name] = (payload.get('prompt', ''), payload.get('size', ''))
+        return web.json_response({
+            'created': int(time.time()),
+            'data': [{'url': f"{request.scheme}://{request.host}/assets/{name}"}],
+        })
+
+    async def download_asset(request):
+        source = assets.get(request.match_info['name'])
+        if source is None:
+            return web.json_response({'code': 'not_found'}, status=404)
+        stats['asset_downloads'] += 1
+        seed = hashlib.sha256(repr(source).encode('utf-8')).hexdigest()
+        head = f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 16 9"><!-- {seed} '.encode('utf-8')
+        tail = b' --><rect width="16" height="9"/></svg>\n'
+        padding = max(0, asset_bytes - len(head) - len(tail))
+        response = web.StreamResponse(headers={'Content-Type': 'image/svg+xml'})
+        response.content_length = len(head) + padding + len(tail)
+        await response.prepare(request)
+        await response.write(head)
+        chunk = (seed.encode('utf-8') * (65536 // len(seed) + 1))[:65536]
+        while padding > 0:
+            await response.write(chunk[:padding])
+            padding -= min(padding, len(chunk))
+        await response.write(tail)
+        await response.write_eof()
+        return response
+
+    async def create_style(request):
+        stats['requests'] += 1
+        if not admit():
+            stats['throttled'] += 1
+            return web.json_response(
+                {'code': 'too_many_requests'}, status=429,
+                headers={'Retry-After': str(retry_after)},
+            )
+        fields = {}
+        files = 0
+        size = 0
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename:
+                files += 1
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+            else:
+                fields[part.name] = await part.text()
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            return web.json_response({'code': 'unavailable'}, status=503)
+        if not files or 'style' not in fields:
+            return web.json_response({'code': 'invalid_request', 'message': 'style and files are required'}, status=400)
+        stats['ok'] += 1
+        stats['styles'] += 1
+        stats['style_files'] += files
+        stats['style_bytes'] += size
+        return web.json_response({
+            'creation_time': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'credits': 40,
+            'id': f"stub-style-{stats['styles']:04d}",
+            'is_private': True,
+            'style': fields['style'],
+        })
+
+    app[STATS] = stats
+    app.router.add_post('/v1/images/generations', generate)
+    app.router.add_post('/v1/styles', create_style)
+    app.router.add_get('/assets/{name}', download_asset)
+    return app
+
+
+def make_imagekit_app(latency=0.1, error_rate=0.0):
+    """
+    Builds the ImageKit upload stub. Counters are exposed on app[STATS].
+    """
+    app = web.Application()
+    stats = {'requests': 0, 'uploads': 0, 'bytes': 0, 'errors': 0}
+
+    async def upload(request):
+        stats['requests'] += 1
+        fields = {}
+        size = 0
+        reader = await request.multipart()
+        async for part in reader:
+            if part.name == 'file':
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+            else:
+                fields[part.name] = await part.text()
+        await asyncio.sleep(latency)
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            return web.json_response({'message': 'unavailable'}, status=503)
+        if not request.headers.get('Authorization', '').startswith('Basic '):
+            return web.json_response({'message': 'Your request does not contain private API key.'}, status=403)
+        stats['uploads'] += 1
+        stats['bytes'] += size
+        folder = '/' + fields.get('folder', '').strip('/')
+        return web.json_response({
+            'fileId': f"stub-{stats['uploads']:06d}",
+            'name': fields.get('fileName', ''),
+            'size': size,
+            'url': f"https://ik.imagekit.io/stub{folder.rstrip('/')}/{fields.get('fileName', '')}",
+        })
+
+    app[STATS] = stats
+    app.router.add_post('/api/v1/files/upload', upload)
+    return app
+
+
+STUB_ANSWER = {
+    'lede': 'A working map of the quiet machinery that turns scattered notes into a living, searchable record.',
+    'image_prompt': 'A brass orrery of index cards orbiting a glowing desk lamp, drawn in clean vector lines.',
+}
+
+
+GENERIC_ANSWER = {
+    'lede': 'This is a placeholder for the lede.',
+    'image_prompt': 'An example image for this document.',
+}
+
+# Packed prompts introduce each file with this line; the answer is then keyed by file id
+PACKED_FILE_ID = re.compile(r'^### FILE (\w+) ###$', re.MULTILINE)
+
+
+def tokenize(text, size=4):
+    """Splits text into ~`size`-character pseudo tokens."""
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def make_ollama_app(num_parallel=4, token_rate=200.0, prompt_rate=20000.0, ramble_tokens=0, error_rate=0.0,
+                    generic_rate=0.0):
+    """
+    Builds the Ollama stub application. Counters are exposed on app[STATS].
+    """
+    app = web.Application()
+    stats = {'requests': 0, 'completed': 0, 'aborted': 0, 'errors': 0, 'max_active': 0, 'active': 0,
+             'prompt_chars': 0, 'cached_prompt_chars': 0}
+    slots = asyncio.Semaphore(num_parallel)
+    # The prompts the slots last evaluated, most recent last
+    recent_prompts = []
+
+    async def generate(request):
+        stats['requests'] += 1
+        payload = await request.json()
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            return web.json_response({'error': 'model runner crashed'}, status=500)
+        async with slots:
+            stats['active'] += 1
+            stats['max_active'] = max(stats['max_active'], stats['active'])
+            try:
+                if payload.get('stream', True) is False:
+                    return await whole_answer(payload)
+                return await stream_answer(request, payload)
+            finally:
+                stats['active'] -= 1
+
+    async def evaluate_prompt(payload):
+        """Sleeps for the prompt's evaluation cost; returns the number of chars that had to be evaluated."""
+        prompt = payload.get('prompt', '')
+        cached = max((len(os.path.commonprefix([prompt, seen])) for seen in recent_prompts), default=0)
+        # At least the last char is always evaluated, as a real server does to produce logits
+        cached = min(cached, len(prompt) - 1) if prompt else 0
+        recent_prompts.append(prompt)
+        del recent_prompts[:-num_parallel]
+        stats['prompt_chars'] += len(prompt) - cached
+        stats['cached_prompt_chars'] += cached
+        await asyncio.sleep((len(prompt) - cached) / prompt_rate)
+        return len(prompt) - cached
+
+    def final_chunk(payload, evaluated, tokens, started, prompt_done):
+        return {
+            'model': payload.get('model'), 'response': '', 'done': True,
+            'prompt_eval_count': max(1, evaluated // 4),
+            'prompt_eval_duration': int((prompt_done - started) * 1e9),
+            'eval_count': len(tokens),
+            'eval_duration': int((time.monotonic() - prompt_done) * 1e9),
+            'total_duration': int((time.monotonic() - started) * 1e9),
+        }
+
+    def answer_for(prompt):
+        pick = lambda: GENERIC_ANSWER if random.random() < generic_rate else STUB_ANSWER
+        file_ids = PACKED_FILE_ID.findall(prompt)
+        if file_ids:
+            return {file_id: pick() for file_id in file_ids}
+        return pick()
+
+    def answer_tokens(payload):
+        tokens = tokenize(json.dumps(answer_for(payload.get('prompt', '')))) + tokenize(' Let me also explain my reasoning in detail.' * 50)[:ramble_tokens]
+        limit = (payload.get('options') or {}).get('num_predict')
+        return tokens[:limit] if limit and limit > 0 else tokens
+
+    async def whole_answer(payload):
+        started = time.monotonic()
+        evaluated = await evaluate_prompt(payload)
+        prompt_done = time.monotonic()
+        tokens = answer_tokens(payload)
+        await asyncio.sleep(len(tokens) / token_rate)
+        final = final_chunk(payload, evaluated, tokens, started, prompt_done)
+        final['response'] = ''.join(tokens)
+        stats['completed'] += 1
+        return web.json_response(final)
+
+    async def stream_answer(request, payload):
+        started = time.monotonic()
+        evaluated = await evaluate_prompt(payload)
+        prompt_done = time.monotonic()
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        tokens = answer_tokens(payload)
+        try:
+            for token in tokens:
+                await asyncio.sleep(1.0 / token_rate)
+                chunk = {'model': payload.get('model'), 'response': token, 'done': False}
+                await response.write((json.dumps(chunk) + '\n').encode('utf-8'))
+            final = final_chunk(payload, evaluated, tokens, started, prompt_done)
+            await response.write((json.dumps(final) + '\n').encode('utf-8'))
+            await response.write_eof()
+            stats['completed'] += 1
+        except (ConnectionResetError, asyncio.CancelledError):
+            # Client closed the stream early
+            stats['aborted'] += 1
+            raise
+        return response
+
+    app[STATS] = stats
+    app.router.add_post('/api/generate', generate)
+    return app
+
+
+def _block_text(block):
+    if isinstance(block, str):
+        return block
+    if block.get('type') == 'text':
+        return block.get('text', '')
+    return json.dumps(block, sort_keys=True)
+
+
+def split_cached_prefix(payload):
+    """
+    Flattens system + messages into (cacheable prefix text, remaining text). The prefix runs up
+    to and including the last block carrying cache_control, as in the Messages API.
+    """
+    blocks = []
+    system = payload.get('system') or []
+    blocks.extend([{'type': 'text', 'text': system}] if isinstance(system, str) else system)
+    for message in payload.get('messages', []):
+        content = message.get('content', '')
+        blocks.extend([{'type': 'text', 'text': content}] if isinstance(content, str) else content)
+    cut = 0
+    for i, block in enumerate(blocks):
+        if isinstance(block, dict) and block.get('cache_control'):
+            cut = i + 1
+    texts = [_block_text(b) for b in blocks]
+    return ''.join(texts[:cut]), ''.join(texts[cut:])
+
+
+def _iso(epoch):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(epoch)) if epoch else None
+
+
+def make_anthropic_app(latency=0.3, input_rate=50000.0, error_rate=0.0, cache_ttl=300.0,
+                       generic_rate=0.0, batch_latency=2.0):
+    """
+    Builds the Anthropic Messages (and Message Batches) stub application. Counters are exposed on app[STATS].
+    """
+    app = web.Application()
+    stats = {'requests': 0, 'ok': 0, 'errors': 0, 'cache_writes': 0, 'cache_reads': 0,
+             'batches': 0, 'batch_requests': 0}
+    # prefix text -> expiry (monotonic); a hit refreshes the TTL like the real cache
+    cache = {}
+    # batch id -> {'created': epoch, 'requests': [...], 'results': None | [...]}
+    batches = {}
+
+    def usage_for(payload):
+        """Token usage for a request plus the number of chars that need processing (cache misses)."""
+        prefix, rest = split_cached_prefix(payload)
+        usage = {'input_tokens': len(rest) // 4, 'cache_creation_input_tokens': 0, 'cache_read_input_tokens': 0}
+        uncached = len(rest)
+        if prefix:
+            if cache.get(prefix, 0) > time.monotonic():
+                usage['cache_read_input_tokens'] = len(prefix) // 4
+                stats['cache_reads'] += 1
+            else:
+                usage['cache_creation_input_tokens'] = len(prefix) // 4
+                uncached += len(prefix)
+                stats['cache_writes'] += 1
+        return prefix, usage, uncached
+
+    def message_for(payload, usage, message_id):
+        text = json.dumps(GENERIC_ANSWER if random.random() < generic_rate else STUB_ANSWER)
+        usage['output_tokens'] = len(text) // 4
+        return {
+            'id': message_id, 'type': 'message', 'role': 'assistant',
+            'model': payload.get('model'), 'content': [{'type': 'text', 'text': text}],
+            'stop_reason': 'end_turn', 'stop_sequence': None, 'usage': usage,
+        }
+
+    async def messages(request):
+        stats['requests'] += 1
+        payload = await request.json()
+        if random.random() < error_rate:
+            stats['errors'] += 1
+            return web.json_response(
+                {'type': 'error', 'error': {'type': 'overloaded_error', 'message': 'Overloaded'}}, status=529,
+            )
+        prefix, usage, uncached = usage_for(payload)
+        await asyncio.sleep(latency + uncached / input_rate)
+        if prefix:
+            # Like the real cache, an entry is only readable once the request that wrote it has finished
+            cache[prefix] = time.monotonic() + cache_ttl
+        stats['ok'] += 1
+        return web.json_response(message_for(payload, usage, f"msg_stub_{stats['requests']}"))
+
+    def run_batch(batch):
+        """Produces every result of a batch at once, the first time it is seen as ended."""
+        results = []
+        for item in batch['requests']:
+            if random.random() < error_rate:
+                result = {'type': 'errored', 'error': {'type': 'error', 'error': {'type': 'api_error', 'message': 'Internal error'}}}
+            else:
+                prefix, usage, _ = usage_for(item['params'])
+                if prefix:
+                    cache[prefix] = time.monotonic() + cache_ttl
+                result = {'type': 'succeeded', 'message': message_for(item['params'], usage, f"msg_stub_{item['custom_id']}")}
+            results.append({'custom_id': item['custom_id'], 'result': result})
+        batch['results'] = results
+
+    def batch_object(request, batch_id):
+        batch = batches[batch_id]
+        ended_at = batch['created'] + batch_latency
+        ended = time.time() >= ended_at
+        if ended and batch['results'] is None:
+            run_batch(batch)
+        counts = {'processing': 0, 'succeeded': 0, 'errored': 0, 'canceled': 0, 'expired': 0}
+        if ended:
+            for entry in batch['results']:
+                counts[entry['result']['type']] += 1
+        else:
+            counts['processing'] = len(batch['requests'])
+        return {
+            'id': batch_id, 'type': 'message_batch',
+            'processing_status': 'ended' if ended else 'in_progress',
+            'request_counts': counts,
+            'created_at': _iso(batch['created']), 'expires_at': _iso(batch['created'] + 86400),
+            'ended_at': _iso(ended_at) if ended else None,
+            'cancel_initiated_at': None, 'archived_at': None,
+            'results_url': f"{request.url.origin()}/v1/messages/batches/{batch_id}/results" if ended else None,
+        }
+
+    async def create_batch(request):
+        payload = await request.json()
+        stats['batches'] += 1
+        stats['batch_requests'] += len(payload.get('requests', []))
+        batch_id = f"msgbatch_stub_{stats['batches']:04d}"
+        batches[batch_id] = {'created': time.time(), 'requests': payload.get('requests', []), 'results': None}
+        return web.json_response(batch_object(request, batch_id))
+
+    async def retrieve_batch(request):
+        batch_id = request.match_info['batch_id']
+        if batch_id not in batches:
+            return web.json_response({'type': 'error', 'error': {'type': 'not_found_error', 'message': batch_id}}, status=404)
+        return web.json_response(batch_object(request, batch_id))
+
+    async def batch_results(request):
+        batch_id = request.match_info['batch_id']
+        batch = batches.get(batch_id)
+        if batch is None or batch['results'] is None:
+            return web.json_response({'type': 'error', 'error': {'type': 'not_found_error', 'message': batch_id}}, status=404)
+        body = ''.join(json.dumps(entry) + '\n' for entry in batch['results'])
+        return web.Response(text=body, content_type='application/binary')
+
+    app[STATS] = stats
+    app.router.add_post('/v1/messages', messages)
+    app.router.add_post('/v1/messages/batches', create_batch)
+    app.router.add_get('/v1/messages/batches/{batch_id}', retrieve_batch)
+    app.router.add_get('/v1/messages/batches/{batch_id}/results', batch_results)
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a local provider API stub.')
+    parser.add_argument('service', choices=['recraft', 'ollama', 'anthropic', 'imagekit'])
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests failing with 5xx')
+    parser.add_argument('--generic-rate', type=float, default=0.0, help='fraction of model answers that are placeholder text')
+    parser.add_argument('--latency', type=float, default=None,
+                        help='seconds per successful request (recraft: 0.2, anthropic: 0.3, imagekit: 0.1)')
+    recraft = parser.add_argument_group('recraft')
+    recraft.add_argument('--ceiling-rps', type=float, default=5.0, help='requests/sec before 429s (0 = unlimited)')
+    recraft.add_argument('--retry-after', type=int, default=1, help='Retry-After seconds sent with 429s')
+    recraft.add_argument('--asset-bytes', type=int, default=2048, help='size of each generated SVG served under /assets')
+    ollama = parser.add_argument_group('ollama')
+    ollama.add_argument('--num-parallel', type=int, default=4, help='concurrent generations (OLLAMA_NUM_PARALLEL)')
+    ollama.add_argument('--token-rate', type=float, default=200.0, help='generated tokens/sec per request')
+    ollama.add_argument('--prompt-rate', type=float, default=20000.0, help='prompt chars evaluated/sec')
+    ollama.add_argument('--ramble-tokens', type=int, default=0, help='extra tokens streamed after the JSON answer')
+    claude = parser.add_argument_group('anthropic')
+    claude.add_argument('--input-rate', type=float, default=50000.0, help='uncached input chars processed/sec')
+    claude.add_argument('--cache-ttl', type=float, default=300.0, help='seconds a cached prefix stays warm')
+    claude.add_argument('--batch-latency', type=float, default=2.0, help='seconds until a message batch ends')
+    args = parser.parse_args(argv)
+    if args.service == 'recraft':
+        latency = 0.2 if args.latency is None else args.latency
+        app = make_recraft_app(latency, args.ceiling_rps, args.error_rate, args.retry_after, args.asset_bytes)
+    elif args.service == 'imagekit':
+        latency = 0.1 if args.latency is None else args.latency
+        app = make_imagekit_app(latency, args.error_rate)
+    elif args.service == 'anthropic':
+        latency = 0.3 if args.latency is None else args.latency
+        app = make_anthropic_app(latency, args.input_rate, args.error_rate, args.cache_ttl,
+                                 args.generic_rate, args.batch_latency)
+    else:
+        app = make_ollama_app(args.num_parallel, args.token_rate, args.prompt_rate, args.ramble_tokens, args.error_rate,
+                              args.generic_rate)
+    print(f"[STUB] {args.service} listening on http://127.0.0.1:{args.port}")
+    web.run_app(app, host='127.0.0.1', port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
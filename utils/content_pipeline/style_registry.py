@@ -0,0 +1,96 @@
+"""
+Module: style_registry
+Named Recraft styles (name -> style id + metadata) in one append-only JSON-lines log, so the
+image scripts look styles up by name instead of loading a timestamped JSON file per style.
+
+- One JSON object per line: {"name", "id", "style", "registered_at", ...metadata}. Registering a
+  style appends a line; the last line for a name wins, so re-creating a style is a plain append
+  and the log stays diff-friendly in git.
+- Loaded lazily: nothing is read until the first lookup, then the whole log is indexed in memory
+  once (a dict by name), so every later lookup is a dict hit.
+- resolve() accepts a registered name or a raw Recraft style id (UUID), which lets a frontmatter
+  field or a directory map name either.
+
+Usage:
+    registry = StyleRegistry(Path(__file__).parent / 'styles-registry-recraft.jsonl')
+    registry.register('lossless', '73a249b2-...', style='digital_illustration', images=[...])
+    style_id = registry.resolve('lossless')
+"""
+
+import os
+import re
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+# A raw Recraft style id, usable without registering it first
+STYLE_ID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$', re.IGNORECASE)
+
+
+class StyleRegistry:
+    """
+    Append-only style log with a lazily built in-memory index. Not thread-safe; one per process.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._styles = None
+
+    @property
+    def styles(self):
+        """name -> latest record, read from the log on first access."""
+        if self._styles is None:
+            self._styles = {}
+            if self.path.exists():
+                with self.path.open('r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            record = json.loads(line)
+                        except json.JSONDecodeError:
+                            # Truncated last line from an interrupted append
+                            continue
+                        self._styles[record['name']] = record
+        return self._styles
+
+    def get(self, name):
+        """The latest record registered under `name`, or None."""
+        return self.styles.get(name)
+
+    def names(self):
+        return sorted(self.styles)
+
+    def resolve(self, name_or_id):
+        """
+        Style id for a registered name, or the value itself if it already is a style id.
+        Raises LookupError (listing the known names) for anything else.
+        """
+        record = self.styles.get(name_or_id)
+        if record is not None:
+            return record['id']
+        if STYLE_ID_PATTERN.match(name_or_id or ''):
+            return name_or_id
+        raise LookupError(f"unknown style {name_or_id!r} (registered: {', '.join(self.names()) or 'none'})")
+
+    def register(self, name, style_id, **metadata):
+        """Appends a record for `name` (replacing any earlier one) and returns it."""
+        record = {
+            'name': name,
+            'id': style_id,
+            'registered_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            **metadata,
+        }
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('a', encoding='utf-8') as f:
+            f.write(json.dumps(record, sort_keys=True) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        self.styles[name] = record
+        return record
+
+    def compact(self):
+        """Rewrites the log with one line per name (temp file + rename, never half-written)."""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with tmp_path.open('w', encoding='utf-8') as f:
+            for name in self.names():
+                f.write(json.dumps(self.styles[name], sort_keys=True) + '\n')
+        os.replace(tmp_path, self.path)
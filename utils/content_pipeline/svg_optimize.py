@@ -0,0 +1,171 @@
+"""
+Module: svg_optimize
+Post-generation optimization for vector assets: a minified SVG plus PNG derivatives at a few
+widths (responsive srcset / thumbnails), run in a process pool so the event loop never waits on it.
+
+- minify_svg() is plain text processing, safe for the path-based SVGs the image APIs return:
+  drops the XML prolog, DOCTYPE, comments, <metadata> and editor (Inkscape/Sodipodi) attributes,
+  rounds coordinates in geometry attributes to PRECISION decimals and collapses whitespace
+  (whitespace between tags is kept if the SVG has <text>, where it can be visible).
+- render_png() needs `cairosvg` (listed in python-requirements.txt, plus the system cairo library).
+  It stays an optional import: without it, optimize_asset() produces the minified SVG only, so
+  callers get no PNG variants (no srcset), and says so once per worker.
+- optimize_asset() is the process-pool entry point: it reads one stored asset and writes its
+  variants next to it, returning a description of each (variant suffix, ext, width, height, size).
+- AssetOptimizer wraps a ProcessPoolExecutor for async callers.
+
+Usage:
+    optimizer = AssetOptimizer(widths=(480, 960, 1440), processes=4)
+    variants = await optimizer.optimize(path, digest, out_dir)
+    optimizer.close()
+"""
+
+import os
+import re
+import asyncio
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from .log import get_logger
+
+PRECISION = 3
+MINIFIED_VARIANT = '.min'
+
+_PROLOG = re.compile(r'<\?xml[^>]*\?>|<!DOCTYPE[^>]*>', re.IGNORECASE)
+_COMMENT = re.compile(r'<!--.*?-->', re.DOTALL)
+_METADATA = re.compile(r'<metadata\b[^>]*/>|<metadata\b.*?</metadata>', re.DOTALL | re.IGNORECASE)
+_EDITOR_ATTR = re.compile(r'\s(?:xmlns:)?(?:inkscape|sodipodi)(?::[\w-]+)?="[^"]*"')
+_EDITOR_ELEMENT = re.compile(r'<sodipodi:namedview\b[^>]*/>|<sodipodi:namedview\b.*?</sodipodi:namedview>', re.DOTALL)
+_BETWEEN_TAGS = re.compile(r'>\s+<')
+_GEOMETRY_ATTR = re.compile(
+    r'(\s(?:d|points|transform|viewBox|x|y|x1|y1|x2|y2|cx|cy|r|rx|ry|width|height|stroke-width|offset)=")([^"]*)(")'
+)
+_NUMBER = re.compile(r'-?(?:\d+\.\d*|\.\d+)(?:[eE][-+]?\d+)?')
+_ROOT_TAG = re.compile(r'<svg\b[^>]*>', re.IGNORECASE)
+_LENGTH = re.compile(r'^\s*([\d.]+)\s*(?:px)?\s*$')
+
+log = get_logger('svg-optimize')
+
+# One "no rasterizer" notice per worker process
+_warned = False
+
+
+def _round_number(match):
+    text = f"{float(match.group()):.{PRECISION}f}".rstrip('0').rstrip('.')
+    return '0' if text in ('-0', '') else text
+
+
+def _compact_value(match):
+    value = _NUMBER.sub(_round_number, match.group(2))
+    value = re.sub(r'\s*,\s*', ',', re.sub(r'\s+', ' ', value.strip()))
+    return match.group(1) + value + match.group(3)
+
+
+def minify_svg(svg):
+    """Returns a smaller, equivalent rendering of an SVG document (see the module notes)."""
+    svg = _PROLOG.sub('', svg)
+    svg = _COMMENT.sub('', svg)
+    svg = _METADATA.sub('', svg)
+    svg = _EDITOR_ELEMENT.sub('', svg)
+    svg = _EDITOR_ATTR.sub('', svg)
+    svg = _GEOMETRY_ATTR.sub(_compact_value, svg)
+    if '<text' not in svg:
+        svg = _BETWEEN_TAGS.sub('><', svg)
+    return svg.strip() + '\n'
+
+
+def svg_dimensions(svg):
+    """(width, height) of the root <svg> from its width/height attributes or viewBox, or None."""
+    root = _ROOT_TAG.search(svg)
+    if not root:
+        return None
+    attrs = dict(re.findall(r'([\w:-]+)="([^"]*)"', root.group()))
+    width = _LENGTH.match(attrs.get('width', ''))
+    height = _LENGTH.match(attrs.get('height', ''))
+    if width and height:
+        return float(width.group(1)), float(height.group(1))
+    box = attrs.get('viewBox', '').replace(',', ' ').split()
+    if len(box) == 4:
+        try:
+            return float(box[2]), float(box[3])
+        except ValueError:
+            return None
+    return None
+
+
+def raster_backend():
+    """The cairosvg module, or None if it (or the cairo library behind it) is not installed."""
+    try:
+        import cairosvg
+    except (ImportError, OSError):
+        return None
+    return cairosvg
+
+
+def render_png(svg, width, height, out_path, backend):
+    backend.svg2png(bytestring=svg.encode('utf-8'), write_to=str(out_path), output_width=width, output_height=height)
+
+
+def optimize_asset(src_path, digest, out_dir, widths):
+    """
+    Process-pool entry point. Writes <digest>.min.svg and <digest>-<w>w.png for each width into
+    `out_dir` (the source is vector, so any width works; only its aspect ratio is used), reusing
+    existing outputs. Returns {'variant', 'ext', 'content_type', 'width', 'height', 'size'} per
+    file, minified SVG first.
+    """
+    global _warned
+    out_dir = Path(out_dir)
+    svg = Path(src_path).read_text(encoding='utf-8')
+    minified = minify_svg(svg)
+    dimensions = svg_dimensions(minified)
+    min_path = out_dir / f"{digest}{MINIFIED_VARIANT}.svg"
+    if not min_path.exists():
+        tmp_path = min_path.with_name(min_path.name + f".{os.getpid()}.tmp")
+        tmp_path.write_text(minified, encoding='utf-8')
+        os.replace(tmp_path, min_path)
+    variants = [{
+        'variant': MINIFIED_VARIANT, 'ext': 'svg', 'content_type': 'image/svg+xml',
+        'width': round(dimensions[0]) if dimensions else None,
+        'height': round(dimensions[1]) if dimensions else None,
+        'size': min_path.stat().st_size,
+    }]
+    if not widths or dimensions is None:
+        return variants
+    backend = raster_backend()
+    if backend is None:
+        if not _warned:
+            log.warning('optimize', "cairosvg not installed: writing minified SVGs only (pip install cairosvg for PNG derivatives)")
+            _warned = True
+        return variants
+    source_width, source_height = dimensions
+    for width in sorted(set(widths)):
+        height = max(1, round(width * source_height / source_width))
+        variant = f"-{width}w"
+        out_path = out_dir / f"{digest}{variant}.png"
+        if not out_path.exists():
+            tmp_path = out_path.with_name(out_path.name + f".{os.getpid()}.tmp")
+            render_png(minified, width, height, tmp_path, backend)
+            os.replace(tmp_path, out_path)
+        variants.append({
+            'variant': variant, 'ext': 'png', 'content_type': 'image/png',
+            'width': width, 'height': height, 'size': out_path.stat().st_size,
+        })
+    return variants
+
+
+class AssetOptimizer:
+    """Runs optimize_asset() in a process pool; optimize() is awaitable and never blocks the loop."""
+
+    def __init__(self, widths=(480, 960, 1440), processes=None):
+        self.widths = tuple(widths)
+        self.pool = ProcessPoolExecutor(max_workers=processes or min(4, os.cpu_count() or 1))
+        self.optimized = 0
+
+    async def optimize(self, path, digest, out_dir):
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self.pool, optimize_asset, str(path), digest, str(out_dir), self.widths)
+        self.optimized += 1
+        return variants
+
+    def close(self):
+        self.pool.shutdown(wait=True)
@@ -0,0 +1,179 @@
+"""
+Module: writes
+Crash-safe file writes for the content-mutating scripts, plus a dry-run diff mode.
+
+- Every write goes to a temp file in the same directory and is moved over the original with
+  os.replace, so a crash or a concurrent run can never leave a truncated essay behind.
+- fsync is batched: staged temp files are fsynced, renamed and their directories fsynced
+  together once `batch_size` writes are pending (and at close()). A crash before a flush
+  loses only the not-yet-renamed updates; the originals stay intact. A failed fsync or rename
+  drops the rest of its batch (temp files removed) after committing the files already renamed.
+- write_async() runs the write in a small thread pool, so async callers never block the event loop.
+- dry_run=True writes nothing and prints a unified diff of the frontmatter change instead.
+
+Usage:
+    writer = BatchedWriter(dry_run=args.dry_run)
+    writer.write(path, fm.render(), before=fm.original_block(), after=fm.block())
+    ...
+    writer.close()
+"""
+
+import os
+import sys
+import asyncio
+import difflib
+import tempfile
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+
+def frontmatter_diff(path, before, after):
+    """Unified diff between two versions of a frontmatter block (or any text)."""
+    name = str(path).lstrip('/')
+    return ''.join(difflib.unified_diff(
+        before.splitlines(keepends=True), after.splitlines(keepends=True),
+        fromfile=f"a/{name}", tofile=f"b/{name}",
+    ))
+
+
+class BatchedWriter:
+    """
+    Atomic temp-file + rename writer with batched fsync and an optional dry-run mode.
+    Thread-safe; write_async() uses an internal thread pool of `max_workers` threads.
+    """
+
+    def __init__(self, dry_run=False, batch_size=32, fsync=True, max_workers=4, out=None):
+        self.dry_run = dry_run
+        self.batch_size = max(1, batch_size)
+        self.fsync = fsync
+        self.max_workers = max_workers
+        self.out = out or sys.stdout
+        self.written = 0
+        self.diffs = 0
+        self._pending = []
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def write(self, path, text, before=None, after=None, on_commit=None):
+        """
+        Replaces `path` with `text` atomically (or prints a diff in dry-run mode).
+        `before`/`after` are the frontmatter blocks to diff; without them the whole file is diffed.
+        `on_commit` is called once the new content has been renamed into place.
+        """
+        path = Path(path)
+        if self.dry_run:
+            if before is None or after is None:
+                before, after = path.read_text(encoding='utf-8'), text
+            diff = frontmatter_diff(path, before, after)
+            with self._lock:
+                self.diffs += 1
+                self.out.write(diff or f"[DRY RUN] no change: {path}\n")
+            return
+        staged = self._stage(path, text)
+        with self._lock:
+            self._pending.append((staged, path, on_commit))
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def _stage(self, path, text):
+        """Writes `text` to a temp file next to `path`, with the original's permissions. Returns (fd, tmp_path)."""
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix='.tmp', dir=path.parent)
+        try:
+            os.write(fd, text.encode('utf-8'))
+            try:
+                os.fchmod(fd, os.stat(path).st_mode & 0o7777)
+            except (FileNotFoundError, AttributeError):
+                pass
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp_path)
+            raise
+        return fd, tmp_path
+
+    def flush(self):
+        """
+        fsyncs every staged temp file, renames them into place, then fsyncs each touched directory once.
+        If an fsync or rename fails, the files already renamed still get their on_commit, the rest of
+        the batch is dropped (temp files closed and removed, originals untouched) and the error raised.
+        """
+        with self._lock:
+            batch, self._pending = self._pending, []
+        if not batch:
+            return
+        directories = set()
+        callbacks = []
+        closed = renamed = 0
+        try:
+            for (fd, tmp_path), path, on_commit in batch:
+                try:
+                    if self.fsync:
+                        os.fsync(fd)
+                finally:
+                    closed += 1
+                    os.close(fd)
+                os.replace(tmp_path, path)
+                renamed += 1
+                directories.add(path.parent)
+                if on_commit is not None:
+                    callbacks.append(on_commit)
+            if self.fsync and hasattr(os, 'O_DIRECTORY'):
+                for directory in directories:
+                    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+        finally:
+            # After a failure the files before it are in place (and committed), the rest never will be
+            for index in range(renamed, len(batch)):
+                (fd, tmp_path), _, _ = batch[index]
+                self._discard(fd if index >= closed else None, tmp_path)
+            with self._lock:
+                self.written += renamed
+            for callback in callbacks:
+                callback()
+
+    @staticmethod
+    def _discard(fd, tmp_path):
+        """Closes (if still open) and removes a staged temp file that will never be renamed."""
+        try:
+            if fd is not None:
+                os.close(fd)
+        except OSError:
+            pass
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+
+    async def write_async(self, path, text, before=None, after=None, on_commit=None, on_commit_in_thread=None):
+        """
+        write() on the writer's thread pool. `on_commit` is handed back to the calling
+        event loop, so it may safely touch loop-owned state (e.g. the run manifest).
+        `on_commit_in_thread` runs on the writer thread right after the rename instead, for
+        thread-safe callbacks that block (the job queue's done() is a SQLite commit).
+        """
+        loop = asyncio.get_running_loop()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='writer')
+        callback = None
+        if on_commit is not None or on_commit_in_thread is not None:
+            def callback():
+                if on_commit_in_thread is not None:
+                    on_commit_in_thread()
+                if on_commit is not None:
+                    loop.call_soon_threadsafe(on_commit)
+        await loop.run_in_executor(self._executor, lambda: self.write(path, text, before, after, callback))
+
+    def close(self):
+        """Flushes any pending writes and stops the thread pool."""
+        self.flush()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def aclose(self):
+        """close() without blocking the event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
@@ -0,0 +1,55 @@
+import sys
+import shutil
+import importlib.util
+from pathlib import Path
+from contextlib import asynccontextmanager
+
+import pytest
+
+# The shared helpers are imported as `content_pipeline`, the way the scripts do it (ai-labs/utils on the path)
+AI_LABS = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(AI_LABS / 'utils'))
+
+
+def _load(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def load_script(tmp_path):
+    """
+    load_script('apis/recraft/generate-banner-and-portrait-images-recraft.py') imports a (hyphenated)
+    script as a module. The script is copied into a minimal monorepo under tmp_path first (package.json,
+    tidyverse/, ai-labs/...), so scripts that look for the monorepo root at import time find one there.
+    """
+    root = tmp_path / 'monorepo'
+    (root / 'tidyverse').mkdir(parents=True)
+    (root / 'package.json').write_text('{}\n')
+
+    def load(relative):
+        target = root / 'ai-labs' / relative
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(AI_LABS / relative, target)
+        return _load(target, Path(relative).stem.replace('-', '_'))
+
+    return load
+
+
+@asynccontextmanager
+async def _serve(app):
+    from aiohttp.test_utils import TestServer
+    server = TestServer(app, host='127.0.0.1')
+    await server.start_server()
+    try:
+        yield str(server.make_url('')).rstrip('/')
+    finally:
+        await server.close()
+
+
+@pytest.fixture
+def stub_server():
+    """`async with stub_server(stubs.make_recraft_app(...)) as base_url:` runs a stub in the test's event loop."""
+    return _serve
@@ -0,0 +1,128 @@
+"""ask-cascade live and --batch modes against the Anthropic Messages / Message Batches stub (stubs.py)."""
+
+import asyncio
+import itertools
+from pathlib import Path
+
+import anthropic
+import pytest
+
+from content_pipeline import stubs
+from content_pipeline.jobs import JobQueue
+from content_pipeline.metrics import RunMetrics
+from content_pipeline.frontmatter import Frontmatter
+
+FILES = 6
+
+
+@pytest.fixture
+def cascade(load_script, monkeypatch, tmp_path):
+    monkeypatch.setenv('ANTHROPIC_API_KEY', 'test')
+    monkeypatch.setenv('CONTENT_LOG_LEVEL', 'warning')
+    module = load_script('apis/msty/ask-cascade-to-perform-prompt-for-dir.py')
+    monkeypatch.setattr(module, 'metrics', RunMetrics(None))
+    monkeypatch.setattr(module, 'DEFAULT_INDEX_PATH', tmp_path / 'index.sqlite3')
+    prompt = tmp_path / 'prompt.md'
+    prompt.write_text('You are a copywriter.\n')
+    monkeypatch.setattr(module, 'PROMPT_PATH', str(prompt))
+    return module
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    target = tmp_path / 'corpus'
+    target.mkdir()
+    for n in range(FILES):
+        (target / f"essay-{n}.md").write_text(f"---\ntitle: Essay {n}\nlede: ''\n---\n\n# Essay {n}\n\nSome notes on graphs.\n")
+    return target
+
+
+def use_stub(cascade, monkeypatch, base_url):
+    # A client per test: the module's own is bound to the event loop of its first request
+    monkeypatch.setattr(cascade, 'client', anthropic.AsyncAnthropic(api_key='test', base_url=base_url, max_retries=0))
+
+
+def filled(path):
+    frontmatter = Frontmatter.parse(path.read_text(encoding='utf-8'))
+    return bool(frontmatter.get('lede')) and bool(frontmatter.get('image_prompt'))
+
+
+def test_live_fill_caches_the_system_block_and_fails_only_bad_files(cascade, corpus, stub_server, monkeypatch):
+    # Not UTF-8: parse_frontmatter raises, which must fail this file and nothing else
+    bad = corpus / 'broken.md'
+    bad.write_bytes(b"---\ntitle: x\n---\n\xff\xfe\n")
+    app = stubs.make_anthropic_app(latency=0.01)
+    jobs = JobQueue('cascade', path=None)
+    jobs.enqueue_many((path, cascade.REQUIRED_FIELDS) for path in sorted(corpus.glob('*.md')))
+
+    async def run():
+        async with stub_server(app) as base_url:
+            use_stub(cascade, monkeypatch, base_url)
+            writer = cascade.BatchedWriter()
+            try:
+                await cascade.process_dir(cascade.build_system_blocks('You are a copywriter.'), writer, 4, jobs)
+            finally:
+                await writer.aclose()
+                await cascade.client.close()
+
+    asyncio.run(run())
+
+    assert all(filled(path) for path in corpus.glob('essay-*.md'))
+    assert jobs.counts() == {'pending': 0, 'in_flight': 0, 'done': 2 * FILES, 'failed': 2}
+    assert {path for path, *_ in jobs.failures()} == {str(bad)}
+    # The first request writes the cached system block; every other file reads it
+    assert app[stubs.STATS]['cache_writes'] == 1
+    assert app[stubs.STATS]['cache_reads'] == FILES - 1
+    assert cascade.usage_totals['cache_read_input_tokens'] > 0
+
+
+def run_batch(cascade, monkeypatch, stub_server, app, corpus, state_path, before=None):
+    async def run():
+        async with stub_server(app) as base_url:
+            use_stub(cascade, monkeypatch, base_url)
+            if before is not None:
+                await before()
+            await cascade.run_batch_mode(str(corpus), state_path=str(state_path), poll_seconds=0.05)
+
+    asyncio.run(run())
+
+
+def test_batch_state_defaults_next_to_the_script(cascade):
+    assert Path(cascade.BATCH_STATE_PATH).parent == Path(cascade.__file__).parent
+
+
+def test_batch_mode_applies_results_and_clears_its_state(cascade, corpus, stub_server, monkeypatch, tmp_path):
+    app = stubs.make_anthropic_app(latency=0.01, batch_latency=0.1)
+    state_path = tmp_path / 'batch-state.json'
+    run_batch(cascade, monkeypatch, stub_server, app, corpus, state_path)
+    assert all(filled(path) for path in corpus.glob('*.md'))
+    assert (app[stubs.STATS]['batches'], app[stubs.STATS]['batch_requests'], app[stubs.STATS]['requests']) == (1, FILES, 0)
+    assert not state_path.exists()
+
+
+def test_batch_mode_resumes_the_persisted_batch(cascade, corpus, stub_server, monkeypatch, tmp_path):
+    app = stubs.make_anthropic_app(latency=0.01, batch_latency=0.1)
+    state_path = tmp_path / 'batch-state.json'
+
+    async def submit_then_stop():
+        # A run that created its batch and was killed before polling it
+        items = cascade.collect_batch_items(str(corpus))
+        await cascade.submit_batch(items, cascade.build_system_blocks('You are a copywriter.'), str(state_path), attempt=1)
+        assert state_path.exists()
+
+    run_batch(cascade, monkeypatch, stub_server, app, corpus, state_path, before=submit_then_stop)
+    assert all(filled(path) for path in corpus.glob('*.md'))
+    assert app[stubs.STATS]['batches'] == 1
+    assert not state_path.exists()
+
+
+def test_batch_mode_resubmits_errored_results(cascade, corpus, stub_server, monkeypatch, tmp_path):
+    app = stubs.make_anthropic_app(latency=0.01, batch_latency=0.1, error_rate=0.5)
+    # The first result drawn errors, every later draw succeeds with a usable answer
+    draws = itertools.chain([0.0], itertools.repeat(0.9))
+    monkeypatch.setattr(stubs.random, 'random', lambda: next(draws))
+    state_path = tmp_path / 'batch-state.json'
+    run_batch(cascade, monkeypatch, stub_server, app, corpus, state_path)
+    assert all(filled(path) for path in corpus.glob('*.md'))
+    assert (app[stubs.STATS]['batches'], app[stubs.STATS]['batch_requests']) == (2, FILES + 1)
+    assert not state_path.exists()
@@ -0,0 +1,93 @@
+"""Lossless frontmatter parser (content_pipeline/frontmatter.py): round-trips and minimal edits."""
+
+import pytest
+
+from content_pipeline.frontmatter import Frontmatter
+
+BODY = "\n# Graphs\n\nA rule below is body text, not frontmatter.\n\n---\n\nlede: not a key\n"
+DOCUMENTS = {
+    'plain': "---\ntitle: Graphs\nlede: ''\n---\n" + BODY,
+    'crlf': "---\r\ntitle: Graphs\r\nlede: ''\r\n---\r\n" + BODY.replace('\n', '\r\n'),
+    'block list': "---\ntitle: Graphs\ntags:\n  - graphs\n  - notes\n- loose item\nlede: Set\n---\n" + BODY,
+    'quoted colons': "---\ntitle: 'Graphs: a primer'\nsubtitle: \"It's: quoted\"\nurl: https://example.com/a:b\n---\n" + BODY,
+    'comments and blanks': "---\n# generated\n\ntitle:   spaced   \nempty:\n---\n",
+    'no trailing newline': "---\ntitle: Graphs\n---",
+    'block scalar': "---\nsummary: >\n  Folded over\n  two lines.\ntitle: Graphs\n---\n" + BODY,
+}
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_untouched_document_renders_unchanged(name):
+    text = DOCUMENTS[name]
+    frontmatter = Frontmatter.parse(text)
+    assert frontmatter.render() == text
+    assert not frontmatter.dirty
+    assert frontmatter.block() == frontmatter.original_block()
+
+
+@pytest.mark.parametrize('name', DOCUMENTS)
+def test_setting_a_new_key_only_adds_its_line(name):
+    text = DOCUMENTS[name]
+    frontmatter = Frontmatter.parse(text)
+    frontmatter.set('image_prompt', 'A lighthouse over a knowledge graph')
+    newline = frontmatter.newline
+    lines = frontmatter.original_block().splitlines(keepends=True)
+    expected = lines[:-1] + [f"image_prompt: A lighthouse over a knowledge graph{newline}"] + lines[-1:]
+    assert frontmatter.block() == ''.join(expected)
+    assert frontmatter.render() == ''.join(expected) + frontmatter.body
+    assert Frontmatter.parse(frontmatter.render()).get('image_prompt') == 'A lighthouse over a knowledge graph'
+
+
+def test_crlf_is_kept_for_new_and_changed_lines():
+    frontmatter = Frontmatter.parse(DOCUMENTS['crlf'])
+    assert frontmatter.newline == '\r\n'
+    frontmatter.set('lede', 'Graphs, briefly.')
+    frontmatter.set('image_prompt', 'A lighthouse')
+    assert frontmatter.render() == ("---\r\ntitle: Graphs\r\nlede: 'Graphs, briefly.'\r\nimage_prompt: A lighthouse\r\n---\r\n"
+                                    + BODY.replace('\n', '\r\n'))
+
+
+def test_block_list_lines_belong_to_their_key():
+    frontmatter = Frontmatter.parse(DOCUMENTS['block list'])
+    assert frontmatter.keys() == ['title', 'tags', 'lede']
+    assert frontmatter.get('lede') == 'Set'
+    # Overwriting the list with a scalar drops its item lines; the keys after it still resolve
+    frontmatter.set('tags', 'graphs')
+    assert frontmatter.block() == "---\ntitle: Graphs\ntags: graphs\nlede: Set\n---\n"
+    frontmatter.set('lede', 'Changed')
+    assert frontmatter.block() == "---\ntitle: Graphs\ntags: graphs\nlede: Changed\n---\n"
+    # A block scalar written by another tool reads as one folded string
+    assert Frontmatter.parse(DOCUMENTS['block scalar']).get('summary') == 'Folded over two lines.'
+
+
+def test_quoted_values_with_colons():
+    frontmatter = Frontmatter.parse(DOCUMENTS['quoted colons'])
+    assert frontmatter.get('title') == 'Graphs: a primer'
+    assert frontmatter.get('subtitle') == "It's: quoted"
+    assert frontmatter.get('url') == 'https://example.com/a:b'
+    frontmatter.set('lede', 'Graphs: what they are')
+    frontmatter.set('image_prompt', "An editor's desk: cards and string")
+    frontmatter.set('banner_image', 'https://cdn.example.com/a:b.png')
+    reparsed = Frontmatter.parse(frontmatter.render())
+    assert reparsed.raw('lede') == "'Graphs: what they are'"
+    assert reparsed.raw('image_prompt') == '"An editor\'s desk: cards and string"'
+    assert reparsed.get('lede') == 'Graphs: what they are'
+    assert reparsed.get('image_prompt') == "An editor's desk: cards and string"
+    assert reparsed.get('banner_image') == 'https://cdn.example.com/a:b.png'
+
+
+def test_setting_the_same_value_changes_nothing():
+    frontmatter = Frontmatter.parse(DOCUMENTS['quoted colons'])
+    frontmatter.set('title', 'Graphs: a primer')
+    assert not frontmatter.dirty
+    assert frontmatter.render() == DOCUMENTS['quoted colons']
+
+
+def test_file_without_a_closing_delimiter_is_not_frontmatter():
+    text = "---\ntitle: Graphs\n\n# Graphs\n\nNo closing line.\n"
+    assert Frontmatter.parse(text) is None
+    assert Frontmatter.parse("# Graphs\n---\n") is None
+    # The scripts' fallback puts a new block in front and keeps the whole text as the body
+    frontmatter = Frontmatter.empty(text)
+    frontmatter.set('lede', 'Graphs')
+    assert frontmatter.render() == "---\nlede: Graphs\n---\n" + text
@@ -0,0 +1,30 @@
+"""Generic-output detector (content_pipeline/generic.py): check_many() agrees with check()."""
+
+import random
+
+from content_pipeline.generic import GenericDetector, PATTERNS_DIR
+
+VALUES = ['A vivid lede about graphs', 'TBD', 'lede: ...', None, '', '{"lede": "x"}', 'a lorem here',
+          'ipsum there', 'Example image of a lighthouse', 'This is a placeholder.', 'lorem and ipsum']
+
+
+def assert_agrees(detector, values):
+    assert detector.check_many(values) == [detector.check(value) for value in values]
+
+
+def test_regex_pattern_never_matches_across_candidates():
+    detector = GenericDetector(['re:lorem.*ipsum'])
+    assert detector.check_many(['a lorem here', 'ipsum there']) == [None, None]
+    assert detector.check_many(['a lorem here', 'lorem and ipsum']) == [None, "matched 're:lorem.*ipsum'"]
+
+
+def test_check_many_agrees_with_check():
+    rng = random.Random(7)
+    detectors = [
+        GenericDetector.from_file(PATTERNS_DIR / 'claude.txt', min_length=10, reject_prefixes=('{',)),
+        GenericDetector.from_file(PATTERNS_DIR / 'local-model.txt', non_string_is_generic=True),
+        GenericDetector(['tbd', 're:lorem.*ipsum', r're:\.\.\.$', 're:(?<=ere) '], min_length=3),
+    ]
+    for detector in detectors:
+        for _ in range(200):
+            assert_agrees(detector, rng.choices(VALUES, k=rng.randint(0, 6)))
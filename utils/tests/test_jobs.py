@@ -0,0 +1,218 @@
+"""Durable job queue (content_pipeline/jobs.py): claims, leases, reclaim and re-queueing."""
+
+import sqlite3
+import sys
+import time
+import asyncio
+import threading
+import subprocess
+
+from content_pipeline.jobs import JobQueue, queue_name, shard_of
+
+
+def queue_pair(tmp_path, lease_seconds=600.0):
+    # Two workers sharing one jobs file, with ids that orphan reclaim never treats as local pids
+    path = tmp_path / 'jobs.sqlite3'
+    return (JobQueue('t', path=path, lease_seconds=lease_seconds, worker_id='worker-a'),
+            JobQueue('t', path=path, lease_seconds=lease_seconds, worker_id='worker-b'))
+
+
+def drain(jobs):
+    files = 0
+    while (job := jobs.claim()) is not None:
+        jobs.done(job.path)
+        files += 1
+    return files
+
+
+def query_plan(jobs, sql, params):
+    return ' | '.join(row[-1] for row in jobs._db.execute('EXPLAIN QUERY PLAN ' + sql, params))
+
+
+def test_claim_takes_every_field_of_a_file():
+    jobs = JobQueue('t', path=None)
+    jobs.enqueue_many([('/c/a.md', ['lede', 'image_prompt']), ('/c/b.md', ['lede'])])
+    job = jobs.claim()
+    assert (job.path, job.fields, job.attempts) == ('/c/a.md', ['image_prompt', 'lede'], 1)
+    assert jobs.counts()['in_flight'] == 2
+    assert jobs.claim().path == '/c/b.md'
+    assert jobs.claim() is None
+
+
+def test_claims_only_read_pending_rows():
+    # Linear drain: the claim seeks straight to the pending rows, in path order, never walking the
+    # done ones (no scan, no temp b-tree to sort or de-duplicate)
+    jobs = JobQueue('t', path=None)
+    plan = query_plan(jobs, *jobs._pending_query(1))
+    assert 'USING COVERING INDEX jobs_state (queue=? AND state=?)' in plan
+    assert 'TEMP B-TREE' not in plan
+    expired = "SELECT * FROM jobs WHERE queue = ? AND state = 'in_flight' AND lease_until < ?"
+    assert 'USING INDEX jobs_state (queue=? AND state=?)' in query_plan(jobs, expired, ['t', 0.0])
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    a, b = queue_pair(tmp_path, lease_seconds=0.05)
+    a.enqueue_many([('/c/a.md', ['lede'])])
+    assert a.claim().path == '/c/a.md'
+    assert b.claim() is None
+    time.sleep(0.1)
+    job = b.claim()
+    assert (job.path, job.attempts) == ('/c/a.md', 2)
+
+
+def test_renew_keeps_a_lease_and_requeues_expired_ones(tmp_path):
+    a, b = queue_pair(tmp_path, lease_seconds=0.2)
+    a.enqueue_many([('/c/a.md', ['lede']), ('/c/b.md', ['lede'])])
+    a.claim()
+    b.claim()
+    time.sleep(0.25)
+    assert a.renew() == 1
+    # b stopped renewing: a's renew put its task back, a's own stays leased
+    assert a.counts() == {'pending': 1, 'in_flight': 1, 'done': 0, 'failed': 0}
+    assert a.claim().path == '/c/b.md'
+
+
+def test_outcome_of_a_taken_over_task_is_ignored(tmp_path):
+    a, b = queue_pair(tmp_path, lease_seconds=0.05)
+    a.enqueue_many([('/c/a.md', ['lede'])])
+    a.claim()
+    time.sleep(0.1)
+    b.claim()
+    assert a.done('/c/a.md') == 0
+    assert a.fail('/c/a.md', 'late') == 0
+    assert a.release_held() == 0
+    assert a.counts()['in_flight'] == 1
+    assert b.fail('/c/a.md', 'HTTP 503') == 1
+    assert b.failures() == [('/c/a.md', 'lede', 'HTTP 503', 2)]
+
+
+def test_orphans_of_a_dead_local_process_are_reclaimed(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    dead = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                          capture_output=True, text=True, check=True)
+    pid = int(dead.stdout)
+    host = JobQueue('t', path=path).host
+    stopped = JobQueue('t', path=path, worker_id=f"{host}:{pid}")
+    stopped.enqueue_many([('/c/a.md', ['lede', 'image_prompt'])])
+    assert stopped.claim() is not None
+    stopped.close()
+    live = JobQueue('t', path=path)
+    assert live.reclaimed == 2
+    assert live.claim().attempts == 2
+    # A live process's tasks are left alone
+    again = JobQueue('t', path=path)
+    assert again.reclaimed == 0
+    assert again.counts()['in_flight'] == 2
+
+
+def test_enqueue_requeues_finished_tasks_only(tmp_path):
+    a, b = queue_pair(tmp_path)
+    a.enqueue_many([(f"/c/{name}.md", ['lede']) for name in 'abcd'])
+    a.done(a.claim().path)
+    a.fail(a.claim().path, 'generic output')
+    a.claim()
+    # a: done, b: failed, c: in flight, d: pending
+    assert b.enqueue_many([(f"/c/{name}.md", ['lede']) for name in 'abcd'] + [('/c/e.md', ['lede'])]) == 3
+    assert a.counts() == {'pending': 4, 'in_flight': 1, 'done': 0, 'failed': 0}
+    assert b.claim() == ('/c/a.md', ['lede'], 1)
+    assert a.done('/c/c.md') == 1
+
+
+def test_retry_failed_requeues_failures_only():
+    jobs = JobQueue('t', path=None)
+    jobs.enqueue_many([('/c/a.md', ['lede', 'image_prompt']), ('/c/b.md', ['lede'])])
+    job = jobs.claim()
+    jobs.done(job.path, ['lede'])
+    jobs.fail(job.path, 'HTTP 500', ['image_prompt'])
+    jobs.done(jobs.claim().path)
+    assert jobs.retry_failed() == 1
+    job = jobs.claim()
+    assert (job.path, job.fields, job.attempts) == ('/c/a.md', ['image_prompt'], 2)
+    assert jobs.claim() is None
+
+
+def test_queues_of_two_directories_share_a_jobs_file_apart(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    first, second = tmp_path / 'a', tmp_path / 'b'
+    # An interrupted run on a: one file finished, one failed, one left pending
+    interrupted = JobQueue(queue_name('cascade', first), path=path)
+    interrupted.enqueue_many((first / f"{name}.md", ['lede']) for name in 'xyz')
+    interrupted.done(interrupted.claim().path)
+    interrupted.fail(interrupted.claim().path, 'HTTP 500')
+    interrupted.close()
+    # A run on b (named through a relative path) sees none of a's tasks
+    run = JobQueue(queue_name('cascade', tmp_path / 'a' / '..' / 'b'), path=path)
+    assert run.queue == queue_name('cascade', second)
+    run.enqueue_many([(second / 'w.md', ['lede'])])
+    assert run.retry_failed() == 0
+    assert run.counts() == {'pending': 1, 'in_flight': 0, 'done': 0, 'failed': 0}
+    assert drain(run) == 1
+    resumed = JobQueue(queue_name('cascade', first), path=path)
+    assert resumed.counts() == {'pending': 1, 'in_flight': 0, 'done': 1, 'failed': 1}
+    assert resumed.claim().path == str(first / 'z.md')
+
+
+def test_async_calls_run_off_the_event_loop():
+    jobs = JobQueue('t', path=None)
+    jobs.enqueue_many([('/c/a.md', ['lede', 'image_prompt']), ('/c/b.md', ['lede'])])
+    threads = []
+    claim_many = jobs.claim_many
+    jobs.claim_many = lambda limit: threads.append(threading.get_ident()) or claim_many(limit)
+
+    async def run():
+        job = await jobs.aclaim()
+        await jobs.adone(job.path, ['lede'])
+        await jobs.afail(job.path, 'HTTP 500', ['image_prompt'])
+        (job,) = await jobs.aclaim_many(5)
+        await jobs.arelease(job.path)
+
+    asyncio.run(run())
+    assert threads and threading.get_ident() not in threads
+    assert jobs.counts() == {'pending': 1, 'in_flight': 0, 'done': 1, 'failed': 1}
+
+
+def test_shards_split_the_queue(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    files = [f"/corpus/essay-{n:04d}.md" for n in range(300)]
+    parent = JobQueue('t', path=path)
+    parent.enqueue_many((file, ['lede', 'image_prompt']) for file in files)
+    parent.reshard(3)
+    drained = []
+    for index in range(3):
+        shard = JobQueue('t', path=path, shard=(index, 3))
+        claimed = []
+        while (job := shard.claim()) is not None:
+            assert shard_of(job.path, 3) == index
+            claimed.append(job.path)
+            shard.done(job.path)
+        drained.append(claimed)
+    assert sorted(path for claimed in drained for path in claimed) == files
+    assert all(claimed for claimed in drained)
+    assert parent.counts()['done'] == 600
+
+
+def test_sharded_claims_use_the_shard_index():
+    jobs = JobQueue('t', path=None, shard=(1, 4))
+    plan = query_plan(jobs, *jobs._pending_query(1))
+    assert 'USING COVERING INDEX jobs_shard (queue=? AND shard=? AND state=?)' in plan
+    assert 'TEMP B-TREE' not in plan
+    jobs.enqueue_many((f"/corpus/essay-{n:04d}.md", ['lede']) for n in range(400))
+    jobs.reshard(4)
+    assert drain(jobs) == sum(1 for n in range(400) if shard_of(f"/corpus/essay-{n:04d}.md", 4) == 1)
+
+
+def test_jobs_file_from_before_sharding_is_migrated(tmp_path):
+    path = tmp_path / 'jobs.sqlite3'
+    db = sqlite3.connect(str(path))
+    db.executescript("""
+        CREATE TABLE jobs (queue TEXT NOT NULL, path TEXT NOT NULL, field TEXT NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0, worker TEXT,
+            lease_until REAL, error TEXT, updated_at REAL NOT NULL, PRIMARY KEY (queue, path, field));
+        INSERT INTO jobs (queue, path, field, updated_at) VALUES ('t', '/c/a.md', 'lede', 0);
+    """)
+    db.commit()
+    db.close()
+    jobs = JobQueue('t', path=path)
+    jobs.reshard(2)
+    shard = JobQueue('t', path=path, shard=(shard_of('/c/a.md', 2), 2))
+    assert shard.claim().path == '/c/a.md'
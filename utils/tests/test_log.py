@@ -0,0 +1,38 @@
+"""Structured logger (content_pipeline/log.py): lazy fields and Path values."""
+
+import io
+import json
+from pathlib import Path
+
+import pytest
+
+from content_pipeline import log as logging_setup
+
+
+@pytest.fixture
+def output():
+    saved = logging_setup.settings()
+    stream = io.StringIO()
+    logging_setup._config.stream = stream
+    yield stream
+    logging_setup._config.stream = None
+    logging_setup.configure(**saved)
+
+
+def test_suppressed_level_builds_nothing(output):
+    logging_setup.configure(level='info', fmt='text')
+    built = []
+    logging_setup.get_logger('t').debug('update', "{path}: {fields}", path=Path('/c/a.md'),
+                                        fields=lambda: built.append('fields') or ['lede'])
+    assert built == [] and output.getvalue() == ''
+
+
+def test_path_fields_are_formatted_when_emitted(output):
+    log = logging_setup.get_logger('t')
+    logging_setup.configure(level='debug', fmt='text')
+    log.debug('update', "{path}: set {fields}", path=Path('/c/a.md'), fields=lambda: ['lede', 'image_prompt'])
+    assert output.getvalue() == "[UPDATE] /c/a.md: set lede, image_prompt\n"
+    logging_setup.configure(fmt='json')
+    log.info('write', "Updated {path}", path=Path('/c/a.md'))
+    record = json.loads(output.getvalue().splitlines()[-1])
+    assert (record['msg'], record['path']) == ('Updated /c/a.md', '/c/a.md')
@@ -0,0 +1,52 @@
+"""request-local-MSTY-model against the Ollama stub's prompt cache (stubs.py)."""
+
+import asyncio
+
+import pytest
+from aiohttp import web
+
+from content_pipeline import stubs
+
+
+@pytest.fixture
+def msty(load_script, monkeypatch):
+    monkeypatch.setenv('CONTENT_LOG_LEVEL', 'warning')
+    return load_script('apis/msty/request-local-MSTY-model.py')
+
+
+def recording_ollama_app(payloads):
+    app = stubs.make_ollama_app(prompt_rate=1e6, token_rate=1e4)
+
+    @web.middleware
+    async def record(request, handler):
+        payloads.append(await request.json())
+        return await handler(request)
+
+    app.middlewares.append(record)
+    return app
+
+
+def test_shared_prefix_is_reused_through_the_prompt_cache(msty, stub_server, monkeypatch):
+    payloads = []
+    app = recording_ollama_app(payloads)
+    prefix = msty.build_shared_prefix('You are a copywriter. ' * 100)
+    files = [f"# Essay {n}\n\nNotes on graph number {n}." for n in range(4)]
+
+    async def run():
+        async with stub_server(app) as base_url:
+            monkeypatch.setattr(msty, 'LLM_API_URL', base_url)
+            async with msty.make_llm_client(2) as client:
+                counts = await msty.warm_prefix_cache(client, prefix)
+                answers = [await msty.request_completion(client, prefix, msty.build_file_prompt(['lede'], text), text, f"f{n}")
+                           for n, text in enumerate(files)]
+                return counts, answers
+
+    (first, repeat), answers = asyncio.run(run())
+    # The repeat only pays for the last token; the files pay for their own part only
+    assert repeat < first and first >= len(prefix) // 4 - 1
+    assert all(answer.get('lede') for answer in answers)
+    assert app[stubs.STATS]['cached_prompt_chars'] >= (len(files) + 1) * (len(prefix) - 1)
+    # Every request is a self-contained prompt: the full prefix, never Ollama's deprecated `context`
+    requests = payloads[2:]
+    assert [payload['prompt'] for payload in requests] == [prefix + msty.build_file_prompt(['lede'], text) for text in files]
+    assert not any('context' in payload or payload.get('raw') for payload in payloads)
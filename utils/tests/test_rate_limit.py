@@ -0,0 +1,88 @@
+"""Adaptive limiter + Recraft generation against the Recraft stub's server-side ceiling (stubs.py)."""
+
+import time
+import asyncio
+
+import aiohttp
+import pytest
+
+from content_pipeline import stubs
+from content_pipeline.rate_limit import AdaptiveRateLimiter, backoff_delay, parse_retry_after
+
+RETRY_AFTER = 1
+
+
+class RecordingLimiter(AdaptiveRateLimiter):
+    """Keeps the rate after every success/throttle and the time every token was handed out."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rates = []
+        self.throttle_times = []
+        self.acquire_times = []
+
+    async def acquire(self):
+        await super().acquire()
+        self.acquire_times.append(time.monotonic())
+
+    def on_success(self):
+        super().on_success()
+        self.rates.append(('ok', self.rate))
+
+    def on_throttle(self, retry_after=None):
+        self.throttle_times.append(time.monotonic())
+        super().on_throttle(retry_after)
+        self.rates.append(('throttled', self.rate))
+
+
+@pytest.fixture
+def recraft(load_script, monkeypatch):
+    monkeypatch.setenv('RECRAFT_API_TOKEN', 'test')
+    monkeypatch.setenv('CONTENT_LOG_LEVEL', 'warning')
+    return load_script('apis/recraft/generate-banner-and-portrait-images-recraft.py')
+
+
+def test_parse_retry_after():
+    assert parse_retry_after('3') == 3.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('soon') is None
+    assert 0 <= parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') < 1
+
+
+def test_backoff_never_undercuts_retry_after():
+    assert all(backoff_delay(1, base=0.1, retry_after=2.0) >= 2.0 for _ in range(50))
+    assert all(0 <= backoff_delay(4, base=1.0, cap=3.0) <= 3.0 for _ in range(50))
+
+
+def test_limiter_settles_under_the_stub_ceiling(recraft, stub_server, monkeypatch):
+    prompts = [f"a lighthouse over a knowledge graph, variant {n}" for n in range(24)]
+    app = stubs.make_recraft_app(latency=0.01, ceiling_rps=5.0, retry_after=RETRY_AFTER)
+    # Starts at twice the ceiling, so the stub has to push it down
+    limiter = RecordingLimiter(rate=10.0, min_rate=0.5, max_rate=20.0)
+
+    async def run():
+        async with stub_server(app) as base_url:
+            monkeypatch.setattr(recraft, 'RECRAFT_API_URL', base_url + '/v1/images/generations')
+            monkeypatch.setattr(recraft, 'RETRY_BASE_DELAY', 0.1)
+            in_flight = asyncio.Semaphore(8)
+            async with aiohttp.ClientSession() as session:
+                async def generate(prompt):
+                    async with in_flight:
+                        return await recraft.generate_recraft_image_async(prompt, '2048x1024', session, 'style', limiter)
+                return await asyncio.gather(*(generate(prompt) for prompt in prompts))
+
+    urls = asyncio.run(run())
+
+    # No file dropped: every prompt got its own image, each generated exactly once
+    assert len(set(urls)) == len(prompts)
+    assert app[stubs.STATS]['ok'] == len(prompts)
+    assert app[stubs.STATS]['throttled'] > 0
+    assert limiter.throttled == app[stubs.STATS]['throttled']
+    # Retry-After pauses every caller: no token is handed out while a 429's pause runs
+    for throttled_at in limiter.throttle_times:
+        assert not any(throttled_at < acquired < throttled_at + RETRY_AFTER - 0.05 for acquired in limiter.acquire_times)
+    # The rate is cut on 429 and creeps back up on the successes after it
+    lowest = min(rate for _, rate in limiter.rates)
+    assert lowest < 10.0
+    last_throttle = max(i for i, (event, _) in enumerate(limiter.rates) if event == 'throttled')
+    assert limiter.rate > limiter.rates[last_throttle][1]
@@ -0,0 +1,92 @@
+"""Atomic batched writer (content_pipeline/writes.py): renames, commits, failures and the dry-run diff."""
+
+import io
+import os
+
+import pytest
+
+from content_pipeline.frontmatter import Frontmatter
+from content_pipeline.writes import BatchedWriter
+
+ESSAY = "---\ntitle: Graphs\nlede: ''\n---\n\n# Graphs\n\nBody text.\n"
+
+
+@pytest.fixture
+def essays(tmp_path):
+    paths = [tmp_path / f"essay-{n}.md" for n in range(4)]
+    for path in paths:
+        path.write_text(ESSAY, encoding='utf-8')
+    return paths
+
+
+def leftovers(directory):
+    return sorted(path.name for path in directory.iterdir() if path.name.endswith('.tmp'))
+
+
+def test_batch_is_renamed_and_committed_on_flush(essays, tmp_path):
+    committed = []
+    writer = BatchedWriter(batch_size=10)
+    for path in essays:
+        writer.write(path, ESSAY.replace('Body', 'New body'), on_commit=lambda path=path: committed.append(path))
+    assert committed == [] and all(path.read_text() == ESSAY for path in essays)
+    writer.close()
+    assert committed == essays
+    assert all('New body' in path.read_text() for path in essays)
+    assert writer.written == len(essays)
+    assert leftovers(tmp_path) == []
+
+
+def test_failed_rename_commits_the_renamed_and_drops_the_rest(essays, tmp_path, monkeypatch):
+    committed = []
+    writer = BatchedWriter(batch_size=10)
+    for path in essays:
+        writer.write(path, 'new\n', on_commit=lambda path=path: committed.append(path))
+    replace = os.replace
+
+    def failing_replace(src, dst):
+        if str(dst) == str(essays[2]):
+            raise OSError('disk full')
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', failing_replace)
+    with pytest.raises(OSError, match='disk full'):
+        writer.flush()
+    # The first two are in place and their tasks committed; the others keep their original text
+    assert committed == essays[:2]
+    assert [path.read_text() for path in essays] == ['new\n', 'new\n', ESSAY, ESSAY]
+    assert writer.written == 2
+    assert leftovers(tmp_path) == []
+    # Nothing of the failed batch is left to flush again
+    monkeypatch.setattr(os, 'replace', replace)
+    writer.close()
+    assert committed == essays[:2]
+
+
+def test_failed_fsync_closes_and_removes_every_staged_file(essays, tmp_path, monkeypatch):
+    writer = BatchedWriter(batch_size=10)
+    for path in essays:
+        writer.write(path, 'new\n')
+    monkeypatch.setattr(os, 'fsync', lambda fd: (_ for _ in ()).throw(OSError('I/O error')))
+    with pytest.raises(OSError, match='I/O error'):
+        writer.flush()
+    assert all(path.read_text() == ESSAY for path in essays)
+    assert leftovers(tmp_path) == []
+
+
+def test_dry_run_prints_the_frontmatter_diff_and_writes_nothing(essays):
+    out = io.StringIO()
+    writer = BatchedWriter(dry_run=True, out=out)
+    frontmatter = Frontmatter.parse(ESSAY)
+    frontmatter.set('lede', 'Graphs, briefly.')
+    writer.write(essays[0], frontmatter.render(), before=frontmatter.original_block(), after=frontmatter.block())
+    name = str(essays[0]).lstrip('/')
+    assert out.getvalue() == (f"--- a/{name}\n+++ b/{name}\n@@ -1,4 +1,4 @@\n"
+                              " ---\n title: Graphs\n-lede: ''\n+lede: 'Graphs, briefly.'\n ---\n")
+    # Unchanged frontmatter, and a whole-file diff when no blocks are given
+    writer.write(essays[1], ESSAY, before='x: 1\n', after='x: 1\n')
+    writer.write(essays[2], ESSAY.replace('Body', 'New body'))
+    assert f"[DRY RUN] no change: {essays[1]}\n" in out.getvalue()
+    assert '-Body text.\n+New body text.\n' in out.getvalue()
+    writer.close()
+    assert writer.diffs == 3 and writer.written == 0
+    assert all(path.read_text() == ESSAY for path in essays)